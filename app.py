@@ -1,66 +1,71 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
-import csv
+import functools
+import hashlib
 import json
 import os
-from datetime import datetime
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import io
-import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-import requests
 import base64
 import urllib3
 
+import http_client
+from donor_store import CSVDonorStore, SQLiteDonorStore, WriteThroughDonorStore, iter_csv, iter_gzip
+from smtp_pool import SMTPConnectionPool, DeliveryUncertain
+from graph_auth import TokenCache
+from settings_cache import CachedSetting
+from bloomerang_sync import (SyncOutbox, OutboxWorker, TransactionBatcher, TokenBucket, RateLimitedClient,
+                             PermanentSyncError)
+from metrics import Registry, format_gauge
+from donor_search import DonorSearchIndex
+from donor_snapshot import FORMATS as SNAPSHOT_FORMATS, DonorSnapshot
+from reports import INTERVALS, DonationRollups
+from idempotency import IdempotencyStore, REPLAY, IN_PROGRESS, MISMATCH
+from email_templates import TemplateError, compile_template, validate_template
+from receipts import render_receipt
+from batch_receipts import generate_batch
+from jobs import JobStore, JobPipeline, StageSkipped, PermanentStageError, new_job_id
+from bloomerang_index import (ConstituentIndex, IndexRefresher, fetch_constituents_page,
+                              match_constituent, PAGE_SIZE)
+
 # Suppress SSL warnings when verify_ssl is disabled (for local testing)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# Import configuration
+# Import configuration (organization details and the CSV path are shared with the CLI tools)
+from org_config import ORGANIZATION_INFO, CSV_FILE
+
+# Try to import DEBUG and PORT from config, with fallbacks
 try:
-    from config import ORGANIZATION_INFO, CSV_FILE
-    # Try to import DEBUG and PORT from config, with fallbacks
-    try:
-        from config import DEBUG, PORT
-    except ImportError:
-        DEBUG = False
-        PORT = int(os.getenv('PORT', 5000))
-    # Try to import EMAIL_CONFIG and GRAPH_CONFIG from config.py (for local development)
-    try:
-        from config import EMAIL_CONFIG as LOCAL_EMAIL_CONFIG
-    except ImportError:
-        LOCAL_EMAIL_CONFIG = None
-    try:
-        from config import GRAPH_CONFIG as LOCAL_GRAPH_CONFIG
-    except ImportError:
-        LOCAL_GRAPH_CONFIG = None
-    try:
-        from config import EMAIL_MODE as LOCAL_EMAIL_MODE
-    except ImportError:
-        LOCAL_EMAIL_MODE = 'smtp'
-    try:
-        from config import BLOOMERANG_CONFIG as LOCAL_BLOOMERANG_CONFIG
-    except ImportError:
-        LOCAL_BLOOMERANG_CONFIG = None
+    from config import DEBUG, PORT
+except ImportError:
+    DEBUG = False
+    PORT = int(os.getenv('PORT', 5000))
+# Try to import EMAIL_CONFIG and GRAPH_CONFIG from config.py (for local development)
+try:
+    from config import EMAIL_CONFIG as LOCAL_EMAIL_CONFIG
 except ImportError:
-    # Default configuration if config.py doesn't exist
-    ORGANIZATION_INFO = {
-        'name': 'Your Organization Name',
-        'address': '123 Main Street, City, State ZIP',
-        'tax_id': 'XX-XXXXXXX',
-        'phone': '(555) 123-4567',
-        'email': 'info@yourorganization.org'
-    }
-    CSV_FILE = 'donors.csv'
     LOCAL_EMAIL_CONFIG = None
+try:
+    from config import GRAPH_CONFIG as LOCAL_GRAPH_CONFIG
+except ImportError:
     LOCAL_GRAPH_CONFIG = None
+try:
+    from config import EMAIL_MODE as LOCAL_EMAIL_MODE
+except ImportError:
     LOCAL_EMAIL_MODE = 'smtp'
+try:
+    from config import BLOOMERANG_CONFIG as LOCAL_BLOOMERANG_CONFIG
+except ImportError:
     LOCAL_BLOOMERANG_CONFIG = None
 
 # Set PORT and DEBUG with environment variable support
@@ -77,16 +82,22 @@ if LOCAL_EMAIL_CONFIG:
         'smtp_server': os.getenv('SMTP_SERVER', LOCAL_EMAIL_CONFIG.get('smtp_server', 'smtp.gmail.com')),
         'smtp_port': int(os.getenv('SMTP_PORT', LOCAL_EMAIL_CONFIG.get('smtp_port', 587))),
         'sender_email': os.getenv('SENDER_EMAIL', LOCAL_EMAIL_CONFIG.get('sender_email', '')),
-        'sender_password': os.getenv('SENDER_PASSWORD', LOCAL_EMAIL_CONFIG.get('sender_password', ''))
+        'sender_password': os.getenv('SENDER_PASSWORD', LOCAL_EMAIL_CONFIG.get('sender_password', '')),
+        'use_tls': os.getenv('SMTP_USE_TLS', str(LOCAL_EMAIL_CONFIG.get('use_tls', True))).lower() == 'true'
     }
 else:
     EMAIL_CONFIG = {
         'smtp_server': os.getenv('SMTP_SERVER', 'smtp.gmail.com'),
         'smtp_port': int(os.getenv('SMTP_PORT', 587)),
         'sender_email': os.getenv('SENDER_EMAIL', ''),
-        'sender_password': os.getenv('SENDER_PASSWORD', '')
+        'sender_password': os.getenv('SENDER_PASSWORD', ''),
+        'use_tls': os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'
     }
 
+# SMTP connection pool (sessions stay logged in between receipts)
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 4))
+SMTP_MAX_IDLE = int(os.getenv('SMTP_MAX_IDLE', 120))
+
 # Microsoft Graph API Configuration
 if LOCAL_GRAPH_CONFIG:
     GRAPH_CONFIG = {
@@ -103,6 +114,19 @@ else:
         'sender_email': os.getenv('MS_SENDER_EMAIL', '')
     }
 
+# Outbound HTTP (Bloomerang, Microsoft Graph): pooled keep-alive sessions per host
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 3))
+
+# Refresh the cached Graph token this many seconds before it expires
+GRAPH_TOKEN_REFRESH_MARGIN = int(os.getenv('GRAPH_TOKEN_REFRESH_MARGIN', 300))
+
+# Microsoft sign-in and Graph API base URLs (override to point at fake_services.py for load tests)
+GRAPH_LOGIN_URL = os.getenv('GRAPH_LOGIN_URL', 'https://login.microsoftonline.com').rstrip('/')
+GRAPH_API_URL = os.getenv('GRAPH_API_URL', 'https://graph.microsoft.com/v1.0').rstrip('/')
+
 # Bloomerang CRM Configuration
 if LOCAL_BLOOMERANG_CONFIG:
     BLOOMERANG_CONFIG = {
@@ -119,356 +143,409 @@ else:
         'verify_ssl': os.getenv('BLOOMERANG_VERIFY_SSL', 'true').lower() == 'true'
     }
 
-# Override organization info with environment variables for Azure App Service
-ORGANIZATION_INFO['name'] = os.getenv('ORG_NAME', ORGANIZATION_INFO.get('name', ''))
-ORGANIZATION_INFO['address'] = os.getenv('ORG_ADDRESS', ORGANIZATION_INFO.get('address', ''))
-ORGANIZATION_INFO['tax_id'] = os.getenv('ORG_TAX_ID', ORGANIZATION_INFO.get('tax_id', ''))
-ORGANIZATION_INFO['phone'] = os.getenv('ORG_PHONE', ORGANIZATION_INFO.get('phone', ''))
-ORGANIZATION_INFO['email'] = os.getenv('ORG_EMAIL', ORGANIZATION_INFO.get('email', ''))
+# Settings storage
+# Use /home directory on Azure (persists across deployments) or local directory
+PERSISTENT_DIR = '/home' if os.path.exists('/home/site/wwwroot') else '.'
+LOCATIONS_FILE = os.path.join(PERSISTENT_DIR, 'donation_locations.json')
+FORM_TITLE_FILE = os.path.join(PERSISTENT_DIR, 'form_title.txt')
+EMAIL_TEMPLATE_FILE = os.path.join(PERSISTENT_DIR, 'email_template.txt')
+# Settings are cached in memory and re-checked against the files at most this often (seconds)
+SETTINGS_CACHE_MAX_AGE = float(os.getenv('SETTINGS_CACHE_MAX_AGE', 2))
+
+# donors.csv writes: rows are fsynced once CSV_FSYNC_BATCH are pending or after CSV_FSYNC_INTERVAL seconds
+CSV_FSYNC_BATCH = int(os.getenv('CSV_FSYNC_BATCH', 10))
+CSV_FSYNC_INTERVAL = float(os.getenv('CSV_FSYNC_INTERVAL', 1.0))
+
+# Donor storage backend: 'csv' (donors.csv only) or 'sqlite' (donors.csv plus an indexed SQLite copy
+# that serves exports and receipt batches). Rows already in donors.csv are copied into SQLite on startup
+DONOR_STORE_BACKEND = os.getenv('DONOR_STORE_BACKEND', 'csv').lower()
+DONOR_DB_FILE = os.getenv('DONOR_DB_FILE', os.path.join(PERSISTENT_DIR, 'donors.db'))
+
+# Parquet / Arrow snapshots of the donor history for /api/download-snapshot (needs pyarrow)
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join(PERSISTENT_DIR, 'donor_snapshot'))
+
+# Batch receipt regeneration output (ZIP files and their progress)
+BATCH_RECEIPTS_DIR = os.getenv('BATCH_RECEIPTS_DIR', os.path.join(PERSISTENT_DIR, 'batch_receipts'))
+
+# Local Bloomerang constituent index (donor matching without paging through the CRM)
+BLOOMERANG_INDEX_FILE = os.getenv('BLOOMERANG_INDEX_FILE', os.path.join(PERSISTENT_DIR, 'bloomerang_index.db'))
+BLOOMERANG_INDEX_REFRESH = int(os.getenv('BLOOMERANG_INDEX_REFRESH', 300))
+BLOOMERANG_INDEX_FULL_SYNC = int(os.getenv('BLOOMERANG_INDEX_FULL_SYNC', 86400))
+
+# Bloomerang sync worker: donors wait in a persistent outbox and are synced at most
+# BLOOMERANG_RATE_LIMIT requests/second per worker process (bursts up to BLOOMERANG_RATE_BURST)
+CRM_OUTBOX_FILE = os.getenv('CRM_OUTBOX_FILE', os.path.join(PERSISTENT_DIR, 'crm_outbox.db'))
+BLOOMERANG_RATE_LIMIT = float(os.getenv('BLOOMERANG_RATE_LIMIT', 3))
+BLOOMERANG_RATE_BURST = int(os.getenv('BLOOMERANG_RATE_BURST', 10))
+# Seconds syncing pauses when Bloomerang rejects the API key (401/403), instead of dead-lettering donors
+BLOOMERANG_AUTH_PAUSE = float(os.getenv('BLOOMERANG_AUTH_PAUSE', 300))
+CRM_SYNC_BATCH_SIZE = int(os.getenv('CRM_SYNC_BATCH_SIZE', 20))
+CRM_SYNC_MAX_ATTEMPTS = int(os.getenv('CRM_SYNC_MAX_ATTEMPTS', 8))
+CRM_SYNC_RETRY_DELAY = float(os.getenv('CRM_SYNC_RETRY_DELAY', 30))
+
+# In-kind transactions for synced donors are posted together every BLOOMERANG_TXN_FLUSH_WINDOW seconds,
+# up to BLOOMERANG_TXN_BATCH_SIZE per flush over BLOOMERANG_TXN_CONCURRENCY pooled connections
+BLOOMERANG_TRANSACTIONS = os.getenv('BLOOMERANG_TRANSACTIONS', 'true').lower() == 'true'
+BLOOMERANG_FUND_ID = os.getenv('BLOOMERANG_FUND_ID', '')
+BLOOMERANG_TXN_FLUSH_WINDOW = float(os.getenv('BLOOMERANG_TXN_FLUSH_WINDOW', 5))
+BLOOMERANG_TXN_BATCH_SIZE = int(os.getenv('BLOOMERANG_TXN_BATCH_SIZE', 50))
+BLOOMERANG_TXN_CONCURRENCY = int(os.getenv('BLOOMERANG_TXN_CONCURRENCY', 4))
+
+# Background job pipeline (PDF receipt, email and CRM sync run after the response)
+JOBS_DB_FILE = os.getenv('JOBS_DB_FILE', os.path.join(PERSISTENT_DIR, 'jobs.db'))
+RECEIPTS_DIR = os.getenv('RECEIPTS_DIR', os.path.join(PERSISTENT_DIR, 'receipts'))
+# Receipt PDFs (donor details) are deleted when their job finishes; any left over (e.g. by a crash)
+# are swept on startup once older than RECEIPT_RETENTION seconds
+RECEIPT_RETENTION = float(os.getenv('RECEIPT_RETENTION', 7 * 86400))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 30))
+# Independent stages of a job (email and crm) run concurrently, at most JOB_STAGE_CONCURRENCY at once per process
+JOB_STAGE_CONCURRENCY = int(os.getenv('JOB_STAGE_CONCURRENCY', 4))
+
+# Idempotency-Key handling for /api/submit-donation: keys are remembered for IDEMPOTENCY_TTL seconds,
+# shared between workers through IDEMPOTENCY_DB_FILE (set it empty to keep keys per process only)
+IDEMPOTENCY_DB_FILE = os.getenv('IDEMPOTENCY_DB_FILE', os.path.join(PERSISTENT_DIR, 'idempotency.db'))
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 86400))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv('IDEMPOTENCY_MAX_KEYS', 10000))
+
+# Largest number of donations accepted by one /api/submit-donations/batch request
+BATCH_SUBMIT_MAX = int(os.getenv('BATCH_SUBMIT_MAX', 500))
+
+# /api/reports: daily donation counters, updated as donations are saved
+REPORTS_DB_FILE = os.getenv('REPORTS_DB_FILE', os.path.join(PERSISTENT_DIR, 'reports.db'))
+
+# /metrics: each worker publishes its samples to METRICS_DB_FILE every METRICS_PUBLISH_INTERVAL seconds
+# so any worker can answer a scrape for all of them (set it empty to report per process only)
+METRICS_DB_FILE = os.getenv('METRICS_DB_FILE', os.path.join(PERSISTENT_DIR, 'metrics.db'))
+METRICS_PUBLISH_INTERVAL = float(os.getenv('METRICS_PUBLISH_INTERVAL', 5))
 
 app = Flask(__name__)
 CORS(app)
 
+metrics = Registry(METRICS_DB_FILE or None, publish_interval=METRICS_PUBLISH_INTERVAL)
+submit_stage_seconds = metrics.histogram(
+    'donor_submit_stage_seconds', 'Time spent in each stage of a donation submission', ['stage', 'outcome'])
+email_send_seconds = metrics.histogram(
+    'donor_email_send_seconds', 'Receipt email delivery time by email mode', ['mode', 'outcome'])
+bloomerang_call_seconds = metrics.histogram(
+    'donor_bloomerang_call_seconds', 'Bloomerang search pages, constituent and transaction creation', ['operation', 'outcome'])
+http_client_seconds = metrics.histogram(
+    'donor_http_client_request_seconds', 'Outbound HTTP requests by host, method and status', ['host', 'method', 'status'])
+http_request_seconds = metrics.histogram(
+    'donor_http_request_seconds', 'Requests served by the app by route, method and status', ['endpoint', 'method', 'status'])
+
+donor_store = CSVDonorStore(CSV_FILE, fsync_batch=CSV_FSYNC_BATCH, fsync_interval=CSV_FSYNC_INTERVAL)
+if DONOR_STORE_BACKEND == 'sqlite':
+    donor_store = WriteThroughDonorStore(donor_store, SQLiteDonorStore(DONOR_DB_FILE))
+
+# Returning-donor lookup for the kiosk form, kept current by tailing the donor store
+donor_search = DonorSearchIndex(donor_store)
+
+# Per-day counts by location, donation type and merchandise item for /api/reports
+donation_rollups = DonationRollups(REPORTS_DB_FILE, donor_store, source=DONOR_STORE_BACKEND)
+
+# Columnar export, extended with the rows recorded since the previous download
+donor_snapshot = DonorSnapshot(SNAPSHOT_DIR, donor_store, source=DONOR_STORE_BACKEND)
+
+http_client.client.configure(
+    pool_maxsize=HTTP_POOL_SIZE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    retries=HTTP_RETRIES
+)
+http_client.client.observer = lambda method, host, status, seconds: http_client_seconds.observe(
+    seconds, host=host, method=method, status=status)
+
+smtp_pool = SMTPConnectionPool(
+    EMAIL_CONFIG['smtp_server'],
+    EMAIL_CONFIG['smtp_port'],
+    username=EMAIL_CONFIG['sender_email'],
+    password=EMAIL_CONFIG['sender_password'],
+    use_tls=EMAIL_CONFIG['use_tls'],
+    max_size=SMTP_POOL_SIZE,
+    max_idle=SMTP_MAX_IDLE
+)
+
+graph_token_cache = TokenCache(lambda: fetch_graph_token(), refresh_margin=GRAPH_TOKEN_REFRESH_MARGIN)
+
+# Every Bloomerang call from this process takes a token; the bucket follows the API's rate-limit headers
+bloomerang_bucket = TokenBucket(rate=BLOOMERANG_RATE_LIMIT, capacity=BLOOMERANG_RATE_BURST)
+bloomerang_api = RateLimitedClient(bloomerang_bucket, auth_pause=BLOOMERANG_AUTH_PAUSE)
+
+constituent_index = ConstituentIndex(BLOOMERANG_INDEX_FILE)
+index_refresher = IndexRefresher(
+    constituent_index,
+    lambda: BLOOMERANG_CONFIG,
+    refresh_interval=BLOOMERANG_INDEX_REFRESH,
+    full_sync_interval=BLOOMERANG_INDEX_FULL_SYNC,
+    http=bloomerang_api
+)
+
+crm_outbox = SyncOutbox(CRM_OUTBOX_FILE, post_transactions=BLOOMERANG_TRANSACTIONS)
+crm_worker = OutboxWorker(
+    crm_outbox,
+    lambda data: resolve_bloomerang_constituent(data),
+    is_enabled=lambda: bloomerang_enabled(),
+    batch_size=CRM_SYNC_BATCH_SIZE,
+    max_attempts=CRM_SYNC_MAX_ATTEMPTS,
+    base_delay=CRM_SYNC_RETRY_DELAY
+)
+transaction_batcher = TransactionBatcher(
+    crm_outbox,
+    lambda entry: create_bloomerang_transaction(entry['constituent_id'], entry['data'], record_id=entry['record_id'],
+                                                check_existing=entry['maybe_posted']),
+    on_posted=lambda entry, transaction_id: donor_store.set_crm_ids(
+        entry['record_id'], entry['constituent_id'], transaction_id),
+    is_enabled=lambda: bloomerang_enabled(),
+    flush_window=BLOOMERANG_TXN_FLUSH_WINDOW,
+    batch_size=BLOOMERANG_TXN_BATCH_SIZE,
+    concurrency=BLOOMERANG_TXN_CONCURRENCY,
+    max_attempts=CRM_SYNC_MAX_ATTEMPTS,
+    base_delay=CRM_SYNC_RETRY_DELAY
+)
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_DB_FILE or None, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_KEYS)
+
 def init_csv():
     """Initialize CSV file with headers if it doesn't exist"""
-    if not os.path.exists(CSV_FILE):
-        with open(CSV_FILE, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                'Date Recorded', 'First Name', 'Last Name', 'Email', 
-                'Phone', 'Address', 'Donation Type', 'Merchandise Items',
-                'Donation Date', 'Location'
-            ])
-
-def save_to_csv(data):
-    """Save donor data to CSV file"""
-    with open(CSV_FILE, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        merchandise = ', '.join(data.get('merchandiseItems', [])) if data.get('merchandiseItems') else 'N/A'
-        writer.writerow([
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            data['firstName'],
-            data['lastName'],
-            data['email'],
-            data['phone'],
-            data['address'],
-            data['donationType'],
-            merchandise,
-            data['donationDate'],
-            data['location']
-        ])
-
-def send_to_bloomerang(data):
-    """Send donor data to Bloomerang CRM"""
-    if not BLOOMERANG_CONFIG.get('enabled'):
-        print("Bloomerang integration is disabled")
-        return {'success': False, 'message': 'Bloomerang integration disabled'}
-    
-    if not BLOOMERANG_CONFIG.get('api_key'):
-        print("Bloomerang API key not configured")
-        return {'success': False, 'message': 'Bloomerang API key not configured'}
-    
+    donor_store.ensure_ready()
+
+def save_to_csv(data, record_id=None):
+    """Save donor data to CSV file (and the SQLite store when enabled)"""
+    with submit_stage_seconds.time(stage='csv_write'):
+        donor_store.append(data, record_id=record_id)
+    update_rollups()
+
+def release_jobs(job_ids):
+    """Let held jobs run once their donor rows are saved (if this fails, workers still pick them up after stale_after)"""
     try:
-        # Prepare constituent data for Bloomerang
-        # Prepare constituent data for Bloomerang
-        # Note: Email and Phone need to be in specific format for Bloomerang API
-        constituent_data = {
-            'Type': 'Individual',
-            'Status': 'Active',
-            'FirstName': data['firstName'],
-            'LastName': data['lastName'],
-            'PrimaryEmail': {
-                'Type': 'Home',
-                'Value': data['email']
-            },
-            'PrimaryPhone': {
-                'Type': 'Mobile',
-                'Number': data['phone']
-            }
-        }
+        pipeline.release(job_ids)
+    except Exception as e:
+        print(f"Releasing jobs {', '.join(job_ids)} failed: {e}")
+
+def update_rollups():
+    """Fold newly saved donations into the report rollups (a failure is caught up on the next save or report)"""
+    try:
+        with submit_stage_seconds.time(stage='rollup'):
+            donation_rollups.refresh()
+    except Exception as e:
+        print(f"Report rollup update failed: {e}")
+
+def search_recent_constituents(data, max_pages=10):
+    """Scan the newest Bloomerang constituents for a match (used until the local index is built)"""
+    for page in range(max_pages):
+        try:
+            with bloomerang_call_seconds.time(operation='search_page'):
+                results = fetch_constituents_page(BLOOMERANG_CONFIG, page * PAGE_SIZE, http=bloomerang_api)
+        except Exception as e:
+            # Creating the donor without a complete search could duplicate them, so let the sync retry
+            print(f"Search page {page} failed: {e}")
+            raise
         
-        # Add address only if provided
-        if data.get('address') and data['address'].strip():
-            constituent_data['PrimaryAddress'] = {
-                'Street': data['address'],
-                'Type': 'Home'
-            }
+        # If no results, we've reached the end
+        if not results:
+            break
         
-        # Check if constituent already exists
-        headers = {
-            'X-API-Key': BLOOMERANG_CONFIG['api_key'],
-            'Content-Type': 'application/json'
+        for constituent in results:
+            match_score, match_details = match_constituent(data, constituent)
+            # Strong match: Email OR (Phone + Name)
+            if match_score >= 80:
+                print(f"Match found (score: {match_score}, matched: {' + '.join(match_details)}): {constituent.get('FullName', 'Unknown')}")
+                return constituent
+    return None
+
+def bloomerang_constituent_data(data):
+    """Constituent payload for a donor"""
+    # Note: Email and Phone need to be in specific format for Bloomerang API
+    constituent_data = {
+        'Type': 'Individual',
+        'Status': 'Active',
+        'FirstName': data['firstName'],
+        'LastName': data['lastName'],
+        'PrimaryEmail': {
+            'Type': 'Home',
+            'Value': data['email']
+        },
+        'PrimaryPhone': {
+            'Type': 'Mobile',
+            'Number': data['phone']
         }
-        
-        # Search for constituent by email
-        # Note: Bloomerang API limits to 50 results per request, so we paginate
-        search_url = f"{BLOOMERANG_CONFIG['api_url']}/constituents"
-        
-        constituent_id = None
-        matching_constituent = None
-        max_pages = 10  # Search up to 500 constituents (10 pages x 50)
-        
-        for page in range(max_pages):
-            search_params = {
-                'skip': page * 50,
-                'take': 50,  # Maximum allowed by Bloomerang
-                'orderBy': 'Id',
-                'orderDirection': 'Desc'
-            }
-            
-            search_response = requests.get(search_url, headers=headers, params=search_params, verify=BLOOMERANG_CONFIG.get('verify_ssl', True))
-            
-            if search_response.status_code == 200:
-                results = search_response.json()['Results']
-                
-                # If no results, we've reached the end
-                if not results or len(results) == 0:
-                    break
-                
-                # Normalize donor data for comparison
-                donor_email = data['email'].lower().strip() if data.get('email') else ''
-                donor_phone = ''.join(filter(str.isdigit, data.get('phone', '')))  # Remove formatting
-                donor_first = data['firstName'].lower().strip()
-                donor_last = data['lastName'].lower().strip()
-                
-                # Filter results using multiple identifiers
-                for constituent in results:
-                    match_score = 0
-                    match_details = []
-                    
-                    # Check email match (highest priority)
-                    # Bloomerang stores email in PrimaryEmail object
-                    constituent_email = ''
-                    primary_email_obj = constituent.get('PrimaryEmail', {})
-                    if isinstance(primary_email_obj, dict):
-                        constituent_email = primary_email_obj.get('Value', '')
-                    
-                    # Also check EmailAddress field (some API versions)
-                    if not constituent_email:
-                        constituent_email = constituent.get('EmailAddress', '')
-                    
-                    if constituent_email and donor_email:
-                        if constituent_email.lower().strip() == donor_email:
-                            match_score += 100  # Email match is strongest
-                            match_details.append('email')
-                    
-                    # Check phone match
-                    # Bloomerang stores phone in PrimaryPhone.Number
-                    constituent_phone = ''
-                    primary_phone_obj = constituent.get('PrimaryPhone', {})
-                    if isinstance(primary_phone_obj, dict):
-                        constituent_phone = primary_phone_obj.get('Number', '')
-                    
-                    # Also check PhoneNumber field (some API versions)
-                    if not constituent_phone:
-                        constituent_phone = constituent.get('PhoneNumber', '')
-                    
-                    if constituent_phone and donor_phone:
-                        # Normalize phone (remove formatting)
-                        normalized_phone = ''.join(filter(str.isdigit, constituent_phone))
-                        if normalized_phone == donor_phone and len(donor_phone) >= 10:
-                            match_score += 50  # Phone match is good
-                            match_details.append('phone')
-                    
-                    # Check name match
-                    constituent_first = (constituent.get('FirstName', '') or '').lower().strip()
-                    constituent_last = (constituent.get('LastName', '') or '').lower().strip()
-                    
-                    if constituent_first == donor_first and constituent_last == donor_last:
-                        match_score += 30  # Name match
-                        match_details.append('name')
-                    
-                    # Strong match: Email OR (Phone + Name)
-                    if match_score >= 80:
-                        matching_constituent = constituent
-                        match_info = ' + '.join(match_details)
-                        print(f"Match found (score: {match_score}, matched: {match_info}): {constituent.get('FullName', 'Unknown')}")
-                        break
-                
-                # If we found a match, stop searching
-                if matching_constituent:
-                    break
-            else:
-                print(f"Search page {page} failed: {search_response.status_code}")
-                break
-        
-        if matching_constituent:
-            # Constituent exists, use existing ID
-            constituent_id = matching_constituent.get('Id')
-            print(f"Found existing constituent: {constituent_id} ({matching_constituent.get('FullName', 'Unknown')})")
-            return {
-                    'success': True,
-                    'constituent_id': constituent_id,
-                    'transaction_id': 0,
-                    'message': f"Found existing constituent"
-                }
-        else:
-            # Not found, create new constituent
-            print(f"No matching constituent found for {data['email']}, creating new...")
-            # Note: Bloomerang uses singular 'constituent' for POST
-            create_url = f"{BLOOMERANG_CONFIG['api_url']}/constituent"
-            create_response = requests.post(create_url, headers=headers, json=constituent_data, verify=BLOOMERANG_CONFIG.get('verify_ssl', True))
-            
-            if create_response.status_code in [200, 201]:
-                result = create_response.json()
-                constituent_id = result.get('Id')
-                print(f"Created new constituent: {constituent_id}")
-                return {
-                    'success': True,
-                    'constituent_id': constituent_id,
-                    'transaction_id': 0,
-                    'message': 'Successfully added to Bloomerang'
-                }
-            else:
-                print(f"Failed to create constituent: {create_response.status_code} - {create_response.text}")
-                return {'success': False, 'message': f'Failed to create constituent: {create_response.text}'}
-        
-        # Create transaction (donation record)
-        # if constituent_id:
-        #     transaction_data = {
-        #         'ConstituentId': constituent_id,
-        #         'Date': data['donationDate'],
-        #         'Amount': 0,  # In-kind donation, no monetary value
-        #         'Method': 'InKind',
-        #         'Fund': 'General',
-        #         'Note': f"Donation Type: {data['donationType']}\nLocation: {data['location']}"
-        #     }
-            
-        #     # Add merchandise details if applicable
-        #     if data['donationType'] == 'merchandise' and data.get('merchandiseItems'):
-        #         transaction_data['Note'] += f"\nItems: {', '.join(data['merchandiseItems'])}"
-            
-        #     transaction_url = f"{BLOOMERANG_CONFIG['api_url']}/transactions"
-        #     transaction_response = requests.post(transaction_url, headers=headers, json=transaction_data, verify=BLOOMERANG_CONFIG.get('verify_ssl', True))
-            
-        #     if transaction_response.status_code in [200, 201]:
-        #         transaction_id = transaction_response.json().get('Id')
-        #         print(f"Created transaction: {transaction_id}")
-        #         return {
-        #             'success': True,
-        #             'constituent_id': constituent_id,
-        #             'transaction_id': transaction_id,
-        #             'message': 'Successfully added to Bloomerang'
-        #         }
-        #     else:
-        #         print(f"Failed to create transaction: {transaction_response.status_code} - {transaction_response.text}")
-        #         return {'success': False, 'message': f'Failed to create transaction: {transaction_response.text}'}
-        
-        # return {'success': False, 'message': 'Failed to get constituent ID'}
-        
-    except Exception as e:
-        print(f"Bloomerang error: {str(e)}")
-        return {'success': False, 'message': str(e)}
+    }
+    
+    # Add address only if provided
+    if data.get('address') and data['address'].strip():
+        constituent_data['PrimaryAddress'] = {
+            'Street': data['address'],
+            'Type': 'Home'
+        }
+    return constituent_data
 
-def generate_pdf_receipt(data):
-    """Generate PDF receipt and return as bytes"""
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    
-    # Header
-    c.setFont("Helvetica-Bold", 20)
-    c.drawString(1*inch, height - 0.8*inch, "This is your Tax Receipt")
-    
-    # Organization info
-    c.setFont("Helvetica", 10)
-    c.drawString(1*inch, height - 1.1*inch, "Goodwill Industries of South Florida, Inc.")
-    c.drawString(1*inch, height - 1.3*inch, ORGANIZATION_INFO['address'])
-    
-    # Tax acknowledgment
-    donation_date = datetime.strptime(data['donationDate'], '%Y-%m-%d').strftime('%m/%d/%Y')
-    c.setFont("Helvetica", 11)
-    y_position = height - 1.7*inch
-    
-    c.drawString(1*inch, y_position, f"Goodwill Industries of South Florida, Inc. acknowledges that a non-cash donation")
-    y_position -= 0.2*inch
-    c.drawString(1*inch, y_position, f"was received on {donation_date}.")
-    y_position -= 0.3*inch
-    
-    # 501(c)(3) statement
-    c.drawString(1*inch, y_position, "Goodwill Industries of South Florida, Inc is a 501(c)(3) non-profit organization.")
-    y_position -= 0.2*inch
-    c.drawString(1*inch, y_position, "Your donations are tax deductible to the fullest extent of the law.")
-    y_position -= 0.2*inch
-    c.drawString(1*inch, y_position, "No goods or services were provided in exchange for this donation.")
-    y_position -= 0.4*inch
-    
-    # Itemized donations
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(1*inch, y_position, "For your records, below please find your itemized donation(s):")
-    y_position -= 0.3*inch
-    
-    c.setFont("Helvetica", 11)
-    if data['donationType'] == 'merchandise' and data.get('merchandiseItems'):
-        for item in data['merchandiseItems']:
-            c.drawString(1.2*inch, y_position, f"• {item}")
-            y_position -= 0.2*inch
+def resolve_bloomerang_constituent(data):
+    """
+    Find the donor's Bloomerang constituent or create one; returns a result dict with constituent_id
+    Raises RateLimited on 429 (AuthFailed on 401/403), PermanentSyncError when Bloomerang rejects the donor, Exception otherwise
+    """
+    # Resolve the donor against the local constituent index (no CRM calls)
+    matching_constituent = None
+    if constituent_index.is_ready():
+        match = constituent_index.find_match(data)
+        if match:
+            matching_constituent = {'Id': match['id'], 'FullName': match['full_name']}
+            print(f"Index match ({' + '.join(match['matched'])}): {match['full_name'] or 'Unknown'}")
     else:
-        c.drawString(1.2*inch, y_position, f"• {data['donationType'].capitalize()}")
-        y_position -= 0.2*inch
-    
-    y_position -= 0.2*inch
-    
-    # IRS regulation notice
-    c.setFont("Helvetica-Oblique", 10)
-    c.drawString(1*inch, y_position, "IRS Regulations prohibit charitable organizations from establishing or affirming")
-    y_position -= 0.2*inch
-    c.drawString(1*inch, y_position, "the value of contributions.")
-    y_position -= 0.5*inch
-    
-    # Donor Information section
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(1*inch, y_position, "Donor Information:")
-    y_position -= 0.3*inch
-    
-    c.setFont("Helvetica", 10)
-    donor_info = [
-        f"Name: {data['firstName']} {data['lastName']}",
-        f"Email: {data['email']}",
-        f"Phone: {data['phone']}",
-        f"Address: {data['address']}",
-        f"Location: {data['location']}"
-    ]
+        # Index not built yet - fall back to scanning the newest constituents
+        matching_constituent = search_recent_constituents(data)
     
-    for line in donor_info:
-        c.drawString(1*inch, y_position, line)
-        y_position -= 0.2*inch
+    if matching_constituent:
+        # Constituent exists, use existing ID
+        constituent_id = matching_constituent.get('Id')
+        print(f"Found existing constituent: {constituent_id} ({matching_constituent.get('FullName', 'Unknown')})")
+        return {
+            'success': True,
+            'constituent_id': constituent_id,
+            'transaction_id': 0,
+            'message': 'Found existing constituent'
+        }
     
-    # Footer
-    c.setFont("Helvetica-Oblique", 9)
-    c.drawString(1*inch, 1.2*inch, "Thank you for your generous donation!")
-    c.drawString(1*inch, 1.0*inch, "Please consult with a tax professional regarding deductibility.")
+    # Not found, create new constituent
+    print(f"No matching constituent found for {data['email']}, creating new...")
+    constituent_data = bloomerang_constituent_data(data)
+    headers = {
+        'X-API-Key': BLOOMERANG_CONFIG['api_key'],
+        'Content-Type': 'application/json'
+    }
+    # Note: Bloomerang uses singular 'constituent' for POST
+    create_url = f"{BLOOMERANG_CONFIG['api_url']}/constituent"
+    with bloomerang_call_seconds.time(operation='create_constituent'):
+        create_response = bloomerang_api.post(create_url, headers=headers, json=constituent_data, verify=BLOOMERANG_CONFIG.get('verify_ssl', True))
+    
+    if create_response.status_code not in [200, 201]:
+        print(f"Failed to create constituent: {create_response.status_code} - {create_response.text}")
+        message = f'Failed to create constituent: {create_response.status_code} - {create_response.text}'
+        if 400 <= create_response.status_code < 500:
+            raise PermanentSyncError(message)
+        raise Exception(message)
     
-    # Receipt date at bottom
-    c.setFont("Helvetica", 8)
-    c.drawString(1*inch, 0.7*inch, f"Receipt Generated: {datetime.now().strftime('%B %d, %Y at %I:%M %p')}")
+    result = create_response.json()
+    constituent_id = result.get('Id')
+    print(f"Created new constituent: {constituent_id}")
     
-    c.save()
-    buffer.seek(0)
-    return buffer
+    # Keep the index current so the next submission from this donor matches
+    constituent_index.add([{
+        **constituent_data,
+        'FullName': f"{data['firstName']} {data['lastName']}",
+        **result,
+        'Id': constituent_id
+    }])
+    return {
+        'success': True,
+        'constituent_id': constituent_id,
+        'transaction_id': 0,
+        'message': 'Successfully added to Bloomerang'
+    }
+
+def bloomerang_transaction_data(constituent_id, data, record_id=None):
+    """In-kind transaction payload for a donation (no monetary value)"""
+    note = f"Donation Type: {data['donationType']}\nLocation: {data['location']}"
+    if data['donationType'] == 'merchandise' and data.get('merchandiseItems'):
+        note += f"\nItems: {', '.join(data['merchandiseItems'])}"
+    if record_id:
+        # Lets a retried post find the transaction an earlier attempt may have created
+        note += f"\n{receipt_marker(record_id)}"
+    transaction_data = {
+        'AccountId': constituent_id,
+        'Date': data['donationDate'],
+        'Amount': 0,
+        'Method': 'InKind',
+        'Note': note
+    }
+    if BLOOMERANG_FUND_ID:
+        transaction_data['Designations'] = [{'Amount': 0, 'Type': 'Donation', 'FundId': int(BLOOMERANG_FUND_ID)}]
+    return transaction_data
+
+def receipt_marker(record_id):
+    return f"Receipt: {record_id}"
+
+def find_bloomerang_transaction(constituent_id, record_id):
+    """Id of the transaction already posted for a donation (found by the receipt line in its note), or None"""
+    headers = {'X-API-Key': BLOOMERANG_CONFIG['api_key']}
+    params = {'accountId': constituent_id, 'take': 50, 'orderBy': 'Id', 'orderDirection': 'Desc'}
+    with bloomerang_call_seconds.time(operation='find_transaction'):
+        response = bloomerang_api.get(
+            f"{BLOOMERANG_CONFIG['api_url']}/transactions",
+            headers=headers,
+            params=params,
+            verify=BLOOMERANG_CONFIG.get('verify_ssl', True)
+        )
+    if response.status_code != 200:
+        raise Exception(f"Failed to look up transactions: {response.status_code} - {response.text}")
+    marker = receipt_marker(record_id)
+    for transaction in response.json().get('Results', []):
+        notes = [transaction.get('Note')] + [d.get('Note') for d in transaction.get('Designations') or []]
+        if any(marker in (note or '') for note in notes):
+            return transaction.get('Id')
+    return None
+
+def create_bloomerang_transaction(constituent_id, data, record_id=None, check_existing=False):
+    """
+    Record a donation as an in-kind transaction on the constituent; returns the transaction id
+    check_existing looks for a transaction an earlier attempt created (a timeout or 5xx can come after
+    Bloomerang has saved it) and returns its id instead of posting again.
+    Raises RateLimited on 429 (AuthFailed on 401/403), PermanentSyncError when Bloomerang rejects it, Exception otherwise
+    """
+    if not constituent_id:
+        raise PermanentSyncError('No constituent id to attach the transaction to')
+    if check_existing and record_id:
+        existing_id = find_bloomerang_transaction(constituent_id, record_id)
+        if existing_id:
+            print(f"Transaction {existing_id} for {record_id} was already posted")
+            return existing_id
+    headers = {
+        'X-API-Key': BLOOMERANG_CONFIG['api_key'],
+        'Content-Type': 'application/json'
+    }
+    transaction_url = f"{BLOOMERANG_CONFIG['api_url']}/transaction"
+    with bloomerang_call_seconds.time(operation='create_transaction'):
+        transaction_response = bloomerang_api.post(
+            transaction_url,
+            headers=headers,
+            json=bloomerang_transaction_data(constituent_id, data, record_id),
+            verify=BLOOMERANG_CONFIG.get('verify_ssl', True)
+        )
+
+    if transaction_response.status_code not in [200, 201]:
+        print(f"Failed to create transaction: {transaction_response.status_code} - {transaction_response.text}")
+        message = f'Failed to create transaction: {transaction_response.status_code} - {transaction_response.text}'
+        if 400 <= transaction_response.status_code < 500:
+            raise PermanentSyncError(message)
+        raise Exception(message)
+
+    transaction_id = transaction_response.json().get('Id')
+    print(f"Created transaction: {transaction_id}")
+    return transaction_id
+
+def bloomerang_enabled():
+    return bool(BLOOMERANG_CONFIG.get('enabled') and BLOOMERANG_CONFIG.get('api_key'))
+
+def generate_pdf_receipt(data):
+    """Generate PDF receipt and return as bytes"""
+    return render_receipt(data, ORGANIZATION_INFO)
 
 def get_email_body(data):
     """Generate email body text using template"""
-    template = load_email_template()
-    
-    # Replace variables in template
-    body = template.replace('{firstName}', data['firstName'])
-    body = body.replace('{lastName}', data['lastName'])
-    body = body.replace('{donationType}', data['donationType'].capitalize())
-    body = body.replace('{donationDate}', datetime.strptime(data['donationDate'], '%Y-%m-%d').strftime('%B %d, %Y'))
-    body = body.replace('{location}', data['location'])
-    
-    return body
+    # Compiled once per template text, then rendered in a single pass
+    return compile_template(load_email_template()).render(data)
 
-def get_access_token():
-    """Get access token for Microsoft Graph API"""
+def fetch_graph_token():
+    """Request a new access token for Microsoft Graph API, returns (token, expires_in)"""
     if not GRAPH_CONFIG.get('tenant_id') or not GRAPH_CONFIG.get('client_id') or not GRAPH_CONFIG.get('client_secret'):
         raise Exception(
             "Microsoft Graph API credentials not configured. "
             "Please update config.py with your Azure AD app credentials."
         )
     
-    token_url = f"https://login.microsoftonline.com/{GRAPH_CONFIG['tenant_id']}/oauth2/v2.0/token"
+    token_url = f"{GRAPH_LOGIN_URL}/{GRAPH_CONFIG['tenant_id']}/oauth2/v2.0/token"
     
     payload = {
         'grant_type': 'client_credentials',
@@ -477,7 +554,7 @@ def get_access_token():
         'scope': 'https://graph.microsoft.com/.default'
     }
     
-    response = requests.post(token_url, data=payload)
+    response = http_client.post(token_url, data=payload)
     
     if response.status_code != 200:
         raise Exception(f"Failed to get access token: {response.status_code} - {response.text}")
@@ -487,7 +564,11 @@ def get_access_token():
     if not access_token:
         raise Exception("No access token received from Microsoft Graph API")
     
-    return access_token
+    return access_token, response.json().get('expires_in', 3599)
+
+def get_access_token():
+    """Get access token for Microsoft Graph API (cached until shortly before it expires)"""
+    return graph_token_cache.get()
 
 def send_email_smtp(data, pdf_buffer):
     """Send email using SMTP (Gmail/Google Workspace)"""
@@ -515,12 +596,8 @@ def send_email_smtp(data, pdf_buffer):
     )
     msg.attach(part)
     
-    # Send email via SMTP
-    server = smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port'])
-    server.starttls()
-    server.login(EMAIL_CONFIG['sender_email'], EMAIL_CONFIG['sender_password'])
-    server.send_message(msg)
-    server.quit()
+    # Send email over a pooled SMTP session
+    smtp_pool.send_message(msg)
     
     print(f"Email sent successfully via SMTP to {data['email']}")
 
@@ -564,57 +641,392 @@ def send_email_microsoft(data, pdf_buffer):
     }
     
     # Send email via Graph API
-    url = f"https://graph.microsoft.com/v1.0/users/{GRAPH_CONFIG['sender_email']}/sendMail"
+    url = f"{GRAPH_API_URL}/users/{GRAPH_CONFIG['sender_email']}/sendMail"
     headers = {
         'Authorization': f'Bearer {token}',
         'Content-Type': 'application/json'
     }
     
-    response = requests.post(url, json=message, headers=headers)
+    response = http_client.post(url, json=message, headers=headers)
+    
+    if response.status_code == 401:
+        # Token revoked or expired early - make the retry fetch a new one
+        graph_token_cache.invalidate()
     
     if response.status_code != 202:
         raise Exception(f"Graph API error: {response.status_code} - {response.text}")
     
     print(f"Email sent successfully via Microsoft Graph API to {data['email']}")
 
-def send_email_with_receipt(data, pdf_buffer):
-    """Send email with PDF receipt attached - uses configured email mode"""
-    try:
-        if EMAIL_MODE == 'microsoft':
+def deliver_receipt_email(data, pdf_buffer):
+    """Send email with PDF receipt attached using the configured email mode (raises on failure)"""
+    if EMAIL_MODE == 'microsoft':
+        with email_send_seconds.time(mode='microsoft'):
             send_email_microsoft(data, pdf_buffer)
-        else:  # Default to SMTP
+    else:  # Default to SMTP
+        with email_send_seconds.time(mode='smtp'):
             send_email_smtp(data, pdf_buffer)
+
+# Background Job Pipeline
+# The request only writes the CSV row; the receipt, email and CRM sync run as job stages
+def receipt_path(job_id):
+    """Path of the stored PDF receipt for a job"""
+    return os.path.join(RECEIPTS_DIR, f"{job_id}.pdf")
+
+def run_pdf_stage(job_id, data, results):
+    """Render the PDF receipt and keep it on disk for the email stage"""
+    with submit_stage_seconds.time(stage='pdf_render'):
+        pdf_bytes = generate_pdf_receipt(data).getvalue()
+    os.makedirs(RECEIPTS_DIR, exist_ok=True)
+    path = receipt_path(job_id)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(pdf_bytes)
+    os.replace(path + '.tmp', path)
+    return {'bytes': len(pdf_bytes)}
+
+def run_email_stage(job_id, data, results):
+    """Email the stored receipt to the donor"""
+    with open(receipt_path(job_id), 'rb') as f:
+        pdf_buffer = io.BytesIO(f.read())
+    with submit_stage_seconds.time(stage='email'):
+        try:
+            deliver_receipt_email({**data, 'receiptNumber': job_id}, pdf_buffer)
+        except DeliveryUncertain as e:
+            # The donor may already have the receipt; a retry could send it twice
+            raise PermanentStageError(str(e))
+    return {'mode': EMAIL_MODE}
+
+def remove_receipt(job_id, status=None):
+    """Delete a job's stored PDF receipt once the job no longer needs it"""
+    try:
+        os.remove(receipt_path(job_id))
+    except FileNotFoundError:
+        pass
+
+def sweep_receipts():
+    """Delete stored receipts older than RECEIPT_RETENTION (left by jobs that never finished)"""
+    cutoff = time.time() - RECEIPT_RETENTION
+    removed = 0
+    try:
+        names = os.listdir(RECEIPTS_DIR)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        path = os.path.join(RECEIPTS_DIR, name)
+        try:
+            if name.endswith('.pdf') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        print(f"Removed {removed} stored receipt(s) older than {RECEIPT_RETENTION / 86400:g} days")
+    return removed
+
+def run_crm_stage(job_id, data, results):
+    """Queue the donor for the Bloomerang sync worker"""
+    if not BLOOMERANG_CONFIG.get('enabled'):
+        raise StageSkipped('Bloomerang integration disabled')
+    if not BLOOMERANG_CONFIG.get('api_key'):
+        raise StageSkipped('Bloomerang API key not configured')
+    with submit_stage_seconds.time(stage='crm_queue'):
+        crm_outbox.enqueue(job_id, data)
+    crm_worker.wake()
+    return {'queued': True}
+
+job_store = JobStore(JOBS_DB_FILE)
+pipeline = JobPipeline(
+    job_store,
+    stages=['pdf', 'email', 'crm'],
+    handlers={'pdf': run_pdf_stage, 'email': run_email_stage, 'crm': run_crm_stage},
+    depends_on={'email': 'pdf'},
+    workers=JOB_WORKERS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_delay=JOB_RETRY_DELAY,
+    stage_concurrency=JOB_STAGE_CONCURRENCY,
+    on_finish=remove_receipt
+)
+
+def start_workers():
+    """Make sure this worker process is running its job, index refresh, CRM sync and metrics threads"""
+    metrics.ensure_started()
+    pipeline.ensure_started()
+    donor_search.ensure_started()
+    if BLOOMERANG_CONFIG.get('enabled'):
+        index_refresher.ensure_started()
+        crm_worker.ensure_started()
+        if BLOOMERANG_TRANSACTIONS:
+            transaction_batcher.ensure_started()
+
+# Process that has run warm_up (gunicorn.conf.py calls it in each worker before it takes requests)
+warmed_up_pid = None
+
+def warm_up():
+    """Start the background threads and load the donor search index and report rollups up front"""
+    global warmed_up_pid
+    start = time.perf_counter()
+    start_workers()
+    donor_search.refresh()
+    update_rollups()
+    warmed_up_pid = os.getpid()
+    print(f"Worker {os.getpid()} warmed up in {time.perf_counter() - start:.2f}s")
+
+@app.before_request
+def start_background_workers():
+    g.request_started = time.perf_counter()
+    start_workers()
+
+@app.after_request
+def record_request_metrics(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_seconds.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method,
+                                     status=str(response.status_code))
+    return response
+
+def idempotent(view):
+    """Answer a repeated Idempotency-Key with the original response instead of running the view again"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'success': False, 'message': 'Idempotency-Key must be at most 255 characters'}), 400
         
-        return True
-            
-    except Exception as e:
-        print(f"Email error ({EMAIL_MODE} mode): {str(e)}")
-        return False
+        # The same key with a different body is a client bug, not a retry
+        fingerprint = hashlib.sha256(request.path.encode('utf-8') + b'\0' + request.get_data()).hexdigest()
+        outcome, stored = idempotency_store.begin(key, fingerprint)
+        if outcome == REPLAY:
+            status_code, body = stored
+            response = jsonify(body)
+            response.status_code = status_code
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        if outcome == IN_PROGRESS:
+            response = jsonify({'success': False, 'message': 'A request with this Idempotency-Key is still in progress'})
+            response.status_code = 409
+            response.headers['Retry-After'] = '1'
+            return response
+        if outcome == MISMATCH:
+            return jsonify({'success': False, 'message': 'Idempotency-Key was already used with a different request'}), 422
+        
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.release(key)
+            raise
+        # Server errors are not remembered, so the client's retry runs the request again
+        if response.status_code < 500 and response.is_json:
+            idempotency_store.complete(key, fingerprint, response.status_code, response.get_json())
+        else:
+            idempotency_store.release(key)
+        return response
+    return wrapper
 
 @app.route('/api/submit-donation', methods=['POST'])
+@idempotent
 def submit_donation():
-    """Handle donation submission"""
+    """Handle donation submission - saves the record and queues the receipt/email/CRM job"""
     try:
         data = request.json
         
-        # Save to CSV
-        save_to_csv(data)
+        # The job is saved (held) before the record, so a failure in either one fails the request
+        # with nothing left behind for the retry to append again; the job id doubles as the record id
+        job_id = pipeline.submit(data, job_id=new_job_id(), hold=True)
+        try:
+            save_to_csv(data, record_id=job_id)
+        except Exception:
+            pipeline.discard([job_id])
+            raise
+        
+        # Receipt, email and Bloomerang sync happen in the background
+        release_jobs([job_id])
+        
+        return jsonify({
+            'success': True,
+            'message': 'Donation recorded successfully',
+            'jobId': job_id,
+            'statusUrl': f'/api/jobs/{job_id}'
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@app.route('/api/reports', methods=['GET'])
+def donation_report():
+    """
+    Donation counts by location, donation type and merchandise item
+    Optional filters: start/end (donation date, YYYY-MM-DD), location, type; interval=day|week|month adds a series
+    """
+    filters = {
+        'start': request.args.get('start') or None,
+        'end': request.args.get('end') or None,
+        'location': request.args.get('location') or None,
+        'donation_type': request.args.get('type') or None,
+        'interval': request.args.get('interval') or None
+    }
+    for name in ('start', 'end'):
+        if filters[name]:
+            try:
+                datetime.strptime(filters[name], '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'success': False, 'message': f'{name} must be a date (YYYY-MM-DD)'}), 400
+    if filters['interval'] and filters['interval'] not in INTERVALS:
+        return jsonify({'success': False, 'message': f"interval must be one of: {', '.join(INTERVALS)}"}), 400
+    try:
+        # Catches up on rows a failed rollup update left out (normally there are none)
+        donation_rollups.refresh()
+        return jsonify({'success': True, 'report': donation_rollups.report(**filters)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/donors/search', methods=['GET'])
+def search_donors():
+    """Returning donors matching q (email, phone or name), for prefilling the kiosk form"""
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 25)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit must be a number'}), 400
+    try:
+        start = time.perf_counter()
+        donors = donor_search.search(request.args.get('q', ''), limit=limit)
+        return jsonify({
+            'success': True,
+            'donors': donors,
+            'tookMs': round((time.perf_counter() - start) * 1000, 2)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# Fields every donation record must have (matching the required inputs on the kiosk form)
+REQUIRED_DONATION_FIELDS = ['firstName', 'lastName', 'email', 'phone', 'donationType', 'donationDate', 'location']
+# Optional text fields (address is not required on the kiosk form)
+OPTIONAL_DONATION_FIELDS = ['address']
+
+def validate_donation(data):
+    """Return a list of problems with a donation record (empty when it is valid)"""
+    if not isinstance(data, dict):
+        return ['Record must be a JSON object']
+    
+    errors = []
+    for field in REQUIRED_DONATION_FIELDS + OPTIONAL_DONATION_FIELDS:
+        value = data.get(field)
+        if value is not None and not isinstance(value, str):
+            errors.append(f"{field} must be a string")
+        elif field in REQUIRED_DONATION_FIELDS and not (value or '').strip():
+            errors.append(f"{field} is required")
+    if isinstance(data.get('donationDate'), str) and data['donationDate']:
+        try:
+            datetime.strptime(data['donationDate'], '%Y-%m-%d')
+        except ValueError:
+            errors.append('donationDate must be YYYY-MM-DD')
+    items = data.get('merchandiseItems')
+    if items is not None and not (isinstance(items, list) and all(isinstance(item, str) for item in items)):
+        errors.append('merchandiseItems must be a list of strings')
+    if data.get('clientId') is not None and not isinstance(data['clientId'], str):
+        errors.append('clientId must be a string')
+    return errors
+
+def read_batch_records():
+    """Donation records from a JSON array ({"donations": [...]} also accepted) or an NDJSON body"""
+    if 'ndjson' in (request.content_type or ''):
+        records = []
+        for line in request.stream:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+        return records
+    
+    body = request.get_json(force=True, silent=True)
+    if isinstance(body, dict):
+        body = body.get('donations')
+    if not isinstance(body, list):
+        raise ValueError('Expected a JSON array of donations or an NDJSON body')
+    return body
+
+@app.route('/api/submit-donations/batch', methods=['POST'])
+def submit_donations_batch():
+    """
+    Record a backlog of donations at once (e.g. from a kiosk that was offline)
+    Each record may carry a clientId; a record whose clientId was already accepted is reported
+    as a duplicate and not recorded again, so a kiosk can safely resend a whole batch.
+    """
+    try:
+        try:
+            records = read_batch_records()
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        if len(records) > BATCH_SUBMIT_MAX:
+            return jsonify({
+                'success': False,
+                'message': f'At most {BATCH_SUBMIT_MAX} donations per batch'
+            }), 413
         
-        # Generate PDF
-        pdf_buffer = generate_pdf_receipt(data)
+        results = []
+        accepted = []
+        for index, record in enumerate(records):
+            errors = validate_donation(record)
+            client_id = None
+            if isinstance(record, dict) and isinstance(record.get('clientId'), str) and record['clientId']:
+                client_id = record['clientId']
+            result = {'index': index, 'clientId': client_id}
+            if errors:
+                result.update({'status': 'invalid', 'errors': errors})
+            else:
+                data = {key: value for key, value in record.items() if key != 'clientId'}
+                # Fill in the optional fields so the donor store, receipt and email all see them
+                for field in OPTIONAL_DONATION_FIELDS:
+                    data[field] = data.get(field) or ''
+                accepted.append((result, data))
+            results.append(result)
         
-        # Send email
-        email_sent = send_email_with_receipt(data, pdf_buffer)
+        # The donor store lock is held across the duplicate check and both writes, so the same
+        # batch resent to another worker at the same time cannot be recorded twice. The jobs are
+        # saved (claiming their clientIds) before the donor rows and only run once those are written;
+        # if the donor write fails they are dropped again, so a resend records the batch once.
+        with donor_store.lock:
+            existing = job_store.find_by_client_ids(
+                {result['clientId'] for result, _ in accepted if result['clientId']}
+            )
+            new_jobs = []
+            for result, data in accepted:
+                client_id = result['clientId']
+                if client_id and client_id in existing:
+                    result.update({'status': 'duplicate', 'jobId': existing[client_id]})
+                    continue
+                job_id = new_job_id()
+                if client_id:
+                    existing[client_id] = job_id
+                result.update({'status': 'created', 'jobId': job_id, 'statusUrl': f'/api/jobs/{job_id}'})
+                new_jobs.append((job_id, data, client_id))
+            
+            if new_jobs:
+                job_ids = [job_id for job_id, _, _ in new_jobs]
+                # One job transaction, then one donor store append for the whole batch
+                pipeline.submit_many(new_jobs, hold=True)
+                try:
+                    donor_store.append_many([data for _, data, _ in new_jobs], record_ids=job_ids)
+                except Exception:
+                    pipeline.discard(job_ids)
+                    raise
+                # Receipts, emails and CRM sync are picked up by the job workers in parallel
+                release_jobs(job_ids)
         
-        # Send to Bloomerang CRM
-        bloomerang_result = send_to_bloomerang(data)
+        if any(result['status'] == 'created' for result in results):
+            update_rollups()
         
+        counts = {status: sum(1 for r in results if r['status'] == status) for status in ('created', 'duplicate', 'invalid')}
         return jsonify({
             'success': True,
-            'message': 'Donation recorded successfully',
-            'emailSent': email_sent,
-            'bloomerangSynced': bloomerang_result.get('success', False),
-            'bloomerangMessage': bloomerang_result.get('message', '')
+            'message': f"{counts['created']} recorded, {counts['duplicate']} duplicate, {counts['invalid']} invalid",
+            'counts': counts,
+            'results': results
         })
     
     except Exception as e:
@@ -623,12 +1035,90 @@ def submit_donation():
             'message': str(e)
         }), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Report the progress of a donation's background job"""
+    try:
+        job = job_store.get_job(job_id)
+        if not job:
+            return jsonify({'success': False, 'message': 'Job not found'}), 404
+        
+        # Donor details stay out of the status response
+        job.pop('data', None)
+        # The crm stage only queues the donor; the outbox entry shows the actual sync
+        job['crmSync'] = crm_outbox.get(job_id)
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/api/download-csv', methods=['GET'])
 def download_csv():
-    """Download the donors CSV file"""
-    if os.path.exists(CSV_FILE):
-        return send_file(CSV_FILE, as_attachment=True, download_name='donors.csv')
-    return jsonify({'error': 'No data available'}), 404
+    """
+    Download the donors CSV file
+    Optional filters: start/end (donation date, YYYY-MM-DD), location, type; gzip=1 compresses the download
+    """
+    filters = {
+        'start': request.args.get('start') or None,
+        'end': request.args.get('end') or None,
+        'location': request.args.get('location') or None,
+        'donation_type': request.args.get('type') or None
+    }
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    if not os.path.exists(CSV_FILE):
+        return jsonify({'error': 'No data available'}), 404
+    
+    # Unfiltered export of the CSV itself: send_file handles ETag/If-Modified-Since and ranges
+    if DONOR_STORE_BACKEND != 'sqlite' and not compress and not any(filters.values()):
+        return send_file(os.path.abspath(CSV_FILE), as_attachment=True, download_name='donors.csv')
+    
+    # The ETag covers the store version plus the request, so an unchanged export returns 304
+    version = donor_store.version()
+    etag = hashlib.sha1(json.dumps([version, filters, compress]).encode('utf-8')).hexdigest()
+    last_modified = datetime.fromtimestamp(int(os.path.getmtime(CSV_FILE)), timezone.utc)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = bool(request.if_modified_since and request.if_modified_since >= last_modified)
+    
+    if not_modified:
+        response = Response(status=304)
+    else:
+        # Rows are streamed a chunk at a time, so memory stays flat however large the file is
+        chunks = iter_csv(donor_store.iter_rows(**filters))
+        filename = 'donors.csv'
+        if compress:
+            chunks = iter_gzip(chunks)
+            filename += '.gz'
+        response = Response(
+            stream_with_context(chunks),
+            mimetype='application/gzip' if compress else 'text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/download-snapshot', methods=['GET'])
+def download_snapshot():
+    """
+    Download the donor history as a typed columnar file: format=parquet (default) or arrow (Arrow IPC)
+    Only rows recorded since the previous snapshot are converted
+    """
+    fmt = request.args.get('format', 'parquet').lower()
+    if fmt not in SNAPSHOT_FORMATS:
+        return jsonify({'success': False, 'message': f"format must be one of: {', '.join(SNAPSHOT_FORMATS)}"}), 400
+    if not donor_snapshot.available():
+        return jsonify({'success': False, 'message': 'Snapshot export needs pyarrow (pip install pyarrow)'}), 503
+    try:
+        path = donor_snapshot.export(fmt)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+    filename, mimetype = SNAPSHOT_FORMATS[fmt]
+    response = send_file(os.path.abspath(path), as_attachment=True, download_name=filename, mimetype=mimetype)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/api/test-email', methods=['POST'])
 def test_email():
@@ -658,13 +1148,16 @@ def test_email():
                 }
             }
             
-            url = f"https://graph.microsoft.com/v1.0/users/{GRAPH_CONFIG['sender_email']}/sendMail"
+            url = f"{GRAPH_API_URL}/users/{GRAPH_CONFIG['sender_email']}/sendMail"
             headers = {
                 'Authorization': f'Bearer {token}',
                 'Content-Type': 'application/json'
             }
             
-            response = requests.post(url, json=message, headers=headers)
+            response = http_client.post(url, json=message, headers=headers)
+            
+            if response.status_code == 401:
+                graph_token_cache.invalidate()
             
             if response.status_code == 202:
                 return jsonify({'success': True, 'message': 'Test email sent successfully via Microsoft Graph API'})
@@ -680,17 +1173,27 @@ def test_email():
             msg['Subject'] = 'Test Email - Donor App'
             msg.attach(MIMEText('This is a test email from your donor app using SMTP.', 'plain'))
             
-            server = smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port'])
-            server.starttls()
-            server.login(EMAIL_CONFIG['sender_email'], EMAIL_CONFIG['sender_password'])
-            server.send_message(msg)
-            server.quit()
+            smtp_pool.send_message(msg)
             
             return jsonify({'success': True, 'message': 'Test email sent successfully via SMTP'})
             
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/graph/token-cache', methods=['GET'])
+def graph_token_cache_status():
+    """Hit/miss/refresh counters for the Microsoft Graph token cache"""
+    return jsonify({'success': True, 'tokenCache': graph_token_cache.status()})
+
+@app.route('/api/settings/cache', methods=['GET'])
+def settings_cache_status():
+    """Hit/miss counters for the in-memory settings cache"""
+    return jsonify({'success': True, 'settingsCache': {
+        'locations': locations_setting.status(),
+        'formTitle': form_title_setting.status(),
+        'emailTemplate': email_template_setting.status()
+    }})
+
 @app.route('/')
 def index():
     """Serve the main HTML page"""
@@ -701,14 +1204,20 @@ def settings_page():
     """Serve the settings page"""
     return send_file('settings.html')
 
+@app.route('/sw.js')
+def service_worker():
+    """Serve the kiosk service worker from the site root so it controls every page"""
+    response = send_file('sw.js', mimetype='application/javascript')
+    # Browsers must always pick up a new version of the worker
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     """Serve static files (images, etc.)"""
     from flask import send_from_directory
     return send_from_directory('static', filename)
 
-# Email template storage file (will be redefined below with persistent path)
-
 def get_default_email_template():
     """Get the default email template"""
     return """Dear {firstName} {lastName},
@@ -730,21 +1239,19 @@ Thank You!
 
 Your friends at Goodwill South Florida"""
 
+email_template_setting = CachedSetting(
+    EMAIL_TEMPLATE_FILE, parse=lambda text: text, dump=lambda template: template,
+    default=get_default_email_template, max_age=SETTINGS_CACHE_MAX_AGE
+)
+
 def load_email_template():
     """Load email template from file or return default"""
-    if os.path.exists(EMAIL_TEMPLATE_FILE):
-        try:
-            with open(EMAIL_TEMPLATE_FILE, 'r', encoding='utf-8') as f:
-                return f.read()
-        except Exception as e:
-            print(f"Error loading template: {e}")
-    return get_default_email_template()
+    return email_template_setting.get()
 
 def save_email_template(template):
     """Save email template to file"""
     try:
-        with open(EMAIL_TEMPLATE_FILE, 'w', encoding='utf-8') as f:
-            f.write(template)
+        email_template_setting.save(template)
         return True
     except Exception as e:
         print(f"Error saving template: {e}")
@@ -769,6 +1276,11 @@ def update_email_template():
         if not template:
             return jsonify({'success': False, 'message': 'Template cannot be empty'}), 400
         
+        try:
+            validate_template(template)
+        except TemplateError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
         if save_email_template(template):
             return jsonify({'success': True, 'message': 'Template saved successfully'})
         else:
@@ -789,36 +1301,27 @@ def reset_email_template():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # Location Management
-# Use /home directory on Azure (persists across deployments) or local directory
-PERSISTENT_DIR = '/home' if os.path.exists('/home/site/wwwroot') else '.'
-LOCATIONS_FILE = os.path.join(PERSISTENT_DIR, 'donation_locations.json')
-FORM_TITLE_FILE = os.path.join(PERSISTENT_DIR, 'form_title.txt')
-EMAIL_TEMPLATE_FILE = os.path.join(PERSISTENT_DIR, 'email_template.txt')
+def get_default_locations():
+    """Locations used until some are saved"""
+    return [
+        "Gulliver Prep | Marian C. Krutulis PK-8 Campus",
+        "Gulliver Prep | Upper School Campus"
+    ]
+
+locations_setting = CachedSetting(
+    LOCATIONS_FILE, parse=json.loads, dump=lambda locations: json.dumps(locations, indent=2),
+    default=get_default_locations, max_age=SETTINGS_CACHE_MAX_AGE
+)
 
 def load_locations():
     """Load locations from file"""
-    try:
-        if os.path.exists(LOCATIONS_FILE):
-            with open(LOCATIONS_FILE, 'r') as f:
-                return json.load(f)
-        else:
-            # Default locations
-            return [
-                "Gulliver Prep | Marian C. Krutulis PK-8 Campus",
-                "Gulliver Prep | Upper School Campus"
-            ]
-    except Exception as e:
-        print(f"Error loading locations: {e}")
-        return [
-            "Gulliver Prep | Marian C. Krutulis PK-8 Campus",
-            "Gulliver Prep | Upper School Campus"
-        ]
+    # Callers add and remove entries, so hand out a copy of the cached list
+    return list(locations_setting.get())
 
 def save_locations(locations):
     """Save locations to file"""
     try:
-        with open(LOCATIONS_FILE, 'w') as f:
-            json.dump(locations, f, indent=2)
+        locations_setting.save(list(locations))
         return True
     except Exception as e:
         print(f"Error saving locations: {e}")
@@ -885,23 +1388,19 @@ def delete_location():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # Form Title Management
+form_title_setting = CachedSetting(
+    FORM_TITLE_FILE, parse=str.strip, dump=lambda title: title,
+    default=lambda: "Goodwill Donated Goods Form", max_age=SETTINGS_CACHE_MAX_AGE
+)
+
 def load_form_title():
     """Load form title from file"""
-    try:
-        if os.path.exists(FORM_TITLE_FILE):
-            with open(FORM_TITLE_FILE, 'r', encoding='utf-8') as f:
-                return f.read().strip()
-        else:
-            return "Goodwill Donated Goods Form"
-    except Exception as e:
-        print(f"Error loading form title: {e}")
-        return "Goodwill Donated Goods Form"
+    return form_title_setting.get()
 
 def save_form_title(title):
     """Save form title to file"""
     try:
-        with open(FORM_TITLE_FILE, 'w', encoding='utf-8') as f:
-            f.write(title)
+        form_title_setting.save(title.strip())
         return True
     except Exception as e:
         print(f"Error saving form title: {e}")
@@ -950,7 +1449,7 @@ def test_bloomerang():
         }
         
         test_url = f"{BLOOMERANG_CONFIG['api_url']}/constituents?take=1"
-        response = requests.get(test_url, headers=headers)
+        response = http_client.get(test_url, headers=headers, verify=BLOOMERANG_CONFIG.get('verify_ssl', True))
         
         if response.status_code == 200:
             return jsonify({
@@ -967,8 +1466,144 @@ def test_bloomerang():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# Batch Receipt Generation
+def batch_path(batch_id, extension):
+    """Path of a batch's ZIP or status file (batch ids are hex only)"""
+    if not re.fullmatch(r'[0-9a-f]{32}', batch_id):
+        raise ValueError('Invalid batch id')
+    return os.path.join(BATCH_RECEIPTS_DIR, f"{batch_id}.{extension}")
+
+def write_batch_status(batch_id, status):
+    """Persist batch progress so any worker process can report it"""
+    path = batch_path(batch_id, 'json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(status, f)
+    os.replace(path + '.tmp', path)
+
+def run_receipt_batch(batch_id, start, end):
+    """Generate a batch of receipts, recording progress as it goes"""
+    status = {'id': batch_id, 'status': 'running', 'start': start, 'end': end}
+    
+    def report(counts):
+        write_batch_status(batch_id, {**status, **counts})
+    
+    try:
+        counts = generate_batch(donor_store, batch_path(batch_id, 'zip'), dict(ORGANIZATION_INFO),
+                                start=start, end=end, progress=report)
+        write_batch_status(batch_id, {**status, **counts, 'status': 'done'})
+    except Exception as e:
+        print(f"Receipt batch {batch_id} failed: {e}")
+        write_batch_status(batch_id, {**status, 'status': 'failed', 'error': str(e)})
+
+@app.route('/api/admin/receipts/batch', methods=['POST'])
+def start_receipt_batch():
+    """Start regenerating receipts for donations in a date range"""
+    try:
+        data = request.json or {}
+        start = data.get('start') or None
+        end = data.get('end') or None
+        
+        if not os.path.exists(CSV_FILE):
+            return jsonify({'success': False, 'message': 'No data available'}), 404
+        
+        batch_id = uuid.uuid4().hex
+        os.makedirs(BATCH_RECEIPTS_DIR, exist_ok=True)
+        write_batch_status(batch_id, {'id': batch_id, 'status': 'queued', 'start': start, 'end': end})
+        threading.Thread(target=run_receipt_batch, args=(batch_id, start, end), daemon=True).start()
+        
+        return jsonify({'success': True, 'batchId': batch_id, 'statusUrl': f'/api/admin/receipts/batch/{batch_id}'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/admin/receipts/batch/<batch_id>', methods=['GET'])
+def get_receipt_batch(batch_id):
+    """Report progress of a receipt batch"""
+    try:
+        path = batch_path(batch_id, 'json')
+        if not os.path.exists(path):
+            return jsonify({'success': False, 'message': 'Batch not found'}), 404
+        with open(path, 'r', encoding='utf-8') as f:
+            return jsonify({'success': True, 'batch': json.load(f)})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/admin/receipts/batch/<batch_id>/download', methods=['GET'])
+def download_receipt_batch(batch_id):
+    """Download a finished receipt batch as a ZIP file"""
+    try:
+        path = batch_path(batch_id, 'zip')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if os.path.exists(path):
+        return send_file(os.path.abspath(path), as_attachment=True, download_name=f'receipts_{batch_id[:8]}.zip')
+    return jsonify({'success': False, 'message': 'Batch not finished or not found'}), 404
+
+@app.route('/api/bloomerang/index', methods=['GET'])
+def bloomerang_index_status():
+    """Report the state of the local constituent index"""
+    try:
+        return jsonify({'success': True, 'index': constituent_index.status()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/bloomerang/index/sync', methods=['POST'])
+def bloomerang_index_sync():
+    """Request a full rebuild of the local constituent index"""
+    if not BLOOMERANG_CONFIG.get('enabled') or not BLOOMERANG_CONFIG.get('api_key'):
+        return jsonify({'success': False, 'message': 'Bloomerang integration is not configured'}), 400
+    index_refresher.ensure_started()
+    index_refresher.request_full_sync()
+    return jsonify({'success': True, 'message': 'Full index sync started'})
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Liveness check for load balancers and the gunicorn benchmark"""
+    return jsonify({'success': True, 'pid': os.getpid(), 'warm': warmed_up_pid == os.getpid()})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Timings and counts from every worker process in Prometheus text format"""
+    lines = metrics.render()
+    lines += format_gauge('donor_jobs', 'Background jobs by status', job_store.counts(), labelname='status')
+    outbox_counts = crm_outbox.counts()
+    transaction_counts = outbox_counts.pop('transactions', {})
+    lines += format_gauge('donor_crm_outbox', 'Bloomerang sync outbox entries by status', outbox_counts, labelname='status')
+    lines += format_gauge('donor_crm_transactions', 'Bloomerang transactions by status', transaction_counts,
+                          labelname='status')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/bloomerang/outbox', methods=['GET'])
+def bloomerang_outbox_status():
+    """Outbox counts, recent dead letters and rate limiter state for the Bloomerang sync worker"""
+    try:
+        return jsonify({
+            'success': True,
+            'counts': crm_outbox.counts(),
+            'deadLetters': crm_outbox.dead_letters(limit=int(request.args.get('limit', 100))),
+            'rateLimit': bloomerang_bucket.status(),
+            'worker': crm_worker.stats,
+            'transactions': transaction_batcher.stats
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/bloomerang/outbox/retry', methods=['POST'])
+def bloomerang_outbox_retry():
+    """Put dead-lettered donors (all, or the given recordIds) back in the outbox"""
+    try:
+        data = request.get_json(silent=True) or {}
+        requeued = crm_outbox.requeue_dead(data.get('recordIds'))
+        crm_worker.wake()
+        transaction_batcher.wake()
+        return jsonify({'success': True, 'message': f'{requeued} record(s) queued for another attempt', 'requeued': requeued})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 # Initialize CSV on startup
 init_csv()
+sweep_receipts()
 
 if __name__ == '__main__':
     print("=" * 50)
@@ -988,5 +1623,6 @@ if __name__ == '__main__':
         print(f"   API Key: {'Configured' if BLOOMERANG_CONFIG.get('api_key') else 'Not configured'}")
         if not BLOOMERANG_CONFIG.get('verify_ssl', True):
             print("   ⚠️  SSL Verification: DISABLED (for local testing only!)")
+    print(f"\n⚙️  Background job workers: {JOB_WORKERS}")
     print("=" * 50)
     app.run(debug=DEBUG, host='0.0.0.0', port=PORT)
@@ -0,0 +1,167 @@
+"""
+Batch tax receipt generation from donors.csv
+Streams donor rows from the donor store, renders PDFs across a process pool and writes a ZIP (or directory) with a manifest
+
+Usage:
+    python batch_receipts.py --out receipts_2025.zip --start 2025-01-01 --end 2025-12-31
+    python batch_receipts.py --out receipts_2025 --dir
+"""
+
+import argparse
+import csv
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from donor_store import CSVDonorStore
+from receipts import render_receipt
+
+MANIFEST_FIELDS = ['Row', 'File', 'First Name', 'Last Name', 'Email', 'Donation Date', 'Location', 'Status', 'Error']
+
+
+def receipt_filename(row_number, donation):
+    name = f"{donation['lastName']}_{donation['firstName']}"
+    name = re.sub(r'[^A-Za-z0-9_-]+', '', name.replace(' ', '_'))[:40] or 'donor'
+    return f"receipt_{row_number:06d}_{name}_{donation['donationDate']}.pdf"
+
+
+def _render(donation, org_info):
+    """Process pool task: render one receipt and return its bytes"""
+    return render_receipt(donation, org_info).getvalue()
+
+
+class ReceiptWriter:
+    """Writes receipts into a ZIP file or a directory"""
+
+    def __init__(self, out_path, as_directory=False):
+        self.as_directory = as_directory
+        self.out_path = out_path
+        if as_directory:
+            os.makedirs(out_path, exist_ok=True)
+            self._zip = None
+        else:
+            directory = os.path.dirname(os.path.abspath(out_path))
+            os.makedirs(directory, exist_ok=True)
+            # PDFs are already compressed, so store them as-is
+            self._zip = zipfile.ZipFile(out_path + '.tmp', 'w', compression=zipfile.ZIP_STORED)
+
+    def write(self, name, content):
+        if self._zip:
+            self._zip.writestr(name, content)
+        else:
+            with open(os.path.join(self.out_path, name), 'wb') as f:
+                f.write(content)
+
+    def write_file(self, name, source):
+        """Copy an open text file into the output"""
+        if self._zip:
+            with self._zip.open(name, 'w') as target:
+                for chunk in iter(lambda: source.read(65536), ''):
+                    target.write(chunk.encode('utf-8'))
+        else:
+            with open(os.path.join(self.out_path, name), 'w', newline='', encoding='utf-8') as target:
+                shutil.copyfileobj(source, target)
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+            os.replace(self.out_path + '.tmp', self.out_path)
+
+
+def generate_batch(store, out_path, org_info, start=None, end=None, as_directory=False,
+                   workers=None, progress=None, progress_every=50):
+    """
+    Render a receipt for every matching donation in store.
+
+    At most workers * 4 receipts are in flight at once, so memory stays flat
+    however large the CSV is. progress(counts) is called every progress_every
+    receipts and once at the end. Returns the final counts.
+    """
+    workers = workers or os.cpu_count() or 1
+    counts = {'total': sum(1 for _ in store.iter_donations(start, end)), 'done': 0, 'failed': 0, 'startedAt': time.time()}
+    # The manifest is spooled to a temp file rather than held in memory
+    manifest = tempfile.TemporaryFile('w+', newline='', encoding='utf-8')
+    manifest_writer = csv.DictWriter(manifest, fieldnames=MANIFEST_FIELDS)
+    manifest_writer.writeheader()
+
+    writer = ReceiptWriter(out_path, as_directory)
+    in_flight = deque()
+
+    def collect(entry):
+        row_number, donation, future = entry
+        filename = receipt_filename(row_number, donation)
+        status, error = 'ok', ''
+        try:
+            writer.write(filename, future.result())
+            counts['done'] += 1
+        except Exception as e:
+            status, error, filename = 'failed', str(e), ''
+            counts['failed'] += 1
+        manifest_writer.writerow({
+            'Row': row_number, 'File': filename,
+            'First Name': donation['firstName'], 'Last Name': donation['lastName'],
+            'Email': donation['email'], 'Donation Date': donation['donationDate'],
+            'Location': donation['location'], 'Status': status, 'Error': error
+        })
+        finished = counts['done'] + counts['failed']
+        if progress and finished % progress_every == 0:
+            progress(dict(counts))
+
+    # spawn keeps the pool safe to start from a threaded web worker
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            for row_number, donation in store.iter_donations(start, end):
+                in_flight.append((row_number, donation, executor.submit(_render, donation, org_info)))
+                if len(in_flight) >= workers * 4:
+                    collect(in_flight.popleft())
+            while in_flight:
+                collect(in_flight.popleft())
+
+        manifest.seek(0)
+        writer.write_file('manifest.csv', manifest)
+    finally:
+        manifest.close()
+        writer.close()
+
+    counts['finishedAt'] = time.time()
+    if progress:
+        progress(dict(counts))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Regenerate donation tax receipts from donors.csv')
+    parser.add_argument('--csv', help='Donor CSV file (defaults to CSV_FILE from config)')
+    parser.add_argument('--out', required=True, help='Output ZIP file (or directory with --dir)')
+    parser.add_argument('--dir', action='store_true', help='Write receipts into a directory instead of a ZIP')
+    parser.add_argument('--start', help='First donation date to include (YYYY-MM-DD)')
+    parser.add_argument('--end', help='Last donation date to include (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Render processes (default: CPU count)')
+    args = parser.parse_args()
+
+    # Organization details come from the same configuration the web app uses
+    from org_config import ORGANIZATION_INFO, CSV_FILE
+
+    def report(counts):
+        finished = counts['done'] + counts['failed']
+        print(f"  {finished}/{counts['total']} receipts ({counts['failed']} failed)")
+
+    print(f"Generating receipts with {args.workers} worker processes...")
+    counts = generate_batch(CSVDonorStore(args.csv or CSV_FILE), args.out, dict(ORGANIZATION_INFO), start=args.start,
+                            end=args.end, as_directory=args.dir, workers=args.workers, progress=report,
+                            progress_every=500)
+    elapsed = counts['finishedAt'] - counts['startedAt']
+    print(f"✓ {counts['done']} receipts written to {args.out} in {elapsed:.1f}s")
+    if counts['failed']:
+        print(f"⚠ {counts['failed']} receipts failed - see manifest.csv")
+
+
+if __name__ == '__main__':
+    main()
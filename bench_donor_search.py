@@ -0,0 +1,87 @@
+"""
+Benchmark the returning-donor search index
+Builds a donors.csv of synthetic donors in a temporary directory, loads it into the index and
+times searches by email, phone and name, plus incremental updates as new donations arrive.
+Usage: python bench_donor_search.py [number_of_donors]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from donor_search import DonorSearchIndex
+from donor_store import CSVDonorStore
+
+FIRST_NAMES = ['John', 'Maria', 'Jose', 'Ana', 'David', 'Carmen', 'Luis', 'Sofia', 'James', 'Laura',
+               'Carlos', 'Elena', 'Michael', 'Rosa', 'Daniel', 'Lucia', 'Robert', 'Isabel', 'Pedro', 'Sarah']
+LAST_NAMES = ['Garcia', 'Rodriguez', 'Smith', 'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Perez',
+              'Johnson', 'Sanchez', 'Ramirez', 'Torres', 'Flores', 'Rivera', 'Gomez', 'Diaz', 'Williams']
+
+
+def donation(i, rng):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return {
+        'firstName': first,
+        'lastName': last,
+        'email': f'{first}.{last}{i}@example.com'.lower(),
+        'phone': f'(305) {i // 10000 % 1000:03d}-{i % 10000:04d}',
+        'address': f'{i} Test Street, Miami, FL 33101',
+        'donationType': 'cash',
+        'donationDate': f'2025-{1 + i % 12:02d}-{1 + i % 28:02d}',
+        'location': 'Main Office'
+    }
+
+
+def timed(fn, repeat):
+    """Milliseconds per call (median of repeat calls)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(1)
+    path = os.path.join(tempfile.mkdtemp(prefix='donor-search-bench-'), 'donors.csv')
+    store = CSVDonorStore(path, fsync_batch=1000)
+    store.ensure_ready()
+    for start in range(0, count, 5000):
+        store.append_many([donation(i, rng) for i in range(start, min(start + 5000, count))])
+    store.sync()
+
+    print("=" * 50)
+    print(f"Donor search benchmark ({count} donors)")
+    print("=" * 50)
+
+    index = DonorSearchIndex(store)
+    start = time.perf_counter()
+    index.refresh()
+    print(f"Initial load: {(time.perf_counter() - start) * 1000:.0f} ms ({index.status()['terms']} terms)")
+
+    sample = donation(count // 2, random.Random(2))
+    queries = {
+        'email prefix': f'{sample["firstName"]}.{sample["lastName"]}'.lower(),
+        'phone digits': '305' + sample['phone'][6:9],
+        'name (1 word)': 'car',
+        'name (2 words)': 'maria gar',
+        'full name': 'sofia rivera'
+    }
+    print(f"{'':<18}{'ms/search':>12}{'results':>10}")
+    for label, query in queries.items():
+        ms = timed(lambda: index.search(query), 200)
+        print(f"{label:<18}{ms:>12.3f}{len(index.search(query)):>10}")
+
+    def add_one():
+        store.append(donation(rng.randrange(count * 2), rng))
+        index.refresh()
+    print(f"{'new donation':<18}{timed(add_one, 200):>12.3f}{'':>10}  (append + incremental refresh)")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
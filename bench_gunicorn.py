@@ -0,0 +1,176 @@
+"""
+Compare gunicorn worker modes for the donor app against local stand-ins for SMTP, Graph and Bloomerang
+For each mode, starts gunicorn with gunicorn.conf.py in a scratch directory and submits donations
+from several kiosks at once. Meanwhile other clients keep making requests that wait on a slow mail
+server (POST /api/test-email), as a slow SMTP or CRM call would. The report shows how far those slow calls
+hold up the kiosks.
+
+Modes: sync-1 (one sync worker, the previous startup command), sync, gthread and gevent (skipped
+unless gevent is installed). Worker counts come from gunicorn.conf.py unless --workers is given.
+
+Usage:
+    python bench_gunicorn.py
+    python bench_gunicorn.py --requests 300 --concurrency 20 --slow-latency 2 --modes sync-1 gthread
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from fake_services import FakeBloomerang, FakeGraph, FakeSMTP, parse_rate_limit
+from loadtest import APP_DIR, app_environment, percentile, submit_all
+
+MODES = {
+    'sync-1': {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_WORKERS': '1'},
+    'sync': {'GUNICORN_WORKER_CLASS': 'sync'},
+    'gthread': {'GUNICORN_WORKER_CLASS': 'gthread'},
+    'gevent': {'GUNICORN_WORKER_CLASS': 'gevent'}
+}
+
+
+def gevent_installed():
+    try:
+        import gevent  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def start_gunicorn(mode, args, fakes, workdir):
+    env = app_environment(args, fakes)
+    env.update(MODES[mode])
+    if args.workers and mode != 'sync-1':
+        env['GUNICORN_WORKERS'] = str(args.workers)
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', os.path.join(APP_DIR, 'gunicorn.conf.py'),
+         '--pythonpath', APP_DIR, '--bind', f'127.0.0.1:{args.port}', 'app:app'],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    url = f'http://127.0.0.1:{args.port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}, see {log.name}")
+        try:
+            if requests.get(f'{url}/api/health', timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not start within 60 seconds, see {log.name}")
+
+
+def slow_traffic(url, clients, stop):
+    """Keep `clients` test emails in flight until stop is set; returns their latencies"""
+    latencies = []
+
+    def client():
+        session = requests.Session()
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                session.post(f'{url}/api/test-email', json={'email': 'bench@example.com'}, timeout=120)
+            except requests.RequestException:
+                pass
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    return threads, latencies
+
+
+def run_mode(mode, args, fakes):
+    workdir = tempfile.mkdtemp(prefix=f'bench-gunicorn-{mode}-')
+    process, url = start_gunicorn(mode, args, fakes, workdir)
+    try:
+        stop = threading.Event()
+        threads, slow = slow_traffic(url, args.slow_clients, stop)
+        # Let the slow calls occupy the workers before the kiosks start
+        time.sleep(min(args.slow_latency, 1.0))
+        results, elapsed = submit_all(url, args)
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=args.slow_latency * 4 + 5)
+        latencies = [r['latency'] for r in results if r['ok']]
+        return {
+            'ok': len(latencies),
+            'failed': len(results) - len(latencies),
+            'perSecond': len(results) / elapsed if elapsed else 0,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'slow': len(slow),
+            'slowP50': percentile(slow, 50)
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=40)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def print_report(args, rows):
+    def ms(value):
+        return '-' if value is None else f'{value * 1000:.0f}'
+
+    print("=" * 78)
+    print(f"Gunicorn modes: {args.requests} donations from {args.concurrency} kiosks, "
+          f"{args.slow_clients} clients on a {args.slow_latency}s mail server")
+    print("=" * 78)
+    print(f"{'mode':<10}{'ok':>6}{'failed':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'slow calls':>12}{'slow p50':>10}")
+    for mode, row in rows:
+        if row is None:
+            print(f"{mode:<10}  skipped (pip install gevent)")
+            continue
+        print(f"{mode:<10}{row['ok']:>6}{row['failed']:>8}{row['perSecond']:>9.1f}{ms(row['p50']):>9}"
+              f"{ms(row['p95']):>9}{ms(row['p99']):>9}{row['slow']:>12}{ms(row['slowP50']):>10}")
+    print("=" * 78)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--requests', type=int, default=200, help='Donations to submit per mode')
+    parser.add_argument('--concurrency', type=int, default=10, help='Kiosks submitting at once')
+    parser.add_argument('--donors', type=int, default=50, help='Distinct donors the submissions cycle through')
+    parser.add_argument('--slow-clients', type=int, default=4, help='Clients making slow test-email calls')
+    parser.add_argument('--slow-latency', type=float, default=1.0, help='Seconds the fake mail server takes per message')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the fake Graph and Bloomerang add per call')
+    parser.add_argument('--workers', type=int, default=None, help='GUNICORN_WORKERS for every mode but sync-1')
+    parser.add_argument('--port', type=int, default=5056, help='Port for gunicorn')
+    args = parser.parse_args()
+    # Settings loadtest's helpers expect
+    args.email_mode, args.no_crm, args.job_workers, args.idempotency_keys = 'smtp', False, None, False
+
+    fakes = {
+        'bloomerang': FakeBloomerang(latency=args.latency, rate_limit=parse_rate_limit('1000/10')).start(),
+        'graph': FakeGraph(latency=args.latency).start(),
+        'smtp': FakeSMTP(latency=args.slow_latency).start()
+    }
+    rows = []
+    try:
+        for mode in args.modes:
+            if mode == 'gevent' and not gevent_installed():
+                rows.append((mode, None))
+                continue
+            print(f"Running {mode}...")
+            rows.append((mode, run_mode(mode, args, fakes)))
+    finally:
+        for fake in fakes.values():
+            fake.stop()
+    print_report(args, rows)
+
+
+if __name__ == "__main__":
+    main()
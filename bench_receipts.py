@@ -0,0 +1,64 @@
+"""
+Benchmark PDF receipt rendering with and without the cached static layer
+Usage: python bench_receipts.py [number_of_receipts]
+"""
+
+import sys
+import time
+
+from receipts import ReceiptRenderer
+
+ORGANIZATION_INFO = {
+    'name': 'Goodwill Industries of South Florida, Inc.',
+    'address': '2121 NW 21st Street, Miami, FL 33142',
+    'tax_id': 'XX-XXXXXXX',
+    'phone': '(305) 325-9114',
+    'email': 'info@goodwillsouthflorida.org'
+}
+
+SAMPLE_DONATION = {
+    'firstName': 'John',
+    'lastName': 'Doe',
+    'email': 'test@example.com',
+    'phone': '(555) 123-4567',
+    'address': '123 Test Street, Miami, FL 33101',
+    'donationType': 'merchandise',
+    'merchandiseItems': ['Clothing', 'Books', 'Shoes'],
+    'donationDate': '2024-01-15',
+    'location': 'Main Office'
+}
+
+
+def run(count, use_cache):
+    """Render count receipts; returns (CPU ms per receipt, average bytes per receipt)"""
+    renderer = ReceiptRenderer()
+    # Warm up imports and font metrics so neither run pays for them
+    renderer.render(SAMPLE_DONATION, ORGANIZATION_INFO, use_cache=use_cache)
+
+    total_bytes = 0
+    start = time.process_time()
+    for _ in range(count):
+        total_bytes += len(renderer.render(SAMPLE_DONATION, ORGANIZATION_INFO, use_cache=use_cache).getvalue())
+    elapsed = time.process_time() - start
+    return elapsed * 1000 / count, total_bytes / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    print("=" * 50)
+    print(f"Receipt rendering benchmark ({count} receipts)")
+    print("=" * 50)
+
+    before_ms, before_bytes = run(count, use_cache=False)
+    after_ms, after_bytes = run(count, use_cache=True)
+
+    print(f"{'':<22}{'CPU ms/receipt':>15}{'bytes/receipt':>15}")
+    print(f"{'Full render (before)':<22}{before_ms:>15.3f}{before_bytes:>15.0f}")
+    print(f"{'Cached static layer':<22}{after_ms:>15.3f}{after_bytes:>15.0f}")
+    print("=" * 50)
+    print(f"CPU time saved per receipt: {before_ms - after_ms:.3f} ms ({(1 - after_ms / before_ms) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
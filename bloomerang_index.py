@@ -0,0 +1,351 @@
+"""
+Local index of Bloomerang constituents for matching donors without calling the CRM
+Built by a one-time full sync and kept current by incremental refreshes
+"""
+
+import os
+import threading
+import time
+
+import http_client
+from sqlite_db import ThreadLocalConnection, transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS constituents (
+    id INTEGER PRIMARY KEY,
+    email TEXT,
+    phone TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    full_name TEXT,
+    synced_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_constituents_email ON constituents (email);
+CREATE INDEX IF NOT EXISTS idx_constituents_phone ON constituents (phone);
+CREATE INDEX IF NOT EXISTS idx_constituents_name ON constituents (first_name, last_name);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+PAGE_SIZE = 50  # Maximum allowed by Bloomerang
+
+
+def normalize_email(value):
+    return (value or '').lower().strip()
+
+
+def normalize_phone(value):
+    """Digits only, so (555) 123-4567 and 555.123.4567 compare equal"""
+    return ''.join(filter(str.isdigit, value or ''))
+
+
+def normalize_name(value):
+    return (value or '').lower().strip()
+
+
+def constituent_fields(constituent):
+    """Pull the normalized email, phone and name out of a Bloomerang constituent record"""
+    # Bloomerang stores email in PrimaryEmail object; some API versions use EmailAddress
+    email = ''
+    primary_email_obj = constituent.get('PrimaryEmail', {})
+    if isinstance(primary_email_obj, dict):
+        email = primary_email_obj.get('Value', '') or ''
+    if not email:
+        email = constituent.get('EmailAddress', '') or ''
+
+    # Bloomerang stores phone in PrimaryPhone.Number; some API versions use PhoneNumber
+    phone = ''
+    primary_phone_obj = constituent.get('PrimaryPhone', {})
+    if isinstance(primary_phone_obj, dict):
+        phone = primary_phone_obj.get('Number', '') or ''
+    if not phone:
+        phone = constituent.get('PhoneNumber', '') or ''
+
+    return {
+        'email': normalize_email(email),
+        'phone': normalize_phone(phone),
+        'first_name': normalize_name(constituent.get('FirstName')),
+        'last_name': normalize_name(constituent.get('LastName'))
+    }
+
+
+def match_constituent(data, constituent):
+    """
+    Score a Bloomerang record against donor data.
+    Strong match: Email OR (Phone + Name). Returns (score, matched fields).
+    """
+    fields = constituent_fields(constituent)
+    donor_email = normalize_email(data.get('email'))
+    donor_phone = normalize_phone(data.get('phone'))
+    score = 0
+    matched = []
+
+    if fields['email'] and donor_email and fields['email'] == donor_email:
+        score += 100  # Email match is strongest
+        matched.append('email')
+    if fields['phone'] and len(donor_phone) >= 10 and fields['phone'] == donor_phone:
+        score += 50  # Phone match is good
+        matched.append('phone')
+    if (fields['first_name'] == normalize_name(data.get('firstName'))
+            and fields['last_name'] == normalize_name(data.get('lastName'))):
+        score += 30  # Name match
+        matched.append('name')
+
+    return score, matched
+
+
+def fetch_constituents_page(config, skip, take=PAGE_SIZE, order_direction='Desc', http=None):
+    """Fetch one page of constituents from Bloomerang, ordered by Id (http defaults to the shared client)"""
+    headers = {
+        'X-API-Key': config['api_key'],
+        'Content-Type': 'application/json'
+    }
+    params = {
+        'skip': skip,
+        'take': take,
+        'orderBy': 'Id',
+        'orderDirection': order_direction
+    }
+    response = (http or http_client.client).get(f"{config['api_url']}/constituents", headers=headers, params=params,
+                                                verify=config.get('verify_ssl', True))
+    if response.status_code != 200:
+        raise Exception(f"Bloomerang constituent page failed: {response.status_code} - {response.text}")
+    return response.json().get('Results') or []
+
+
+class ConstituentIndex:
+    """SQLite-persisted constituent lookup keyed by email, phone digits and (first, last) name"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = ThreadLocalConnection(db_path, on_connect=lambda conn: conn.executescript(SCHEMA))
+
+    # State helpers
+    def get_state(self, key, default=None):
+        row = self._conn.get().execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_state(self, key, value, conn=None):
+        (conn or self._conn.get()).execute(
+            'INSERT INTO sync_state (key, value) VALUES (?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            (key, str(value))
+        )
+
+    @staticmethod
+    def _lease_owner():
+        return f"{os.getpid()}-{threading.get_ident()}"
+
+    def try_lease(self, name, ttl):
+        """Take (or renew) a named lease for ttl seconds so only one worker process runs a sync at a time"""
+        now = time.time()
+        owner = self._lease_owner()
+        conn = self._conn.get()
+        with transaction(conn):
+            row = conn.execute('SELECT value FROM sync_state WHERE key = ?', (f'lease:{name}',)).fetchone()
+            if row:
+                holder, expires = row['value'].rsplit('@', 1)
+                if float(expires) > now and holder != owner:
+                    return False
+            self.set_state(f'lease:{name}', f'{owner}@{now + ttl}', conn=conn)
+        return True
+
+    def release_lease(self, name):
+        """Drop the lease only if this thread still holds it; an expired lease may belong to someone else now"""
+        self._conn.get().execute(
+            "DELETE FROM sync_state WHERE key = ? AND value LIKE ? || '@%'",
+            (f'lease:{name}', self._lease_owner())
+        )
+
+    def is_ready(self):
+        """True once a full sync has completed, so the index covers the whole database"""
+        return self.get_state('last_full_sync') is not None
+
+    def status(self):
+        conn = self._conn.get()
+        count = conn.execute('SELECT COUNT(*) AS n FROM constituents').fetchone()['n']
+        return {
+            'ready': self.is_ready(),
+            'constituents': count,
+            'maxId': int(self.get_state('max_id', 0)),
+            'lastFullSync': self.get_state('last_full_sync'),
+            'lastRefresh': self.get_state('last_refresh')
+        }
+
+    # Writes
+    def add(self, constituents, conn=None):
+        """
+        Insert or update constituent records as returned by the Bloomerang API.
+        Does not move the max_id watermark: only full_sync/refresh do, since a constituent
+        created here can have a higher Id than ones created elsewhere that refresh hasn't seen yet.
+        """
+        now = time.time()
+        rows = []
+        for constituent in constituents:
+            if constituent.get('Id') is None:
+                continue
+            fields = constituent_fields(constituent)
+            rows.append((
+                int(constituent['Id']), fields['email'] or None, fields['phone'] or None,
+                fields['first_name'], fields['last_name'], constituent.get('FullName'), now
+            ))
+        if not rows:
+            return 0
+
+        conn = conn or self._conn.get()
+        conn.executemany(
+            'INSERT INTO constituents (id, email, phone, first_name, last_name, full_name, synced_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(id) DO UPDATE SET email = excluded.email, phone = excluded.phone, '
+            'first_name = excluded.first_name, last_name = excluded.last_name, '
+            'full_name = excluded.full_name, synced_at = excluded.synced_at',
+            rows
+        )
+        return len(rows)
+
+    # Lookups
+    def find_match(self, data):
+        """
+        Resolve donor data to an indexed constituent.
+        Strong match: Email OR (Phone + Name), same rule as the CRM search it replaces.
+        Returns {'id', 'full_name', 'matched'} or None.
+        """
+        conn = self._conn.get()
+        donor_email = normalize_email(data.get('email'))
+        donor_phone = normalize_phone(data.get('phone'))
+        donor_first = normalize_name(data.get('firstName'))
+        donor_last = normalize_name(data.get('lastName'))
+
+        if donor_email:
+            row = conn.execute(
+                'SELECT * FROM constituents WHERE email = ? ORDER BY id DESC LIMIT 1', (donor_email,)
+            ).fetchone()
+            if row:
+                return {'id': row['id'], 'full_name': row['full_name'], 'matched': ['email']}
+
+        if len(donor_phone) >= 10:
+            row = conn.execute(
+                'SELECT * FROM constituents WHERE phone = ? AND first_name = ? AND last_name = ? '
+                'ORDER BY id DESC LIMIT 1',
+                (donor_phone, donor_first, donor_last)
+            ).fetchone()
+            if row:
+                return {'id': row['id'], 'full_name': row['full_name'], 'matched': ['phone', 'name']}
+
+        return None
+
+    # Syncing
+    def full_sync(self, config, http=None):
+        """Page through every constituent (oldest first) and rebuild the index"""
+        if not self.try_lease('sync', ttl=3600):
+            print("Bloomerang index sync already running in another worker")
+            return False
+
+        try:
+            started = time.time()
+            skip = 0
+            total = 0
+            max_id = 0
+            while True:
+                results = fetch_constituents_page(config, skip, order_direction='Asc', http=http)
+                if not results:
+                    break
+                conn = self._conn.get()
+                with transaction(conn):
+                    total += self.add(results, conn=conn)
+                max_id = max([max_id] + [int(c['Id']) for c in results if c.get('Id') is not None])
+                skip += len(results)
+                if len(results) < PAGE_SIZE:
+                    break
+                # Renew the lease each page so a long sync isn't taken over halfway through
+                if not self.try_lease('sync', ttl=3600):
+                    print("Bloomerang index sync lease lost; stopping full sync")
+                    return False
+
+            # Anything not seen during the sync was deleted or merged in Bloomerang
+            conn = self._conn.get()
+            with transaction(conn):
+                conn.execute('DELETE FROM constituents WHERE synced_at < ?', (started,))
+                self.set_state('max_id', max_id, conn=conn)
+                self.set_state('last_full_sync', time.time(), conn=conn)
+            print(f"Bloomerang index full sync complete: {total} constituents")
+            return True
+        finally:
+            self.release_lease('sync')
+
+    def refresh(self, config, http=None):
+        """Fetch constituents created since the last sync (newest first, stop at the known max Id)"""
+        if not self.try_lease('sync', ttl=600):
+            return 0
+
+        try:
+            known_max = int(self.get_state('max_id', 0))
+            newest = known_max
+            skip = 0
+            added = 0
+            while True:
+                results = fetch_constituents_page(config, skip, order_direction='Desc', http=http)
+                new = [c for c in results if c.get('Id') is not None and int(c['Id']) > known_max]
+                if new:
+                    newest = max([newest] + [int(c['Id']) for c in new])
+                    conn = self._conn.get()
+                    with transaction(conn):
+                        added += self.add(new, conn=conn)
+                if len(new) < len(results) or len(results) < PAGE_SIZE:
+                    break
+                skip += len(results)
+            conn = self._conn.get()
+            with transaction(conn):
+                self.set_state('max_id', newest, conn=conn)
+                self.set_state('last_refresh', time.time(), conn=conn)
+            if added:
+                print(f"Bloomerang index refresh: {added} new constituents")
+            return added
+        finally:
+            self.release_lease('sync')
+
+
+class IndexRefresher:
+    """
+    Background thread that builds the index once and then refreshes it periodically.
+    Pages are fetched through http (the rate-limited Bloomerang client) when given.
+    """
+
+    def __init__(self, index, get_config, refresh_interval=300, full_sync_interval=86400, http=None):
+        self.index = index
+        self.get_config = get_config
+        self.http = http
+        self.refresh_interval = refresh_interval
+        self.full_sync_interval = full_sync_interval
+        self._started_pid = None
+        self._lock = threading.Lock()
+        self._full_sync_requested = threading.Event()
+
+    def ensure_started(self):
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='bloomerang-index', daemon=True).start()
+            self._started_pid = os.getpid()
+
+    def request_full_sync(self):
+        self._full_sync_requested.set()
+
+    def _run(self):
+        while True:
+            config = self.get_config()
+            if config.get('enabled') and config.get('api_key'):
+                try:
+                    last_full = float(self.index.get_state('last_full_sync', 0))
+                    if self._full_sync_requested.is_set() or time.time() - last_full > self.full_sync_interval:
+                        self._full_sync_requested.clear()
+                        self.index.full_sync(config, http=self.http)
+                    else:
+                        self.index.refresh(config, http=self.http)
+                except Exception as e:
+                    print(f"Bloomerang index sync error: {e}")
+            self._full_sync_requested.wait(self.refresh_interval)
@@ -0,0 +1,663 @@
+"""
+Bloomerang CRM sync worker
+Donors waiting to be synced sit in a persistent SQLite outbox. A background worker drains it
+in batches through a token-bucket rate limiter fed by Bloomerang's rate-limit response headers,
+resolves each donor once per batch even if they donated several times, retries failures with
+jittered exponential backoff and moves entries that keep failing to a dead-letter list.
+Once a donor's constituent is known, the donation's in-kind transaction is posted by a second
+worker that flushes all waiting transactions together every flush window.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+from bloomerang_index import normalize_email, normalize_name, normalize_phone
+from sqlite_db import ClaimHeartbeat, ThreadLocalConnection, transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS crm_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_id TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL,
+    match_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    constituent_id INTEGER,
+    result TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_crm_outbox_status ON crm_outbox (status, available_at);
+"""
+
+# Transaction stage columns (added to outboxes created before transactions were posted)
+TRANSACTION_COLUMNS = [
+    ('txn_status', 'TEXT'),
+    ('txn_attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ('txn_available_at', 'REAL'),
+    ('txn_claimed_at', 'REAL'),
+    ('txn_error', 'TEXT'),
+    ('transaction_id', 'INTEGER')
+]
+
+
+def _init_schema(conn):
+    conn.executescript(SCHEMA)
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(crm_outbox)')]
+    for name, definition in TRANSACTION_COLUMNS:
+        if name not in columns:
+            conn.execute(f'ALTER TABLE crm_outbox ADD COLUMN {name} {definition}')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_crm_outbox_txn ON crm_outbox (txn_status, txn_available_at)')
+
+
+# Outbox entry status values
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+DEAD = 'dead'
+
+# Header names seen for rate-limit information (IETF draft and common X- variants)
+LIMIT_HEADERS = ('RateLimit-Limit', 'X-RateLimit-Limit', 'X-Rate-Limit-Limit')
+REMAINING_HEADERS = ('RateLimit-Remaining', 'X-RateLimit-Remaining', 'X-Rate-Limit-Remaining')
+RESET_HEADERS = ('RateLimit-Reset', 'X-RateLimit-Reset', 'X-Rate-Limit-Reset')
+
+# Lowest token rate (tokens/second) the bucket runs at, so a 0 setting or header can't stall it for good
+MIN_RATE = 0.01
+
+
+class RateLimited(Exception):
+    """The API answered 429; retry_after is how long to wait (seconds)"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited by Bloomerang, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class AuthFailed(RateLimited):
+    """The API rejected the key (401/403); handled like a rate limit, so nothing is dead-lettered while it is fixed"""
+
+    def __init__(self, status_code, retry_after):
+        Exception.__init__(self, f"Bloomerang rejected the API key ({status_code}), pausing for {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class PermanentSyncError(Exception):
+    """A failure that retrying cannot fix (e.g. the API rejected the donor's data)"""
+
+
+def match_key(data):
+    """Key identifying the same donor across submissions (email, else phone + name)"""
+    email = normalize_email(data.get('email'))
+    if email:
+        return 'email:' + email
+    return 'phone:{}:{}:{}'.format(
+        normalize_phone(data.get('phone')), normalize_name(data.get('firstName')), normalize_name(data.get('lastName'))
+    )
+
+
+def _header_number(headers, names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+def rate_limit_from_headers(headers):
+    """(limit, remaining, reset_seconds) from a response; values missing from the headers are None"""
+    reset = _header_number(headers, RESET_HEADERS)
+    if reset is not None and reset > 1e9:
+        # Some APIs send an epoch timestamp instead of seconds
+        reset = max(0.0, reset - time.time())
+    return _header_number(headers, LIMIT_HEADERS), _header_number(headers, REMAINING_HEADERS), reset
+
+
+def retry_after_seconds(response, default=10):
+    value = response.headers.get('Retry-After')
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        reset = rate_limit_from_headers(response.headers)[2]
+        return reset if reset is not None else default
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens/second up to capacity.
+
+    observe() corrects the bucket from the server's own count of remaining
+    requests, so several worker processes sharing one API key back off together:
+    until the server's window resets, the rate is at most what remains of the window
+    spread over the time left in it, then it goes back to the configured rate.
+    """
+
+    def __init__(self, rate=5.0, capacity=10):
+        rate = max(float(rate), MIN_RATE)
+        self.rate = rate
+        self.configured_rate = rate
+        self.capacity = max(capacity, 1)
+        self._window_ends = 0
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+        self.stats = {'acquired': 0, 'waited': 0, 'pauses': 0}
+
+    def _refill(self, now):
+        if self._window_ends and now >= self._window_ends:
+            self.rate = self.configured_rate
+            self._window_ends = 0
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Take a token, sleeping until one is available"""
+        waited = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.stats['acquired'] += 1
+                    if waited:
+                        self.stats['waited'] += 1
+                    return
+                delay = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            waited = True
+            time.sleep(min(delay, 5))
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next seconds (after a 429)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self.stats['pauses'] += 1
+
+    def observe(self, headers):
+        _, remaining, reset = rate_limit_from_headers(headers)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if remaining is not None:
+                self._tokens = min(self._tokens, remaining)
+            if remaining is not None and reset:
+                if remaining <= 0:
+                    self._paused_until = max(self._paused_until, now + reset)
+                else:
+                    # Spend what is left of the server's window evenly over the rest of it
+                    self.rate = max(MIN_RATE, min(self.configured_rate, remaining / max(reset, 1)))
+                    self._window_ends = now + reset
+
+    def status(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'rate': self.rate, 'capacity': self.capacity, 'tokens': round(self._tokens, 2),
+                'pausedFor': max(0, round(self._paused_until - time.monotonic(), 1)), **self.stats
+            }
+
+
+class RateLimitedClient:
+    """
+    Bloomerang HTTP calls through the shared pooled client, one bucket token per request.
+    A 401/403 (bad or rotated API key) pauses the bucket for auth_pause seconds.
+    """
+
+    def __init__(self, bucket, http=None, auth_pause=300):
+        self.bucket = bucket
+        self.http = http or http_client.client
+        self.auth_pause = auth_pause
+
+    def request(self, method, url, **kwargs):
+        self.bucket.acquire()
+        # 429s are handled here (pausing the bucket) rather than by the session's retries
+        response = self.http.request(method, url, retry=False, **kwargs)
+        self.bucket.observe(response.headers)
+        if response.status_code == 429:
+            retry_after = retry_after_seconds(response)
+            self.bucket.pause(retry_after)
+            raise RateLimited(retry_after)
+        if response.status_code in (401, 403):
+            self.bucket.pause(self.auth_pause)
+            print(f"Bloomerang answered {response.status_code}: check the API key; syncing paused for {self.auth_pause}s")
+            raise AuthFailed(response.status_code, self.auth_pause)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+class SyncOutbox:
+    """SQLite outbox of donors waiting to be synced to Bloomerang"""
+
+    def __init__(self, db_path, post_transactions=True):
+        self.db_path = db_path
+        # When set, every synced donor also waits for its in-kind transaction to be posted
+        self.post_transactions = post_transactions
+        self._conn = ThreadLocalConnection(db_path, on_connect=_init_schema)
+
+    def enqueue(self, record_id, data):
+        """Add a donor to the outbox (a record already queued is left as it is)"""
+        now = time.time()
+        conn = self._conn.get()
+        with transaction(conn):
+            conn.execute(
+                'INSERT OR IGNORE INTO crm_outbox (record_id, data, match_key, status, available_at, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (record_id, json.dumps(data), match_key(data), PENDING, now, now, now)
+            )
+
+    def claim_batch(self, worker_id, limit, stale_after=300):
+        """Claim up to limit due entries (plus entries abandoned by a dead worker)"""
+        now = time.time()
+        conn = self._conn.get()
+        with transaction(conn):
+            rows = conn.execute(
+                'SELECT * FROM crm_outbox '
+                'WHERE (status = ? AND available_at <= ?) OR (status = ? AND claimed_at < ?) '
+                'ORDER BY available_at, id LIMIT ?',
+                (PENDING, now, RUNNING, now - stale_after, limit)
+            ).fetchall()
+            conn.executemany(
+                'UPDATE crm_outbox SET status = ?, claimed_by = ?, claimed_at = ?, updated_at = ? WHERE id = ?',
+                [(RUNNING, worker_id, now, now, row['id']) for row in rows]
+            )
+        return [dict(row, data=json.loads(row['data'])) for row in rows]
+
+    def renew_claims(self, worker_id, ids):
+        """Keep a batch's claims fresh while the worker is still on it"""
+        now = time.time()
+        conn = self._conn.get()
+        with transaction(conn):
+            conn.executemany(
+                'UPDATE crm_outbox SET claimed_at = ? WHERE id = ? AND status = ? AND claimed_by = ?',
+                [(now, entry_id, RUNNING, worker_id) for entry_id in ids]
+            )
+
+    def complete(self, ids, constituent_id, result):
+        now = time.time()
+        txn_status = PENDING if self.post_transactions else None
+        conn = self._conn.get()
+        with transaction(conn):
+            # A transaction already posted (e.g. before a dead letter was requeued) is never queued again
+            conn.executemany(
+                'UPDATE crm_outbox SET status = ?, constituent_id = ?, result = ?, last_error = NULL, '
+                'claimed_by = NULL, updated_at = ?, '
+                'txn_status = CASE WHEN transaction_id IS NULL THEN ? ELSE txn_status END, txn_available_at = ? '
+                'WHERE id = ?',
+                [(DONE, constituent_id, json.dumps(result), now, txn_status, now, entry_id) for entry_id in ids]
+            )
+
+    def claim_transactions(self, limit, stale_after=300):
+        """Claim up to limit synced donors whose transaction is due to be posted"""
+        now = time.time()
+        conn = self._conn.get()
+        with transaction(conn):
+            rows = conn.execute(
+                'SELECT * FROM crm_outbox WHERE status = ? AND transaction_id IS NULL AND ('
+                '(txn_status = ? AND txn_available_at <= ?) OR (txn_status = ? AND txn_claimed_at < ?)) '
+                'ORDER BY txn_available_at, id LIMIT ?',
+                (DONE, PENDING, now, RUNNING, now - stale_after, limit)
+            ).fetchall()
+            conn.executemany(
+                'UPDATE crm_outbox SET txn_status = ?, txn_claimed_at = ?, updated_at = ? WHERE id = ?',
+                [(RUNNING, now, now, row['id']) for row in rows]
+            )
+        # maybe_posted: an earlier attempt failed (a timeout or 5xx can come after Bloomerang saved the
+        # transaction) or was abandoned mid-post, so the post must check for the transaction first
+        return [
+            dict(row, data=json.loads(row['data']),
+                 maybe_posted=bool(row['txn_attempts'] or row['txn_error'] or row['txn_status'] == RUNNING))
+            for row in rows
+        ]
+
+    def renew_transaction_claims(self, ids):
+        """Keep claimed transactions from being reclaimed while their posts are still waiting or running"""
+        now = time.time()
+        conn = self._conn.get()
+        with transaction(conn):
+            conn.executemany(
+                'UPDATE crm_outbox SET txn_claimed_at = ? WHERE id = ? AND txn_status = ?',
+                [(now, entry_id, RUNNING) for entry_id in ids]
+            )
+
+    def complete_transaction(self, entry_id, transaction_id):
+        now = time.time()
+        self._conn.get().execute(
+            'UPDATE crm_outbox SET txn_status = ?, transaction_id = ?, txn_error = NULL, updated_at = ? WHERE id = ?',
+            (DONE, transaction_id, now, entry_id)
+        )
+
+    def retry_transaction(self, entry_id, error, delay, count_attempt=True):
+        now = time.time()
+        self._conn.get().execute(
+            'UPDATE crm_outbox SET txn_status = ?, txn_attempts = txn_attempts + ?, txn_available_at = ?, '
+            'txn_error = ?, updated_at = ? WHERE id = ?',
+            (PENDING, 1 if count_attempt else 0, now + delay, error, now, entry_id)
+        )
+
+    def dead_letter_transaction(self, entry_id, error):
+        now = time.time()
+        self._conn.get().execute(
+            'UPDATE crm_outbox SET txn_status = ?, txn_attempts = txn_attempts + 1, txn_error = ?, updated_at = ? '
+            'WHERE id = ?',
+            (DEAD, error, now, entry_id)
+        )
+
+    def retry_later(self, ids, error, delay, count_attempt=True):
+        now = time.time()
+        conn = self._conn.get()
+        with transaction(conn):
+            conn.executemany(
+                'UPDATE crm_outbox SET status = ?, attempts = attempts + ?, available_at = ?, last_error = ?, '
+                'claimed_by = NULL, updated_at = ? WHERE id = ?',
+                [(PENDING, 1 if count_attempt else 0, now + delay, error, now, entry_id) for entry_id in ids]
+            )
+
+    def dead_letter(self, ids, error):
+        now = time.time()
+        conn = self._conn.get()
+        with transaction(conn):
+            conn.executemany(
+                'UPDATE crm_outbox SET status = ?, attempts = attempts + 1, last_error = ?, claimed_by = NULL, '
+                'updated_at = ? WHERE id = ?',
+                [(DEAD, error, now, entry_id) for entry_id in ids]
+            )
+
+    def requeue_dead(self, record_ids=None):
+        """Move dead letters (all, or the given record ids) back to pending; returns how many"""
+        now = time.time()
+        where = ' AND record_id = ?' if record_ids else ''
+        params = [(record_id,) for record_id in record_ids] if record_ids else [()]
+        requeued = 0
+        conn = self._conn.get()
+        with transaction(conn):
+            requeued += conn.executemany(
+                'UPDATE crm_outbox SET status = ?, attempts = 0, available_at = ?, updated_at = ? WHERE status = ?' + where,
+                [(PENDING, now, now, DEAD) + p for p in params]
+            ).rowcount
+            requeued += conn.executemany(
+                'UPDATE crm_outbox SET txn_status = ?, txn_attempts = 0, txn_available_at = ?, updated_at = ? '
+                'WHERE txn_status = ?' + where,
+                [(PENDING, now, now, DEAD) + p for p in params]
+            ).rowcount
+        return requeued
+
+    def get(self, record_id):
+        row = self._conn.get().execute('SELECT * FROM crm_outbox WHERE record_id = ?', (record_id,)).fetchone()
+        return self._entry(row) if row else None
+
+    def dead_letters(self, limit=100):
+        rows = self._conn.get().execute(
+            'SELECT * FROM crm_outbox WHERE status = ? OR txn_status = ? ORDER BY updated_at DESC LIMIT ?',
+            (DEAD, DEAD, limit)
+        ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def counts(self):
+        conn = self._conn.get()
+        counts = {row['status']: row['n'] for row in conn.execute(
+            'SELECT status, COUNT(*) AS n FROM crm_outbox GROUP BY status')}
+        counts['transactions'] = {row['txn_status']: row['n'] for row in conn.execute(
+            'SELECT txn_status, COUNT(*) AS n FROM crm_outbox WHERE txn_status IS NOT NULL GROUP BY txn_status')}
+        return counts
+
+    @staticmethod
+    def _entry(row):
+        """Outbox entry for API responses (donor details left out)"""
+        return {
+            'recordId': row['record_id'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'constituentId': row['constituent_id'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'lastError': row['last_error'],
+            'nextAttemptAt': row['available_at'] if row['status'] == PENDING else None,
+            'transactionStatus': row['txn_status'],
+            'transactionId': row['transaction_id'],
+            'transactionError': row['txn_error'],
+            'updatedAt': row['updated_at']
+        }
+
+
+class OutboxWorker:
+    """
+    Background thread draining the outbox.
+
+    sync_donor(data) resolves or creates the donor's constituent and returns a
+    result dict containing 'constituent_id'. It may raise RateLimited or AuthFailed
+    (the batch is put back without counting an attempt), PermanentSyncError (dead-lettered
+    at once) or any other exception (retried with backoff, dead-lettered after
+    max_attempts).
+    """
+
+    def __init__(self, outbox, sync_donor, is_enabled=lambda: True, batch_size=20, max_attempts=8,
+                 base_delay=30, max_delay=3600, poll_interval=2, claim_timeout=300):
+        self.outbox = outbox
+        # Claims not renewed for this long belong to a worker that died
+        self.claim_timeout = claim_timeout
+        self.sync_donor = sync_donor
+        self.is_enabled = is_enabled
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._started_pid = None
+        self._lock = threading.Lock()
+        self.stats = {'batches': 0, 'synced': 0, 'coalesced': 0, 'retried': 0, 'dead': 0, 'rateLimited': 0}
+
+    def ensure_started(self):
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='bloomerang-sync', daemon=True).start()
+            self._started_pid = os.getpid()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def backoff(self, attempts):
+        """Exponential backoff with full jitter around the nominal delay"""
+        delay = min(self.max_delay, self.base_delay * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _run(self):
+        worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        while True:
+            processed = 0
+            if self.is_enabled():
+                try:
+                    processed = self.run_once(worker_id)
+                except Exception as e:
+                    print(f"Bloomerang sync worker error: {e}")
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_once(self, worker_id):
+        """Claim and sync one batch; returns the number of entries handled"""
+        entries = self.outbox.claim_batch(worker_id, self.batch_size, stale_after=self.claim_timeout)
+        if not entries:
+            return 0
+        self.stats['batches'] += 1
+        ids = [entry['id'] for entry in entries]
+        with ClaimHeartbeat(lambda: self.outbox.renew_claims(worker_id, ids), self.claim_timeout / 4, name='bloomerang-claims'):
+            self._sync(entries)
+        return len(entries)
+
+    def _sync(self, entries):
+        # One lookup per donor, however many of their donations are in the batch
+        groups = {}
+        for entry in entries:
+            groups.setdefault(entry['match_key'], []).append(entry)
+
+        pending = list(groups.values())
+        while pending:
+            group = pending.pop(0)
+            ids = [entry['id'] for entry in group]
+            try:
+                result = self.sync_donor(group[0]['data'])
+            except RateLimited as e:
+                # Everything left in the batch waits out the limit; rate limits do not use up attempts
+                self.stats['rateLimited'] += 1
+                remaining = ids + [entry['id'] for g in pending for entry in g]
+                self.outbox.retry_later(remaining, str(e), e.retry_after * random.uniform(1, 1.2), count_attempt=False)
+                break
+            except PermanentSyncError as e:
+                self.stats['dead'] += len(ids)
+                self.outbox.dead_letter(ids, str(e))
+                print(f"Bloomerang sync dead-lettered {len(ids)} record(s): {e}")
+                continue
+            except Exception as e:
+                attempts = max(entry['attempts'] for entry in group) + 1
+                if attempts >= self.max_attempts:
+                    self.stats['dead'] += len(ids)
+                    self.outbox.dead_letter(ids, str(e))
+                    print(f"Bloomerang sync gave up after {attempts} attempts: {e}")
+                else:
+                    self.stats['retried'] += len(ids)
+                    self.outbox.retry_later(ids, str(e), self.backoff(attempts))
+                continue
+
+            self.stats['synced'] += len(ids)
+            self.stats['coalesced'] += len(ids) - 1
+            self.outbox.complete(ids, result.get('constituent_id'), result)
+
+
+class TransactionBatcher:
+    """
+    Background thread posting in-kind transactions for synced donors.
+
+    Every flush_window seconds all due transactions (up to batch_size) are claimed
+    together and posted concurrently over the pooled HTTP client. post_transaction(entry)
+    returns the new transaction id; it may raise RateLimited, PermanentSyncError or any
+    other exception, handled like OutboxWorker. When entry['maybe_posted'] is set an
+    earlier attempt may have reached Bloomerang, and post_transaction must look for that
+    transaction before posting again. A transaction id is stored as soon as it is known
+    and entries that have one are never claimed again, and claims are renewed while the
+    posts wait or run, so nothing is posted twice.
+    """
+
+    def __init__(self, outbox, post_transaction, on_posted=None, is_enabled=lambda: True, flush_window=5,
+                 batch_size=50, concurrency=4, max_attempts=8, base_delay=30, max_delay=3600, claim_timeout=300):
+        self.outbox = outbox
+        self.claim_timeout = claim_timeout
+        self.post_transaction = post_transaction
+        self.on_posted = on_posted
+        self.is_enabled = is_enabled
+        self.flush_window = flush_window
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._wakeup = threading.Event()
+        self._started_pid = None
+        self._lock = threading.Lock()
+        self.stats = {'flushes': 0, 'posted': 0, 'retried': 0, 'dead': 0, 'rateLimited': 0}
+
+    def ensure_started(self):
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='bloomerang-transactions', daemon=True).start()
+            self._started_pid = os.getpid()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='bloomerang-txn') as executor:
+            while True:
+                # Transactions arriving within one window are posted together
+                self._wakeup.wait(self.flush_window)
+                self._wakeup.clear()
+                if not self.is_enabled():
+                    continue
+                try:
+                    while self.flush(executor) >= self.batch_size:
+                        pass
+                except Exception as e:
+                    print(f"Bloomerang transaction worker error: {e}")
+
+    def flush(self, executor=None):
+        """Post one batch of due transactions; returns how many were claimed"""
+        entries = self.outbox.claim_transactions(self.batch_size, stale_after=self.claim_timeout)
+        if not entries:
+            return 0
+        self.stats['flushes'] += 1
+        ids = [entry['id'] for entry in entries]
+        # Renewed until every post has finished, so no other worker posts these while they wait on the bucket
+        with ClaimHeartbeat(lambda: self.outbox.renew_transaction_claims(ids), self.claim_timeout / 4, name='bloomerang-claims'):
+            if executor is None:
+                outcomes = [self._post(entry) for entry in entries]
+            else:
+                outcomes = list(executor.map(self._post, entries))
+
+        rate_limited = [(entry, outcome) for entry, outcome in zip(entries, outcomes)
+                        if isinstance(outcome, RateLimited)]
+        if rate_limited:
+            # Throttled requests do not count as attempts
+            self.stats['rateLimited'] += 1
+            retry_after = max(outcome.retry_after for _, outcome in rate_limited)
+            for entry, outcome in rate_limited:
+                self.outbox.retry_transaction(entry['id'], str(outcome), retry_after * random.uniform(1, 1.2),
+                                              count_attempt=False)
+        return len(entries)
+
+    def _post(self, entry):
+        try:
+            transaction_id = self.post_transaction(entry)
+        except RateLimited as e:
+            return e
+        except PermanentSyncError as e:
+            self.stats['dead'] += 1
+            self.outbox.dead_letter_transaction(entry['id'], str(e))
+            print(f"Bloomerang transaction for {entry['record_id']} dead-lettered: {e}")
+            return e
+        except Exception as e:
+            attempts = entry['txn_attempts'] + 1
+            if attempts >= self.max_attempts:
+                self.stats['dead'] += 1
+                self.outbox.dead_letter_transaction(entry['id'], str(e))
+                print(f"Bloomerang transaction for {entry['record_id']} gave up after {attempts} attempts: {e}")
+            else:
+                self.stats['retried'] += 1
+                self.outbox.retry_transaction(entry['id'], str(e), self.backoff(attempts))
+            return e
+
+        self.stats['posted'] += 1
+        self.outbox.complete_transaction(entry['id'], transaction_id)
+        if self.on_posted:
+            try:
+                self.on_posted(entry, transaction_id)
+            except Exception as e:
+                print(f"Could not record transaction {transaction_id} for {entry['record_id']}: {e}")
+        return transaction_id
@@ -12,7 +12,8 @@ EMAIL_CONFIG = {
     'smtp_server': 'smtp.gmail.com',
     'smtp_port': 587,
     'sender_email': 'your-email@yourdomain.org',
-    'sender_password': 'your-app-password-here'  # Gmail App Password (16 characters)
+    'sender_password': 'your-app-password-here',  # Gmail App Password (16 characters)
+    'use_tls': True  # STARTTLS; set to False only for a local test SMTP server
 }
 
 # To get Gmail App Password:
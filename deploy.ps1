@@ -46,7 +46,7 @@ Write-Host "Configuring startup command..." -ForegroundColor Yellow
 az webapp config set `
     --resource-group $RESOURCE_GROUP `
     --name $APP_NAME `
-    --startup-file "gunicorn --bind=0.0.0.0 --timeout 600 app:app"
+    --startup-file "gunicorn --config gunicorn.conf.py app:app"
 
 Write-Host ""
 Write-Host "==========================================" -ForegroundColor Cyan
@@ -47,7 +47,7 @@ echo "Configuring startup command..."
 az webapp config set \
     --resource-group $RESOURCE_GROUP \
     --name $APP_NAME \
-    --startup-file "gunicorn --bind=0.0.0.0 --timeout 600 app:app"
+    --startup-file "gunicorn --config gunicorn.conf.py app:app"
 
 echo ""
 echo "=========================================="
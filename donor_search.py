@@ -0,0 +1,181 @@
+"""
+In-memory lookup of donors already recorded, for prefilling the kiosk form
+Each gunicorn worker keeps one entry per donor (latest details) in sorted prefix lists over
+email, phone digits and name. The index tails the donor store, so donations recorded by any
+worker are picked up on the next search without rescanning history.
+"""
+
+import os
+import threading
+from bisect import bisect_left, insort
+
+from bloomerang_index import normalize_email, normalize_name, normalize_phone
+
+# Fields returned for each donor (donors.csv column -> API field)
+DONOR_FIELDS = {
+    'First Name': 'firstName',
+    'Last Name': 'lastName',
+    'Email': 'email',
+    'Phone': 'phone',
+    'Address': 'address'
+}
+
+
+def donor_key(row):
+    """Same donor across submissions: email, else phone + name"""
+    email = normalize_email(row.get('Email'))
+    if email:
+        return 'email:' + email
+    return 'phone:{}:{}:{}'.format(
+        normalize_phone(row.get('Phone')), normalize_name(row.get('First Name')), normalize_name(row.get('Last Name'))
+    )
+
+
+def donor_terms(donor):
+    """Searchable terms: e:<email>, p:<phone digits> and n:<each name word>"""
+    terms = set()
+    email = normalize_email(donor['email'])
+    if email:
+        terms.add('e:' + email)
+    digits = normalize_phone(donor['phone'])
+    if digits:
+        terms.add('p:' + digits)
+        if len(digits) > 10:
+            # Also findable without the country code
+            terms.add('p:' + digits[-10:])
+    for name in (donor['firstName'], donor['lastName']):
+        for word in normalize_name(name).split():
+            terms.add('n:' + word)
+    return terms
+
+
+class DonorSearchIndex:
+    """
+    Prefix search over recorded donors.
+
+    store must provide rows_since(position) -> (rows, position), returning (None, 0)
+    when position is past the end (the store was replaced), as the donor stores do.
+    """
+
+    def __init__(self, store, min_query=2, max_candidates=500):
+        self.store = store
+        self.min_query = min_query
+        self.max_candidates = max_candidates
+        self._lock = threading.Lock()
+        self._donors = {}
+        self._terms = []  # sorted (term, donor key)
+        self._position = 0
+        self._started_pid = None
+        self.stats = {'searches': 0, 'rows': 0, 'rebuilds': 0}
+
+    def ensure_started(self):
+        """Load the donors already recorded on a background thread (once per process)"""
+        if self._started_pid == os.getpid():
+            return
+        self._started_pid = os.getpid()
+        threading.Thread(target=self._load, name='donor-search-load', daemon=True).start()
+
+    def _load(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Donor search index load failed: {e}")
+
+    def refresh(self):
+        """Index rows recorded since the last refresh (by any process)"""
+        with self._lock:
+            rows, position = self.store.rows_since(self._position)
+            if rows is None:
+                self._donors, self._terms = {}, []
+                self.stats['rebuilds'] += 1
+                rows, position = self.store.rows_since(0)
+            if not rows:
+                self._position = position
+                return
+            if self._position == 0 and not self._donors:
+                self._bulk_load(rows)
+            else:
+                for row in rows:
+                    self._add(row)
+            self._position = position
+            self.stats['rows'] += len(rows)
+
+    def _update_donor(self, row):
+        """Record a row on its donor; returns (key, old terms, new terms)"""
+        key = donor_key(row)
+        donor = self._donors.get(key)
+        old_terms = donor['terms'] if donor else set()
+        if donor is None:
+            donor = self._donors[key] = {'donationCount': 0, 'lastDonationDate': ''}
+        for column, field in DONOR_FIELDS.items():
+            # Keep earlier details the donor left blank this time
+            if row.get(column) or field not in donor:
+                donor[field] = row.get(column) or ''
+        donor['donationCount'] += 1
+        donor['lastDonationDate'] = max(donor['lastDonationDate'], row.get('Donation Date') or '')
+        donor['terms'] = donor_terms(donor)
+        return key, old_terms, donor['terms']
+
+    def _bulk_load(self, rows):
+        for row in rows:
+            self._update_donor(row)
+        self._terms = sorted((term, key) for key, donor in self._donors.items() for term in donor['terms'])
+
+    def _add(self, row):
+        key, old_terms, new_terms = self._update_donor(row)
+        for term in old_terms - new_terms:
+            index = bisect_left(self._terms, (term, key))
+            if index < len(self._terms) and self._terms[index] == (term, key):
+                del self._terms[index]
+        for term in new_terms - old_terms:
+            insort(self._terms, (term, key))
+
+    def _count(self, term):
+        """Number of indexed terms starting with term"""
+        return bisect_left(self._terms, (term + '\uffff', '')) - bisect_left(self._terms, (term, ''))
+
+    def _prefix(self, term, accept=None, cap=True):
+        """Donor keys with a term starting with term (and passing accept), at most max_candidates"""
+        keys = set()
+        index = bisect_left(self._terms, (term, ''))
+        while index < len(self._terms) and (not cap or len(keys) < self.max_candidates):
+            found, key = self._terms[index]
+            if not found.startswith(term):
+                break
+            if accept is None or accept(key):
+                keys.add(key)
+            index += 1
+        return keys
+
+    def search(self, query, limit=10):
+        """Donors matching query: an email prefix, phone digits, or the start of each name word"""
+        query = (query or '').strip().lower()
+        if len(query) < self.min_query:
+            return []
+        self.refresh()
+        with self._lock:
+            self.stats['searches'] += 1
+            digits = normalize_phone(query)
+            if '@' in query:
+                keys = self._prefix('e:' + query)
+            elif digits and not any(c.isalpha() for c in query):
+                # A phone number, typed with or without punctuation
+                keys = self._prefix('p:' + digits)
+            else:
+                words = query.split()
+                if len(words) == 1:
+                    # The start of a name or of the email
+                    keys = self._prefix('n:' + words[0]) | self._prefix('e:' + words[0])
+                else:
+                    # Every word must start a name: scan the rarest word, keeping donors matching all the others
+                    words.sort(key=lambda word: self._count('n:' + word))
+                    others = [self._prefix('n:' + word, cap=False) for word in words[1:]]
+                    keys = self._prefix('n:' + words[0], lambda key: all(key in other for other in others))
+            donors = [self._donors[key] for key in keys]
+        donors.sort(key=lambda d: (d['lastDonationDate'], d['donationCount']), reverse=True)
+        return [{field: donor[field] for field in list(DONOR_FIELDS.values()) + ['donationCount', 'lastDonationDate']}
+                for donor in donors[:limit]]
+
+    def status(self):
+        with self._lock:
+            return {'donors': len(self._donors), 'terms': len(self._terms), **self.stats}
@@ -0,0 +1,172 @@
+"""
+Columnar snapshots of the donor history (Parquet, or Arrow IPC) for analytics
+Columns are typed: timestamps and dates, dictionary-encoded location and donation type,
+and a list column for merchandise items. Each refresh converts only the rows recorded
+since the previous one; the row groups already in the snapshot are carried over as they are.
+Needs pyarrow (pip install pyarrow); without it the snapshot reports itself unavailable.
+"""
+
+import json
+import os
+
+from donor_store import InterProcessLock, split_items
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+
+FORMATS = {
+    'parquet': ('donors.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('donors.arrow', 'application/vnd.apache.arrow.file')
+}
+
+
+def snapshot_schema():
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('date_recorded', pa.timestamp('ms')),
+        ('first_name', pa.string()),
+        ('last_name', pa.string()),
+        ('email', pa.string()),
+        ('phone', pa.string()),
+        ('address', pa.string()),
+        ('donation_type', category),
+        ('merchandise_items', pa.list_(pa.string())),
+        ('donation_date', pa.date32()),
+        ('location', category)
+    ])
+
+
+def rows_to_table(rows):
+    """Arrow table for donors.csv rows (dicts keyed by CSV_HEADERS); unparseable dates become null"""
+    def column(name):
+        return [row.get(name) or None for row in rows]
+
+    def timestamps(name, fmt):
+        return pc.strptime(pa.array(column(name), pa.string()), format=fmt, unit='ms', error_is_null=True)
+
+    items = [split_items(row.get('Merchandise Items')) for row in rows]
+    return pa.Table.from_pydict({
+        'date_recorded': timestamps('Date Recorded', '%Y-%m-%d %H:%M:%S'),
+        'first_name': column('First Name'),
+        'last_name': column('Last Name'),
+        'email': column('Email'),
+        'phone': column('Phone'),
+        'address': column('Address'),
+        'donation_type': column('Donation Type'),
+        'merchandise_items': items,
+        'donation_date': timestamps('Donation Date', '%Y-%m-%d').cast(pa.date32()),
+        'location': column('Location')
+    }, schema=snapshot_schema())
+
+
+class DonorSnapshot:
+    """
+    Snapshot files in directory, kept in step with a donor store.
+
+    store must provide rows_since(position) -> (rows, position) as the donor stores do;
+    source names it, so switching DONOR_STORE_BACKEND rebuilds the snapshot from the new store.
+    """
+
+    def __init__(self, directory, store, source, row_group_size=65536):
+        self.directory = directory
+        self.store = store
+        self.source = source
+        self.row_group_size = row_group_size
+        self._state_path = os.path.join(directory, 'snapshot.json')
+        self._lock = None
+
+    @staticmethod
+    def available():
+        return pa is not None
+
+    def _path(self, fmt):
+        return os.path.join(self.directory, FORMATS[fmt][0])
+
+    def _lock_file(self):
+        if self._lock is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock = InterProcessLock(os.path.join(self.directory, 'snapshot.lock'))
+        return self._lock
+
+    def _load_state(self):
+        try:
+            with open(self._state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_state(self, state):
+        tmp = self._state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, self._state_path)
+
+    def status(self):
+        state = self._load_state() or {}
+        return {'available': self.available(), 'rows': state.get('rows', 0), 'version': state.get('version', 0)}
+
+    def refresh(self):
+        """Append rows recorded since the last refresh to the Parquet snapshot; returns the state"""
+        with self._lock_file():
+            state = self._load_state()
+            path = self._path('parquet')
+            rows = None
+            if state and state.get('source') == self.source and os.path.exists(path):
+                rows, position = self.store.rows_since(state['position'])
+            keep = rows is not None
+            if not keep:
+                # First snapshot, a different store, or the store was replaced
+                state = {'source': self.source, 'position': 0, 'rows': 0, 'version': state['version'] if state else 0}
+                rows, position = self.store.rows_since(0)
+            if rows or not os.path.exists(path):
+                tmp = path + '.tmp'
+                existing = pq.ParquetFile(path) if keep else None
+                # New rows take the schema as stored in the file (Parquet's own names for list items)
+                schema = existing.schema_arrow if existing else snapshot_schema()
+                with pq.ParquetWriter(tmp, schema, compression='zstd') as writer:
+                    # Already-converted rows are copied across without going back through Python, regrouped
+                    # so that the small row groups left by frequent refreshes are merged into full ones
+                    pending, pending_rows = [], 0
+                    batches = existing.iter_batches(batch_size=self.row_group_size) if existing else []
+                    for batch in batches:
+                        pending.append(batch)
+                        pending_rows += batch.num_rows
+                        if pending_rows >= self.row_group_size:
+                            writer.write_table(pa.Table.from_batches(pending, schema), row_group_size=self.row_group_size)
+                            pending, pending_rows = [], 0
+                    tables = [pa.Table.from_batches(pending, schema)] if pending else []
+                    if rows:
+                        tables.append(rows_to_table(rows).cast(schema))
+                    if tables:
+                        writer.write_table(pa.concat_tables(tables), row_group_size=self.row_group_size)
+                if existing:
+                    existing.close()
+                os.replace(tmp, path)
+                state.update(rows=state['rows'] + len(rows), version=state['version'] + 1)
+            state['position'] = position
+            self._save_state(state)
+            return state
+
+    def export(self, fmt='parquet'):
+        """Refresh the snapshot and return the path of its file in fmt ('parquet' or 'arrow')"""
+        self.refresh()
+        if fmt == 'parquet':
+            return self._path('parquet')
+        with self._lock_file():
+            state = self._load_state()
+            path = self._path(fmt)
+            if state.get('arrowVersion') != state['version'] or not os.path.exists(path):
+                # The IPC file format needs one dictionary per column, so the batches are unified first
+                table = pq.read_table(self._path('parquet')).unify_dictionaries()
+                tmp = path + '.tmp'
+                with pa.ipc.new_file(tmp, table.schema) as writer:
+                    writer.write_table(table, max_chunksize=self.row_group_size)
+                os.replace(tmp, path)
+                state['arrowVersion'] = state['version']
+                self._save_state(state)
+            return path
@@ -0,0 +1,769 @@
+"""
+Donor storage
+donors.csv is an append-only log, safe under several gunicorn workers: appends are serialized
+across processes with an OS file lock and fsynced in group-commit batches.
+Optionally every row is also written through to an indexed SQLite database, which copies
+any rows it is missing from donors.csv on startup.
+
+Usage (bulk import an existing donors.csv into SQLite):
+    python donor_store.py import-csv donors.csv --db donors.db
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from sqlite_db import ThreadLocalConnection, transaction
+
+try:
+    import fcntl
+except ImportError:  # Windows (local development)
+    fcntl = None
+    import msvcrt
+
+# Windows opens files in text mode unless asked not to
+O_BINARY = getattr(os, 'O_BINARY', 0)
+
+CSV_HEADERS = [
+    'Date Recorded', 'First Name', 'Last Name', 'Email',
+    'Phone', 'Address', 'Donation Type', 'Merchandise Items',
+    'Donation Date', 'Location'
+]
+
+# Merchandise catalogue: the kiosk's checkboxes, with fixed ids (items seen later are numbered after them)
+MERCHANDISE_ITEMS = {
+    1: 'Clothing',
+    2: 'Books',
+    3: 'Shoes',
+    4: 'Toys',
+    5: 'Accessories',
+    6: 'Electronics',
+    7: 'House Wares',
+    8: 'Other'
+}
+
+
+# An item in a Merchandise Items cell, and an escaped character within it
+ITEM_PATTERN = re.compile(r'(?:\\.|[^,\\])+')
+ESCAPE_PATTERN = re.compile(r'\\(.)')
+
+
+def join_items(items):
+    """Merchandise Items cell: names joined by ', ' with commas inside a name escaped as '\\,'; 'N/A' if none"""
+    if not items:
+        return 'N/A'
+    return ', '.join(item.replace('\\', '\\\\').replace(',', '\\,') for item in items)
+
+
+def split_items(text):
+    """Item names from a Merchandise Items cell (the inverse of join_items; older unescaped cells read the same)"""
+    if not text or text == 'N/A':
+        return []
+    if '\\' in text:
+        items = [ESCAPE_PATTERN.sub(r'\1', item) for item in ITEM_PATTERN.findall(text)]
+    else:
+        items = text.split(',')
+    return [item.strip() for item in items if item.strip()]
+
+
+def donation_to_row(data, recorded_at=None):
+    """Flatten a submission into a donors.csv row"""
+    merchandise = join_items(data.get('merchandiseItems'))
+    return [
+        (recorded_at or datetime.now()).strftime('%Y-%m-%d %H:%M:%S'),
+        data['firstName'],
+        data['lastName'],
+        data['email'],
+        data['phone'],
+        data.get('address') or '',
+        data['donationType'],
+        merchandise,
+        data['donationDate'],
+        data['location']
+    ]
+
+
+def row_to_donation(row):
+    """Convert a donors.csv row (dict keyed by header) back into a submission dict"""
+    items = split_items(row.get('Merchandise Items', ''))
+    return {
+        'dateRecorded': row.get('Date Recorded', ''),
+        'firstName': row.get('First Name', ''),
+        'lastName': row.get('Last Name', ''),
+        'email': row.get('Email', ''),
+        'phone': row.get('Phone', ''),
+        'address': row.get('Address', ''),
+        'donationType': row.get('Donation Type', ''),
+        'merchandiseItems': items,
+        'donationDate': row.get('Donation Date', ''),
+        'location': row.get('Location', '')
+    }
+
+
+def row_matches(row, start=None, end=None, location=None, donation_type=None):
+    """True when a CSV row passes the export filters (dates are inclusive YYYY-MM-DD strings)"""
+    if start and row.get('Donation Date', '') < start:
+        return False
+    if end and row.get('Donation Date', '') > end:
+        return False
+    if location and row.get('Location') != location:
+        return False
+    if donation_type and row.get('Donation Type') != donation_type:
+        return False
+    return True
+
+
+def encode_rows(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+class InterProcessLock:
+    """Exclusive lock on a lock file, shared by every thread and process using the same path"""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._fd = None
+        self._pid = None
+        self._depth = 0
+
+    def _open(self):
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | O_BINARY, 0o644)
+            self._pid = os.getpid()
+            self._depth = 0
+
+    def acquire(self):
+        # flock is per open file, so threads in one process also need a regular lock
+        self._thread_lock.acquire()
+        try:
+            self._open()
+            if self._depth == 0:
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX)
+                else:
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    while True:
+                        try:
+                            msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            time.sleep(0.05)
+            self._depth += 1
+        except Exception:
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        try:
+            self._depth -= 1
+            if self._depth == 0:
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class CSVDonorStore:
+    """
+    donors.csv as an append-only log.
+
+    Every append takes the inter-process lock, repairs a torn final line left by
+    a crashed writer, and writes whole rows with a single O_APPEND write. Data is
+    fsynced once fsync_batch rows are pending or fsync_interval seconds after
+    the first unsynced write, whichever comes first (fsync_batch=1 syncs every row).
+    """
+
+    def __init__(self, path, fsync_batch=1, fsync_interval=1.0):
+        self.path = path
+        self.fsync_batch = max(1, int(fsync_batch))
+        self.fsync_interval = fsync_interval
+        self.lock = InterProcessLock(path + '.lock')
+        self._pending = 0
+        self._sync_lock = threading.Lock()
+        self._timer = None
+        self.stats = {'appends': 0, 'rows': 0, 'fsyncs': 0, 'repairs': 0}
+
+    def ensure_ready(self):
+        """Create the file with its header (exactly once across workers) and repair a torn tail"""
+        with self.lock:
+            self._prepare()
+
+    def _prepare(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | O_BINARY, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size == 0:
+                os.write(fd, encode_rows([CSV_HEADERS]))
+                os.fsync(fd)
+                return
+            os.lseek(fd, size - 1, os.SEEK_SET)
+            if os.read(fd, 1) != b'\n':
+                self._repair(fd, size)
+        finally:
+            os.close(fd)
+
+    def _repair(self, fd, size):
+        """Cut a partially written final row back to the last complete line"""
+        chunk = min(size, 1 << 16)
+        position = size
+        while position > 0:
+            start = max(0, position - chunk)
+            os.lseek(fd, start, os.SEEK_SET)
+            data = os.read(fd, position - start)
+            newline = data.rfind(b'\n')
+            if newline != -1:
+                keep = start + newline + 1
+                break
+            position = start
+        else:
+            keep = 0
+
+        os.lseek(fd, keep, os.SEEK_SET)
+        fragment = os.read(fd, size - keep)
+        with open(self.path + '.torn', 'ab') as f:
+            f.write(fragment + b'\n')
+        os.ftruncate(fd, keep)
+        os.fsync(fd)
+        self.stats['repairs'] += 1
+        print(f"Donor store: removed torn final line ({len(fragment)} bytes) from {self.path}, saved to {self.path}.torn")
+
+        if keep == 0:
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, encode_rows([CSV_HEADERS]))
+
+    def append(self, data, recorded_at=None, record_id=None):
+        """Append one donation"""
+        self.append_many([data], recorded_at=recorded_at, record_ids=[record_id])
+
+    def append_many(self, records, recorded_at=None, record_ids=None):
+        """Append several donations as one write (they land together or not at all)"""
+        payload = encode_rows([donation_to_row(data, recorded_at) for data in records])
+        with self.lock:
+            self._prepare()
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | O_BINARY)
+            try:
+                written = 0
+                while written < len(payload):
+                    written += os.write(fd, payload[written:])
+                self._pending += len(records)
+                if self._pending >= self.fsync_batch:
+                    os.fsync(fd)
+                    self._pending = 0
+                    self.stats['fsyncs'] += 1
+            finally:
+                os.close(fd)
+            self.stats['appends'] += 1
+            self.stats['rows'] += len(records)
+
+        if self._pending:
+            self._schedule_sync()
+
+    def _schedule_sync(self):
+        with self._sync_lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.fsync_interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def sync(self):
+        """fsync any rows written but not yet synced"""
+        with self._sync_lock:
+            self._timer = None
+        with self.lock:
+            if not self._pending:
+                return
+            fd = os.open(self.path, os.O_RDONLY | O_BINARY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._pending = 0
+            self.stats['fsyncs'] += 1
+
+    def set_crm_ids(self, record_id, constituent_id, transaction_id):
+        """donors.csv is append-only, so Bloomerang ids are only kept in the sync outbox"""
+        return False
+
+    def get_crm_ids(self, record_id):
+        return None
+
+    def version(self):
+        """(size, mtime) of donors.csv; changes with every append"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return 0, 0.0
+        return st.st_size, st.st_mtime
+
+    def iter_rows(self, start=None, end=None, location=None, donation_type=None):
+        """Yield each stored row matching the filters as a dict, ignoring a final line that is still being written"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(line for line in f if line.endswith('\n'))
+            for row in reader:
+                if row_matches(row, start, end, location, donation_type):
+                    yield row
+
+    def rows_since(self, offset=0):
+        """
+        Rows appended after byte offset (0 = all rows) and the offset to continue from.
+        Returns (None, 0) if the file is now shorter than offset (it was replaced).
+        A final line that is still being written is left for the next call.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() < offset:
+                    return None, 0
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return ([], 0) if offset == 0 else (None, 0)
+        end = data.rfind(b'\n') + 1
+        reader = csv.reader(io.StringIO(data[:end].decode('utf-8'), newline=''))
+        if offset == 0:
+            next(reader, None)  # header
+        return [dict(zip(CSV_HEADERS, row)) for row in reader if row], offset + end
+
+    def iter_donations(self, start=None, end=None):
+        """Yield (row_number, donation) for rows whose donation date is within [start, end]"""
+        for row_number, row in enumerate(self.iter_rows(), start=1):
+            if row_matches(row, start, end):
+                yield row_number, row_to_donation(row)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS donations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_id TEXT UNIQUE,
+    date_recorded TEXT NOT NULL,
+    first_name TEXT,
+    last_name TEXT,
+    email TEXT,
+    email_normalized TEXT,
+    phone TEXT,
+    phone_digits TEXT,
+    address TEXT,
+    donation_type TEXT,
+    merchandise_items TEXT,
+    donation_date TEXT,
+    location TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_donations_email ON donations (email_normalized);
+CREATE INDEX IF NOT EXISTS idx_donations_phone ON donations (phone_digits);
+CREATE TABLE IF NOT EXISTS csv_sync (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_donations_date ON donations (donation_date);
+CREATE INDEX IF NOT EXISTS idx_donations_location ON donations (location, donation_date);
+CREATE TABLE IF NOT EXISTS merchandise_items (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+"""
+
+# Bloomerang ids stored back on each donation once synced, and its merchandise as a JSON array of
+# merchandise_items ids (added to databases created before them)
+SQLITE_EXTRA_COLUMNS = [('constituent_id', 'INTEGER'), ('transaction_id', 'INTEGER'), ('item_ids', 'TEXT')]
+
+# PRAGMA user_version once merchandise text written by older versions has moved into item_ids
+SQLITE_ITEMS_VERSION = 1
+
+SQLITE_COLUMNS = [
+    'date_recorded', 'first_name', 'last_name', 'email', 'phone', 'address',
+    'donation_type', 'merchandise_items', 'donation_date', 'location'
+]
+
+# Columns read back into rows: the CSV columns between the row id and the merchandise item ids
+SELECT_COLUMNS = ', '.join(['id'] + SQLITE_COLUMNS + ['item_ids'])
+
+
+def _sqlite_values(row, record_id=None):
+    """Column values for a donors.csv-style row (list in CSV_HEADERS order)"""
+    email = row[3] or ''
+    phone = row[4] or ''
+    return (
+        record_id, *row, email.lower().strip(), ''.join(filter(str.isdigit, phone))
+    )
+
+
+def _init_sqlite(conn):
+    conn.executescript(SQLITE_SCHEMA)
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(donations)')]
+    for name, definition in SQLITE_EXTRA_COLUMNS:
+        if name not in columns:
+            conn.execute(f'ALTER TABLE donations ADD COLUMN {name} {definition}')
+    conn.executemany('INSERT OR IGNORE INTO merchandise_items (id, name) VALUES (?, ?)', MERCHANDISE_ITEMS.items())
+    if conn.execute('PRAGMA user_version').fetchone()[0] < SQLITE_ITEMS_VERSION:
+        _migrate_items(conn)
+
+
+def _item_id(conn, name):
+    conn.execute('INSERT OR IGNORE INTO merchandise_items (name) VALUES (?)', (name,))
+    return conn.execute('SELECT id FROM merchandise_items WHERE name = ?', (name,)).fetchone()['id']
+
+
+def _migrate_items(conn):
+    """Move merchandise text written by older versions into item_ids"""
+    with transaction(conn):
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= SQLITE_ITEMS_VERSION:
+            return  # another process got there first
+        records = conn.execute(
+            'SELECT id, merchandise_items FROM donations WHERE merchandise_items IS NOT NULL'
+        ).fetchall()
+        item_ids = {}
+        updates = []
+        for record in records:
+            names = split_items(record['merchandise_items'])
+            for name in names:
+                if name not in item_ids:
+                    item_ids[name] = _item_id(conn, name)
+            item_array = json.dumps([item_ids[name] for name in names], separators=(',', ':')) if names else None
+            updates.append((item_array, record['id']))
+        conn.executemany('UPDATE donations SET item_ids = ?, merchandise_items = NULL WHERE id = ?', updates)
+        conn.execute(f'PRAGMA user_version = {SQLITE_ITEMS_VERSION}')
+
+
+# Marks an item array not in the cache (None is a cached value: no items)
+_UNCACHED = object()
+
+
+class SQLiteDonorStore:
+    """
+    Donations in SQLite (WAL mode) with indexes on email, phone, donation date and location.
+    Merchandise is stored as a compact array of merchandise_items catalogue ids per donation;
+    rows read back carry the usual Merchandise Items text.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = ThreadLocalConnection(db_path, on_connect=_init_sqlite)
+        # Catalogue ids never change once committed, so every thread can share these
+        self._item_ids = {}
+        self._item_names = {}
+        self._item_arrays = {}
+
+    def ensure_ready(self):
+        self._conn.get()
+
+    def append(self, data, recorded_at=None, record_id=None):
+        self.append_many([data], recorded_at=recorded_at, record_ids=[record_id])
+
+    def append_many(self, records, recorded_at=None, record_ids=None, csv_position=None):
+        """Insert several donations in one transaction"""
+        record_ids = record_ids or [None] * len(records)
+        rows = [donation_to_row(data, recorded_at) for data in records]
+        self.insert_rows(rows, record_ids, csv_position=csv_position)
+
+    def insert_rows(self, rows, record_ids=None, csv_position=None):
+        """
+        Insert donors.csv-style rows (lists in CSV_HEADERS order).
+        csv_position, when given, is stored in the same transaction as the donors.csv offset these rows reach.
+        """
+        record_ids = record_ids or [None] * len(rows)
+        conn = self._conn.get()
+        items_column = CSV_HEADERS.index('Merchandise Items')
+        # Catalogue ids and item arrays worked out in this transaction; cached once it commits
+        new_ids, arrays = {}, {}
+        with transaction(conn):
+            values = []
+            for row, record_id in zip(rows, record_ids):
+                # Item ids replace the text column
+                text = row[items_column]
+                if text not in arrays:
+                    arrays[text] = self._item_array(conn, text, new_ids)
+                item_ids = arrays[text]
+                row = list(row)
+                row[items_column] = None
+                values.append(_sqlite_values(row, record_id) + (item_ids,))
+            conn.executemany(
+                'INSERT OR IGNORE INTO donations (record_id, ' + ', '.join(SQLITE_COLUMNS) +
+                ', email_normalized, phone_digits, item_ids) VALUES (' + ', '.join(['?'] * (len(SQLITE_COLUMNS) + 4)) + ')',
+                values
+            )
+            if csv_position is not None:
+                conn.execute('INSERT OR REPLACE INTO csv_sync (id, position) VALUES (1, ?)', (csv_position,))
+        self._item_ids.update(new_ids)
+        if len(self._item_arrays) + len(arrays) > 4096:
+            self._item_arrays = {}
+        self._item_arrays.update(arrays)
+
+    def csv_position(self):
+        """donors.csv offset the rows in this database reach (None if never recorded)"""
+        row = self._conn.get().execute('SELECT position FROM csv_sync WHERE id = 1').fetchone()
+        return row['position'] if row else None
+
+    def _item_array(self, conn, text, new_ids):
+        """item_ids value for a Merchandise Items cell (donations repeat the same few combinations)"""
+        item_array = self._item_arrays.get(text, _UNCACHED)
+        if item_array is _UNCACHED:
+            names = split_items(text)
+            item_array = json.dumps(
+                [self._item_id(conn, name, new_ids) for name in names], separators=(',', ':')
+            ) if names else None
+        return item_array
+
+    def _item_id(self, conn, name, new_ids):
+        """Catalogue id for an item name; ids assigned in the open transaction go in new_ids"""
+        item_id = self._item_ids.get(name) or new_ids.get(name)
+        if item_id is None:
+            item_id = new_ids[name] = _item_id(conn, name)
+        return item_id
+
+    def _item_name(self, conn, item_id):
+        if item_id not in self._item_names:
+            self._item_names.update(
+                (row['id'], row['name']) for row in conn.execute('SELECT id, name FROM merchandise_items')
+            )
+        return self._item_names.get(item_id, '')
+
+    def _row(self, conn, record):
+        """donors.csv-style dict for a record selected with SELECT_COLUMNS"""
+        row = dict(zip(CSV_HEADERS, tuple(record)[1:-1]))
+        if row['Merchandise Items'] is None:
+            item_ids = json.loads(record['item_ids']) if record['item_ids'] else []
+            row['Merchandise Items'] = join_items([self._item_name(conn, item_id) for item_id in item_ids])
+        return row
+
+    def count(self):
+        return self._conn.get().execute('SELECT COUNT(*) AS n FROM donations').fetchone()['n']
+
+    def set_crm_ids(self, record_id, constituent_id, transaction_id):
+        """Store the Bloomerang constituent and transaction ids on a donation; returns whether it was found"""
+        cursor = self._conn.get().execute(
+            'UPDATE donations SET constituent_id = ?, transaction_id = ? WHERE record_id = ?',
+            (constituent_id, transaction_id, record_id)
+        )
+        return cursor.rowcount > 0
+
+    def get_crm_ids(self, record_id):
+        """(constituent_id, transaction_id) of a donation, or None"""
+        row = self._conn.get().execute(
+            'SELECT constituent_id, transaction_id FROM donations WHERE record_id = ?', (record_id,)
+        ).fetchone()
+        return (row['constituent_id'], row['transaction_id']) if row else None
+
+    def version(self):
+        """(row count, last row id); changes with every insert"""
+        record = self._conn.get().execute('SELECT COUNT(*) AS n, MAX(id) AS last_id FROM donations').fetchone()
+        return record['n'], record['last_id'] or 0
+
+    def iter_rows(self, start=None, end=None, location=None, donation_type=None):
+        """Yield rows matching the filters as dicts keyed by the CSV headers, oldest first"""
+        for _, row in self._select(start, end, location, donation_type):
+            yield row
+
+    def iter_donations(self, start=None, end=None):
+        """Yield (row_number, donation); row_number is the insertion order, as in donors.csv"""
+        for row_id, row in self._select(start, end):
+            yield row_id, row_to_donation(row)
+
+    def rows_since(self, last_id=0):
+        """Rows inserted after row id last_id and the id to continue from ((None, 0) if the table was emptied)"""
+        conn = self._conn.get()
+        newest = conn.execute('SELECT MAX(id) AS m FROM donations').fetchone()['m'] or 0
+        if newest < last_id:
+            return None, 0
+        records = conn.execute(
+            f'SELECT {SELECT_COLUMNS} FROM donations WHERE id > ? ORDER BY id', (last_id,)
+        ).fetchall()
+        if not records:
+            return [], last_id
+        return [self._row(conn, record) for record in records], records[-1]['id']
+
+    def _select(self, start=None, end=None, location=None, donation_type=None, batch_size=500):
+        clauses, params = [], []
+        if start:
+            clauses.append('donation_date >= ?')
+            params.append(start)
+        if end:
+            clauses.append('donation_date <= ?')
+            params.append(end)
+        if location:
+            clauses.append('location = ?')
+            params.append(location)
+        if donation_type:
+            clauses.append('donation_type = ?')
+            params.append(donation_type)
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        conn = self._conn.get()
+        cursor = conn.execute(f'SELECT {SELECT_COLUMNS} FROM donations {where} ORDER BY id', params)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            for record in batch:
+                yield record['id'], self._row(conn, record)
+
+    def import_csv(self, csv_path, batch_size=1000):
+        """Bulk-import an existing donors.csv; returns the number of rows imported"""
+        imported = 0
+        batch = []
+        for row in CSVDonorStore(csv_path).iter_rows():
+            batch.append([row.get(header, '') for header in CSV_HEADERS])
+            if len(batch) >= batch_size:
+                self.insert_rows(batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            self.insert_rows(batch)
+            imported += len(batch)
+        return imported
+
+
+class WriteThroughDonorStore:
+    """
+    Keeps donors.csv as the append-only record and writes every row through to SQLite.
+    Reads (exports, batch receipts) come from SQLite.
+
+    SQLite stores the donors.csv offset its rows reach. Rows it is missing (an empty database,
+    or a write that failed after the CSV append) are copied over from donors.csv at startup
+    and before the next write.
+    """
+
+    def __init__(self, csv_store, sqlite_store):
+        self.csv_store = csv_store
+        self.sqlite_store = sqlite_store
+        self.path = csv_store.path
+        self.lock = csv_store.lock
+
+    def ensure_ready(self):
+        self.csv_store.ensure_ready()
+        self.sqlite_store.ensure_ready()
+        with self.lock:
+            copied = self.catch_up()
+        if copied:
+            print(f"Donor store: copied {copied} donations from {self.path} into SQLite")
+
+    def catch_up(self):
+        """Insert the donors.csv rows SQLite does not have yet (call with the lock held); returns how many"""
+        position = self.sqlite_store.csv_position()
+        rows = None
+        if position is not None:
+            rows, end = self.csv_store.rows_since(position)
+        if rows is None:
+            # No offset recorded yet (a new database, or one filled by import-csv) or donors.csv was
+            # replaced. SQLite holds the first rows of donors.csv in order, so add the ones after them
+            rows, end = self.csv_store.rows_since(0)
+            rows = rows[self.sqlite_store.count():]
+        elif not rows and end == position:
+            return 0
+        self.sqlite_store.insert_rows([[row.get(header, '') for header in CSV_HEADERS] for row in rows], csv_position=end)
+        return len(rows)
+
+    def append(self, data, recorded_at=None, record_id=None):
+        self.append_many([data], recorded_at=recorded_at, record_ids=[record_id])
+
+    def append_many(self, records, recorded_at=None, record_ids=None):
+        recorded_at = recorded_at or datetime.now()
+        # Held across both writes, so the end of donors.csv is exactly where these rows finish
+        with self.lock:
+            try:
+                self.catch_up()
+                caught_up = True
+            except Exception as e:
+                caught_up = False
+                print(f"Donor store: SQLite catch-up failed: {e}")
+            self.csv_store.append_many(records, recorded_at=recorded_at, record_ids=record_ids)
+            if not caught_up:
+                return
+            try:
+                self.sqlite_store.append_many(records, recorded_at=recorded_at, record_ids=record_ids,
+                                              csv_position=os.path.getsize(self.path))
+            except Exception as e:
+                # donors.csv has the rows; they are copied into SQLite before the next write
+                print(f"Donor store: SQLite write failed, will catch up from {self.path}: {e}")
+
+    def set_crm_ids(self, record_id, constituent_id, transaction_id):
+        return self.sqlite_store.set_crm_ids(record_id, constituent_id, transaction_id)
+
+    def get_crm_ids(self, record_id):
+        return self.sqlite_store.get_crm_ids(record_id)
+
+    def version(self):
+        # Every write lands in donors.csv first, so its size and mtime track both stores
+        return self.csv_store.version()
+
+    def iter_rows(self, start=None, end=None, location=None, donation_type=None):
+        return self.sqlite_store.iter_rows(start, end, location, donation_type)
+
+    def iter_donations(self, start=None, end=None):
+        return self.sqlite_store.iter_donations(start, end)
+
+    def rows_since(self, position=0):
+        return self.sqlite_store.rows_since(position)
+
+
+def iter_csv(rows, chunk_rows=500):
+    """Encode dict rows (keyed by CSV_HEADERS) as CSV text, a chunk at a time, header first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADERS)
+    pending = 0
+    for row in rows:
+        writer.writerow([row.get(header, '') for header in CSV_HEADERS])
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def iter_gzip(chunks, level=6):
+    """gzip-compress a stream of text chunks as it is produced"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Donor storage tools')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    import_parser = subcommands.add_parser('import-csv', help='Bulk-import donors.csv into the SQLite store')
+    import_parser.add_argument('csv_path', help='donors.csv to import')
+    import_parser.add_argument('--db', required=True, help='SQLite database file')
+    import_parser.add_argument('--force', action='store_true', help='Import even if the database already has rows')
+    args = parser.parse_args()
+
+    if args.command == 'import-csv':
+        store = SQLiteDonorStore(args.db)
+        existing = store.count()
+        if existing and not args.force:
+            print(f"✗ {args.db} already has {existing} donations; use --force to import anyway")
+            raise SystemExit(1)
+        start = time.time()
+        imported = store.import_csv(args.csv_path)
+        print(f"✓ Imported {imported} donations into {args.db} in {time.time() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
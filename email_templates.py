@@ -0,0 +1,95 @@
+"""
+Donor email templates
+A template is compiled once into literal text and placeholder slots, then rendered in a
+single pass. Compiled templates are cached by their text, so the cached template from the
+settings cache is only compiled again after it changes.
+"""
+
+import functools
+import re
+from datetime import datetime
+
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+class TemplateError(ValueError):
+    """Raised when a template uses placeholders that cannot be filled"""
+
+
+@functools.lru_cache(maxsize=1024)
+def format_donation_date(value):
+    """2024-01-15 -> January 15, 2024"""
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%B %d, %Y')
+
+
+def _field(name):
+    return lambda data: str(data.get(name) or '')
+
+
+def _merchandise_items(data):
+    items = data.get('merchandiseItems') or []
+    if isinstance(items, str):
+        return items
+    return ', '.join(items) if items else 'N/A'
+
+
+# Placeholder name -> function(data) returning its text
+FIELDS = {
+    'firstName': _field('firstName'),
+    'lastName': _field('lastName'),
+    'email': _field('email'),
+    'phone': _field('phone'),
+    'address': _field('address'),
+    'donationType': lambda data: data['donationType'].capitalize(),
+    'donationDate': lambda data: format_donation_date(data['donationDate']),
+    'location': _field('location'),
+    'merchandiseItems': _merchandise_items,
+    'receiptNumber': _field('receiptNumber')
+}
+
+class CompiledTemplate:
+    """A template split into literal text and placeholder slots"""
+
+    def __init__(self, text, strict=True):
+        self.text = text
+        self._parts = []
+        self._slots = []
+        unknown = []
+        literal = []
+        # re.split with one group alternates literal text and placeholder names
+        for index, piece in enumerate(PLACEHOLDER.split(text)):
+            if index % 2 == 0:
+                literal.append(piece)
+            elif piece in FIELDS:
+                self._parts.append(''.join(literal))
+                literal = []
+                self._slots.append((len(self._parts), FIELDS[piece]))
+                self._parts.append('')
+            else:
+                # Unknown names stay in the text as typed
+                unknown.append('{' + piece + '}')
+                literal.append('{' + piece + '}')
+        self._parts.append(''.join(literal))
+        self.unknown = sorted(set(unknown))
+        if strict and self.unknown:
+            raise TemplateError(
+                f"Unknown placeholder(s): {', '.join(self.unknown)}. "
+                f"Available: {', '.join('{' + name + '}' for name in FIELDS)}"
+            )
+
+    def render(self, data):
+        parts = self._parts[:]
+        for index, fn in self._slots:
+            parts[index] = fn(data)
+        return ''.join(parts)
+
+
+def validate_template(text):
+    """Compile text strictly, raising TemplateError for unknown placeholders"""
+    return CompiledTemplate(text, strict=True)
+
+
+@functools.lru_cache(maxsize=16)
+def compile_template(text):
+    """Compiled template for text; placeholders that are not known are left as-is"""
+    return CompiledTemplate(text, strict=False)
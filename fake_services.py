@@ -0,0 +1,386 @@
+"""
+Local stand-ins for external services, for development and load testing
+FakeBloomerang serves the parts of the Bloomerang v2 API the app uses, with configurable
+latency, injected errors and a fixed-window rate limit that answers 429 like the real API.
+FakeGraph serves the Microsoft sign-in token and sendMail endpoints, and FakeSMTP is an
+SMTP sink that accepts (and counts) every message.
+
+Usage:
+    python fake_services.py bloomerang --port 8765 --latency 0.05 --error-rate 0.05 --rate-limit 100/10
+    # then run the app with BLOOMERANG_API_URL=http://127.0.0.1:8765/v2
+    python fake_services.py graph --port 8766
+    # GRAPH_LOGIN_URL=http://127.0.0.1:8766 GRAPH_API_URL=http://127.0.0.1:8766/v1.0
+    python fake_services.py smtp --port 8025
+    # SMTP_SERVER=127.0.0.1 SMTP_PORT=8025 SMTP_USE_TLS=false
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeService:
+    """Base class: a threaded HTTP server with latency and error injection"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors_injected': 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _dispatch(self):
+                service.count('requests')
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if service.latency:
+                    time.sleep(service.latency)
+                status, payload, headers = service.pre_handle(self)
+                if status is None and service.error_rate and service.random.random() < service.error_rate:
+                    service.count('errors_injected')
+                    status, payload = 503, {'Message': 'Injected failure'}
+                if status is None:
+                    url = urlsplit(self.path)
+                    status, payload, extra = service.handle(self.command, url.path, parse_qs(url.query), self.headers, body)
+                    headers = {**headers, **extra}
+                data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, str(value))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+        return Handler
+
+    def pre_handle(self, request):
+        """Return (status, payload, headers) to answer before routing, or (None, None, headers)"""
+        return None, None, {}
+
+    def handle(self, method, path, query, headers, body):
+        """Return (status, payload, headers)"""
+        return 404, {'Message': 'Not found'}, {}
+
+
+class FakeBloomerang(FakeService):
+    """
+    Fake Bloomerang v2 API: GET /v2/constituents, POST /v2/constituent, POST /v2/transaction and
+    GET /v2/transactions?accountId=.
+    rate_limit=(requests, window_seconds) answers 429 with Retry-After and RateLimit-* headers
+    once a window's budget is spent.
+    """
+
+    def __init__(self, rate_limit=None, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limit = rate_limit
+        self.constituents = {}
+        self.transactions = {}
+        self._next_id = 1000
+        self._window_start = time.time()
+        self._window_count = 0
+
+    @property
+    def api_url(self):
+        return self.url + '/v2'
+
+    def pre_handle(self, request):
+        if not request.headers.get('X-API-Key'):
+            return 401, {'Message': 'Missing X-API-Key'}, {}
+        if not self.rate_limit:
+            return None, None, {}
+        limit, window = self.rate_limit
+        with self.lock:
+            now = time.time()
+            if now - self._window_start >= window:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            reset = max(1, int(round(self._window_start + window - now)))
+            remaining = max(0, limit - self._window_count)
+            headers = {'RateLimit-Limit': limit, 'RateLimit-Remaining': remaining, 'RateLimit-Reset': reset}
+            if self._window_count > limit:
+                self.stats['rate_limited'] = self.stats.get('rate_limited', 0) + 1
+                return 429, {'Message': 'Rate limit exceeded'}, {**headers, 'Retry-After': reset}
+        return None, None, headers
+
+    def add_constituent(self, first_name, last_name, email=None, phone=None):
+        with self.lock:
+            self._next_id += 1
+            constituent = {
+                'Id': self._next_id,
+                'Type': 'Individual',
+                'FirstName': first_name,
+                'LastName': last_name,
+                'FullName': f"{first_name} {last_name}",
+                'PrimaryEmail': {'Value': email} if email else None,
+                'PrimaryPhone': {'Number': phone} if phone else None
+            }
+            self.constituents[constituent['Id']] = constituent
+            return constituent
+
+    def handle(self, method, path, query, headers, body):
+        if method == 'GET' and path == '/v2/constituents':
+            skip = int(query.get('skip', ['0'])[0])
+            take = int(query.get('take', ['50'])[0])
+            descending = query.get('orderDirection', ['Asc'])[0].lower() == 'desc'
+            with self.lock:
+                ordered = sorted(self.constituents.values(), key=lambda c: c['Id'], reverse=descending)
+            page = ordered[skip:skip + take]
+            self.count('constituent_pages')
+            return 200, {'Total': len(ordered), 'Start': skip, 'ResultCount': len(page), 'Results': page}, {}
+
+        if method == 'POST' and path == '/v2/constituent':
+            data = json.loads(body or b'{}')
+            if not data.get('FirstName') or not data.get('LastName'):
+                return 400, {'Message': 'FirstName and LastName are required'}, {}
+            constituent = self.add_constituent(
+                data['FirstName'], data['LastName'],
+                (data.get('PrimaryEmail') or {}).get('Value'), (data.get('PrimaryPhone') or {}).get('Number')
+            )
+            self.count('constituents_created')
+            return 200, constituent, {}
+
+        if method == 'GET' and path == '/v2/transactions':
+            account_id = int(query.get('accountId', ['0'])[0])
+            take = int(query.get('take', ['50'])[0])
+            with self.lock:
+                matches = sorted((t for t in self.transactions.values() if t.get('AccountId') == account_id),
+                                 key=lambda t: t['Id'], reverse=True)
+            page = matches[:take]
+            return 200, {'Total': len(matches), 'Start': 0, 'ResultCount': len(page), 'Results': page}, {}
+
+        if method == 'POST' and path == '/v2/transaction':
+            data = json.loads(body or b'{}')
+            if data.get('AccountId') not in self.constituents:
+                return 400, {'Message': 'AccountId is not a constituent'}, {}
+            with self.lock:
+                self._next_id += 1
+                transaction = {**data, 'Id': self._next_id}
+                self.transactions[transaction['Id']] = transaction
+            self.count('transactions_created')
+            return 200, transaction, {}
+
+        return 404, {'Message': f'No fake for {method} {path}'}, {}
+
+
+class FakeGraph(FakeService):
+    """
+    Fake Microsoft sign-in and Graph API:
+    POST /<tenant>/oauth2/v2.0/token issues bearer tokens valid for token_ttl seconds,
+    POST /v1.0/users/<sender>/sendMail answers 202 for a valid token and 401 otherwise.
+    """
+
+    def __init__(self, token_ttl=3599, **kwargs):
+        super().__init__(**kwargs)
+        self.token_ttl = token_ttl
+        self.tokens = {}
+        self.sent = []
+
+    @property
+    def login_url(self):
+        return self.url
+
+    @property
+    def api_url(self):
+        return self.url + '/v1.0'
+
+    def handle(self, method, path, query, headers, body):
+        if method == 'POST' and re.fullmatch(r'/[^/]+/oauth2/v2\.0/token', path):
+            form = parse_qs(body.decode('utf-8'))
+            if form.get('grant_type', [''])[0] != 'client_credentials' or not form.get('client_secret'):
+                return 400, {'error': 'invalid_request'}, {}
+            token = 'fake-' + uuid.uuid4().hex
+            with self.lock:
+                self.tokens[token] = time.time() + self.token_ttl
+            self.count('tokens_issued')
+            return 200, {'token_type': 'Bearer', 'expires_in': self.token_ttl, 'access_token': token}, {}
+
+        if method == 'POST' and re.fullmatch(r'/v1\.0/users/[^/]+/sendMail', path):
+            token = headers.get('Authorization', '').partition('Bearer ')[2]
+            with self.lock:
+                expires_at = self.tokens.get(token)
+            if not expires_at or expires_at < time.time():
+                return 401, {'error': {'code': 'InvalidAuthenticationToken'}}, {}
+            message = json.loads(body or b'{}').get('message', {})
+            with self.lock:
+                self.sent.append({
+                    'to': [r['emailAddress']['address'] for r in message.get('toRecipients', [])],
+                    'subject': message.get('subject'),
+                    'size': len(body)
+                })
+            self.count('messages_sent')
+            return 202, None, {}
+
+        return 404, {'error': {'code': 'NotFound', 'message': f'No fake for {method} {path}'}}, {}
+
+
+class FakeSMTP:
+    """
+    SMTP sink: accepts EHLO, AUTH PLAIN/LOGIN (any credentials), MAIL, RCPT and DATA without TLS.
+    latency is added before each message is accepted; error_rate of messages get a 451 reply.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'connections': 0, 'messages': 0, 'errors_injected': 0, 'bytes': 0}
+        self.server = socketserver.ThreadingTCPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='FakeSMTP', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode('ascii') + b'\r\n')
+
+            def read_line(self):
+                return self.rfile.readline().decode('utf-8', 'replace').rstrip('\r\n')
+
+            def handle(self):
+                service.count('connections')
+                self.reply('220 fake-smtp ready')
+                while True:
+                    line = self.read_line()
+                    command = line[:4].upper()
+                    if command in ('EHLO', 'HELO'):
+                        self.wfile.write(b'250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+                    elif command == 'AUTH':
+                        if line.upper().startswith('AUTH LOGIN'):
+                            self.reply('334 ' + base64.b64encode(b'Username:').decode())
+                            self.read_line()
+                            self.reply('334 ' + base64.b64encode(b'Password:').decode())
+                            self.read_line()
+                        self.reply('235 Authentication successful')
+                    elif command in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                        self.reply('250 OK')
+                    elif command == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        size = 0
+                        while True:
+                            data = self.rfile.readline()
+                            if not data or data in (b'.\r\n', b'.\n'):
+                                break
+                            size += len(data)
+                        if service.latency:
+                            time.sleep(service.latency)
+                        if service.error_rate and service.random.random() < service.error_rate:
+                            service.count('errors_injected')
+                            self.reply('451 Injected failure')
+                        else:
+                            service.count('messages')
+                            service.count('bytes', size)
+                            self.reply('250 Message accepted')
+                    elif command == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    elif not line:
+                        # Connection closed
+                        return
+                    else:
+                        self.reply('502 Command not implemented')
+
+        return Handler
+
+
+def parse_rate_limit(value):
+    """'100/10' -> (100, 10.0)"""
+    if not value:
+        return None
+    requests_, _, window = value.partition('/')
+    return int(requests_), float(window or 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run local stand-ins for external services')
+    parser.add_argument('service', choices=['bloomerang', 'graph', 'smtp'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with 503 (451 for SMTP messages)')
+    parser.add_argument('--rate-limit', help='Bloomerang rate limit as REQUESTS/SECONDS, e.g. 100/10')
+    args = parser.parse_args()
+
+    options = {'host': args.host, 'port': args.port, 'latency': args.latency, 'error_rate': args.error_rate}
+    if args.service == 'bloomerang':
+        service = FakeBloomerang(rate_limit=parse_rate_limit(args.rate_limit), **options)
+        print(f"Fake Bloomerang API on {service.api_url} (Ctrl+C to stop)")
+    elif args.service == 'graph':
+        service = FakeGraph(**options)
+        print(f"Fake Graph API: GRAPH_LOGIN_URL={service.login_url} GRAPH_API_URL={service.api_url} (Ctrl+C to stop)")
+    else:
+        service = FakeSMTP(**options)
+        print(f"Fake SMTP sink on {service.host}:{service.port} (Ctrl+C to stop)")
+    try:
+        service.server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nStats: {service.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Process-wide cache for Microsoft Graph access tokens
+Tokens are reused until shortly before they expire, and concurrent callers share one refresh
+"""
+
+import threading
+import time
+
+
+class TokenCache:
+    """
+    Caches one access token obtained by fetch_token().
+
+    fetch_token must return (access_token, expires_in_seconds). The token is
+    refreshed refresh_margin seconds before it expires; while a refresh is in
+    flight other callers wait for it instead of requesting their own token.
+    """
+
+    def __init__(self, fetch_token, refresh_margin=300):
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._refreshed = threading.Condition(self._lock)
+        self._token = None
+        self._expires_at = 0
+        self._refreshing = False
+        self._last_error = None
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0, 'waits': 0}
+
+    def _fresh(self, now):
+        return self._token is not None and now < self._expires_at - self.refresh_margin
+
+    def get(self):
+        """Return a valid access token, fetching a new one only when needed"""
+        with self._lock:
+            if self._fresh(time.time()):
+                self.stats['hits'] += 1
+                return self._token
+
+            if self._refreshing:
+                # Another thread is already fetching; the current token is still usable until it expires
+                if self._token is not None and time.time() < self._expires_at:
+                    self.stats['hits'] += 1
+                    return self._token
+                # Otherwise wait for its result
+                self.stats['waits'] += 1
+                while self._refreshing:
+                    self._refreshed.wait()
+                if self._token is not None and time.time() < self._expires_at:
+                    self.stats['hits'] += 1
+                    return self._token
+                if self._last_error is not None:
+                    raise self._last_error
+
+            self.stats['misses'] += 1
+            self._refreshing = True
+
+        try:
+            token, expires_in = self.fetch_token()
+        except Exception as e:
+            with self._lock:
+                self.stats['errors'] += 1
+                self._last_error = e
+                self._refreshing = False
+                self._refreshed.notify_all()
+            raise
+
+        with self._lock:
+            self._token = token
+            self._expires_at = time.time() + float(expires_in)
+            self._last_error = None
+            self.stats['refreshes'] += 1
+            self._refreshing = False
+            self._refreshed.notify_all()
+            return token
+
+    def invalidate(self):
+        """Drop the cached token (e.g. after Graph rejects it with 401)"""
+        with self._lock:
+            self._token = None
+            self._expires_at = 0
+
+    def status(self):
+        """Counters and remaining lifetime for monitoring"""
+        with self._lock:
+            remaining = max(0, self._expires_at - time.time()) if self._token else 0
+            return dict(self.stats, cached=self._token is not None, expiresIn=round(remaining))
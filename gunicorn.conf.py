@@ -0,0 +1,80 @@
+"""
+Gunicorn settings for the donor app (loaded automatically from the app directory, or with --config)
+Submissions spend most of their time waiting on disk, SMTP, Microsoft Graph and Bloomerang, so
+each worker serves several requests at once: threads by default (gthread), or greenlets (gevent).
+Every setting can be overridden with the environment variables below.
+"""
+
+import multiprocessing
+import os
+import sys
+import traceback
+
+CPU_COUNT = multiprocessing.cpu_count()
+
+# Worker class: 'gthread' (default), 'gevent' (needs pip install gevent) or 'sync' (one request per worker)
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread').lower()
+if worker_class == 'gevent':
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        print("GUNICORN_WORKER_CLASS=gevent but gevent is not installed; using gthread")
+        worker_class = 'gthread'
+
+# Worker processes. Each one runs its own job, CRM sync and metrics threads and keeps its own
+# donor search index, so thread/greenlet workers need fewer processes than sync ones
+DEFAULT_WORKERS = {
+    'sync': CPU_COUNT * 2 + 1,
+    'gthread': max(2, CPU_COUNT + 1),
+    'gevent': max(2, CPU_COUNT)
+}
+workers = int(os.getenv('GUNICORN_WORKERS', DEFAULT_WORKERS.get(worker_class, 2)))
+
+# Requests served at once per worker: threads for gthread, connections for gevent
+threads = int(os.getenv('GUNICORN_THREADS', 8)) if worker_class == 'gthread' else 1
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 200))
+
+# Same port and timeout as the previous startup command; batch receipt ZIPs can take a while to stream
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', '8000')}")
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 600))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Import the app once in the master and fork workers from it (less memory, faster restarts).
+# gevent has to patch the standard library before the app is imported, so it never preloads
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true' and worker_class != 'gevent'
+
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    cfg = server.cfg  # includes command-line overrides
+    mode = cfg.worker_class_str
+    print(f"Gunicorn: {cfg.workers} {mode} worker(s)"
+          + (f" x {cfg.threads} threads" if mode == 'gthread' else '')
+          + (f" x {cfg.worker_connections} connections" if mode == 'gevent' else '')
+          + f" on {', '.join(cfg.bind)}, preload {'on' if cfg.preload_app else 'off'}")
+
+
+def post_worker_init(worker):
+    """Readiness: warm the worker up before it accepts its first request"""
+    try:
+        import app
+        app.warm_up()
+    except Exception as e:
+        # The worker still serves; anything not loaded here is loaded by the first request
+        print(f"Worker {worker.pid} warm-up failed: {e}")
+
+
+def worker_abort(worker):
+    """A worker timed out: log where each of its threads was stuck (e.g. a hung SMTP or CRM call)"""
+    frames = sys._current_frames()
+    for thread_id, frame in frames.items():
+        print(f"Worker {worker.pid} thread {thread_id}:\n{''.join(traceback.format_stack(frame))}")
+
+
+def worker_exit(server, worker):
+    """Stop claiming background jobs before the interpreter shuts down (unfinished ones are picked up again)"""
+    app = sys.modules.get('app')
+    if app is not None:
+        app.pipeline.stop()
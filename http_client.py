@@ -0,0 +1,128 @@
+"""
+Outbound HTTP client used for Bloomerang and Microsoft Graph calls
+One keep-alive requests.Session per host, default timeouts, and retries with backoff on 429/5xx
+"""
+
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class OutboundRetry(Retry):
+    """
+    Retry policy that never repeats a POST the server may already have processed.
+    Idempotent requests are retried on 429 and 5xx; POSTs only on 429 (rate limited,
+    so nothing was created) and on connection failures before the request was sent.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() not in IDEMPOTENT_METHODS and status_code != 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class HTTPClient:
+    """Hands out per-host sessions with pooled connections"""
+
+    def __init__(self, pool_connections=4, pool_maxsize=10, connect_timeout=5, read_timeout=30,
+                 retries=3, backoff_factor=0.5):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # Optional callable(method, host, status, seconds) told about every request (status 'error' if it raised)
+        self.observer = None
+
+    def configure(self, **settings):
+        """Change pool/timeout/retry settings (drops existing sessions)"""
+        with self._lock:
+            for key, value in settings.items():
+                if key == 'connect_timeout':
+                    self.timeout = (value, self.timeout[1])
+                elif key == 'read_timeout':
+                    self.timeout = (self.timeout[0], value)
+                else:
+                    setattr(self, key, value)
+            self._close_sessions()
+
+    def _make_session(self, retry):
+        session = requests.Session()
+        max_retries = OutboundRetry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,
+            status=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        ) if retry else 0
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                              max_retries=max_retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _close_sessions(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions = {}
+
+    def session_for(self, url, retry=True):
+        """Return the shared session for url's scheme and host"""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc, retry)
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections inherited across fork must not be shared with the parent
+                self._sessions = {}
+                self._pid = os.getpid()
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = self._make_session(retry)
+            return session
+
+    def request(self, method, url, retry=True, **kwargs):
+        """Send a request over the host's pooled session (retry=False to handle 429/5xx yourself)"""
+        kwargs.setdefault('timeout', self.timeout)
+        if not self.observer:
+            return self.session_for(url, retry).request(method, url, **kwargs)
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session_for(url, retry).request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            self.observer(method.upper(), urlsplit(url).netloc, status, time.perf_counter() - start)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+# Shared client for the whole process (configured from app settings at startup)
+client = HTTPClient()
+
+
+def get(url, **kwargs):
+    return client.get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return client.post(url, **kwargs)
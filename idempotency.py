@@ -0,0 +1,179 @@
+"""
+Idempotency-Key support for donation submissions
+A key is reserved when its request starts and the response is stored once it finishes, so a
+retried or double-tapped request gets the original response back without redoing the work.
+Keys live in a bounded in-process LRU and, when a database path is given, in SQLite shared
+by every gunicorn worker. Keys expire after ttl seconds.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_db import ThreadLocalConnection, transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status TEXT NOT NULL,
+    status_code INTEGER,
+    response TEXT,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys (expires_at);
+"""
+
+# Outcomes of IdempotencyStore.begin()
+NEW = 'new'
+REPLAY = 'replay'
+IN_PROGRESS = 'in_progress'
+MISMATCH = 'mismatch'
+
+# Key record status values
+STARTED = 'started'
+COMPLETED = 'completed'
+
+
+class IdempotencyStore:
+    """
+    Reserve / complete / release idempotency keys.
+
+    begin(key, fingerprint) returns (outcome, stored):
+      NEW          - the key is now reserved for this request; call complete() or release()
+      REPLAY       - stored is (status_code, body) of the finished original request
+      IN_PROGRESS  - the original request is still running
+      MISMATCH     - the key was used with a different request body
+    A reservation older than lock_timeout is treated as abandoned (e.g. a crashed worker).
+    """
+
+    def __init__(self, db_path=None, ttl=86400, max_entries=10000, lock_timeout=120):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        # key -> (fingerprint, status, created_at, expires_at, stored)
+        self._entries = OrderedDict()
+        self._conn = None
+        if db_path:
+            self._conn = ThreadLocalConnection(db_path, on_connect=lambda conn: conn.executescript(SCHEMA))
+        self._begins = 0
+        self.stats = {'new': 0, 'replays': 0, 'in_progress': 0, 'mismatches': 0, 'evictions': 0}
+
+    def begin(self, key, fingerprint):
+        now = time.time()
+        with self._lock:
+            self._begins += 1
+            entry = self._entries.get(key)
+            if entry and entry[3] <= now:
+                del self._entries[key]
+                entry = None
+            # Finished keys can be answered from memory; reservations must be checked in the database
+            if entry and (entry[1] == COMPLETED or not self._conn):
+                self._entries.move_to_end(key)
+                outcome = self._outcome(entry, fingerprint, now)
+                if outcome[0] == NEW:
+                    self._put(key, (fingerprint, STARTED, now, now + self.ttl, None))
+                return outcome
+            if not self._conn:
+                self._put(key, (fingerprint, STARTED, now, now + self.ttl, None))
+                self._count(NEW)
+                return NEW, None
+
+        outcome = self._begin_shared(key, fingerprint, now)
+        self._count(outcome[0])
+        return outcome
+
+    def _outcome(self, entry, fingerprint, now):
+        stored_fingerprint, status, created_at, _, stored = entry
+        if stored_fingerprint != fingerprint:
+            outcome = (MISMATCH, None)
+        elif status == COMPLETED:
+            outcome = (REPLAY, stored)
+        elif now - created_at < self.lock_timeout:
+            outcome = (IN_PROGRESS, None)
+        else:
+            outcome = (NEW, None)
+        self._count(outcome[0])
+        return outcome
+
+    def _begin_shared(self, key, fingerprint, now):
+        conn = self._conn.get()
+        if self._begins % 100 == 0:
+            self.purge()
+        with transaction(conn):
+            row = conn.execute('SELECT * FROM idempotency_keys WHERE key = ?', (key,)).fetchone()
+            if row and row['expires_at'] > now:
+                stored = None
+                if row['status'] == COMPLETED:
+                    stored = (row['status_code'], json.loads(row['response']))
+                entry = (row['fingerprint'], row['status'], row['created_at'], row['expires_at'], stored)
+                if row['fingerprint'] != fingerprint:
+                    return MISMATCH, None
+                if row['status'] == COMPLETED:
+                    self._remember(key, entry)
+                    return REPLAY, stored
+                if now - row['created_at'] < self.lock_timeout:
+                    return IN_PROGRESS, None
+            conn.execute(
+                'INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, status, created_at, expires_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, fingerprint, STARTED, now, now + self.ttl)
+            )
+        return NEW, None
+
+    def complete(self, key, fingerprint, status_code, body):
+        """Store the response for a reserved key"""
+        now = time.time()
+        self._remember(key, (fingerprint, COMPLETED, now, now + self.ttl, (status_code, body)))
+        if self._conn:
+            conn = self._conn.get()
+            with transaction(conn):
+                conn.execute(
+                    'UPDATE idempotency_keys SET status = ?, status_code = ?, response = ?, expires_at = ? '
+                    'WHERE key = ?',
+                    (COMPLETED, status_code, json.dumps(body), now + self.ttl, key)
+                )
+
+    def release(self, key):
+        """Forget a reservation whose request failed, so a retry runs it again"""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self._conn:
+            conn = self._conn.get()
+            with transaction(conn):
+                conn.execute('DELETE FROM idempotency_keys WHERE key = ? AND status = ?', (key, STARTED))
+
+    def purge(self):
+        """Delete expired keys, and the oldest keys beyond max_entries, from the database"""
+        if not self._conn:
+            return
+        conn = self._conn.get()
+        with transaction(conn):
+            conn.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (time.time(),))
+            conn.execute(
+                'DELETE FROM idempotency_keys WHERE key IN ('
+                'SELECT key FROM idempotency_keys ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._put(key, entry)
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _count(self, outcome):
+        name = {NEW: 'new', REPLAY: 'replays', IN_PROGRESS: 'in_progress', MISMATCH: 'mismatches'}[outcome]
+        self.stats[name] += 1
+
+    def status(self):
+        with self._lock:
+            return {'keysInMemory': len(self._entries), 'shared': bool(self._conn), 'ttl': self.ttl, **self.stats}
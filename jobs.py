@@ -0,0 +1,437 @@
+"""
+Durable background job pipeline for the post-submit work (PDF receipt, email, CRM sync)
+Jobs live in SQLite so they survive restarts and can be picked up by any gunicorn worker
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlite_db import ClaimHeartbeat, ThreadLocalConnection, transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    client_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at);
+CREATE TABLE IF NOT EXISTS job_stages (
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, stage)
+);
+"""
+
+# Job status values (a held job is saved but not runnable until it is released)
+HELD = 'held'
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Stage status values (pending/running/done/failed plus skipped)
+SKIPPED = 'skipped'
+
+
+class StageSkipped(Exception):
+    """Raised by a stage handler when the stage does not apply (e.g. integration disabled)"""
+
+
+class PermanentStageError(Exception):
+    """Raised by a stage handler when running it again could do harm (e.g. email a donor twice)"""
+
+
+def new_job_id():
+    """Generate a new job id (also used as the donation's receipt number)"""
+    return uuid.uuid4().hex
+
+
+def _init_schema(conn):
+    conn.executescript(SCHEMA)
+    # jobs.db files created before client ids existed
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(jobs)')]
+    if 'client_id' not in columns:
+        conn.execute('ALTER TABLE jobs ADD COLUMN client_id TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_client_id ON jobs (client_id) WHERE client_id IS NOT NULL')
+
+
+class JobStore:
+    """SQLite-backed store for jobs and their per-stage progress"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = ThreadLocalConnection(db_path, on_connect=_init_schema)
+
+    def create_job(self, job_id, data, stages, client_id=None):
+        """Persist a new pending job with one row per stage"""
+        self.create_jobs([(job_id, data, client_id)], stages)
+        return job_id
+
+    def create_jobs(self, jobs, stages, status=PENDING):
+        """Persist several (job_id, data, client_id) jobs in one transaction"""
+        now = time.time()
+        conn = self._conn.get()
+        with transaction(conn):
+            conn.executemany(
+                'INSERT INTO jobs (id, status, data, created_at, updated_at, available_at, client_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(job_id, status, json.dumps(data), now, now, now, client_id) for job_id, data, client_id in jobs]
+            )
+            conn.executemany(
+                'INSERT INTO job_stages (job_id, stage, position, status) VALUES (?, ?, ?, ?)',
+                [(job_id, stage, position, PENDING)
+                 for job_id, _, _ in jobs for position, stage in enumerate(stages)]
+            )
+
+    def release_jobs(self, job_ids):
+        """Make held jobs runnable"""
+        now = time.time()
+        self._conn.get().executemany(
+            'UPDATE jobs SET status = ?, available_at = ?, updated_at = ? WHERE id = ? AND status = ?',
+            [(PENDING, now, now, job_id, HELD) for job_id in job_ids]
+        )
+
+    def discard_jobs(self, job_ids):
+        """Delete held jobs (and free their client ids) when the write they were waiting for failed"""
+        conn = self._conn.get()
+        with transaction(conn):
+            for job_id in job_ids:
+                if conn.execute('DELETE FROM jobs WHERE id = ? AND status = ?', (job_id, HELD)).rowcount:
+                    conn.execute('DELETE FROM job_stages WHERE job_id = ?', (job_id,))
+
+    def find_by_client_ids(self, client_ids):
+        """Map client id -> job id for the client ids that already have a job"""
+        found = {}
+        client_ids = list(client_ids)
+        conn = self._conn.get()
+        # Stay well under SQLite's bound-parameter limit
+        for offset in range(0, len(client_ids), 500):
+            chunk = client_ids[offset:offset + 500]
+            rows = conn.execute(
+                f"SELECT id, client_id FROM jobs WHERE client_id IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            found.update({row['client_id']: row['id'] for row in rows})
+        return found
+
+    def get_job(self, job_id):
+        """Return a job with its stages as a dict, or None"""
+        conn = self._conn.get()
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if not row:
+            return None
+        stages = conn.execute(
+            'SELECT * FROM job_stages WHERE job_id = ? ORDER BY position', (job_id,)
+        ).fetchall()
+        return {
+            'id': row['id'],
+            'status': row['status'],
+            'data': json.loads(row['data']),
+            'createdAt': row['created_at'],
+            'updatedAt': row['updated_at'],
+            'attempts': row['attempts'],
+            'stages': {
+                stage['stage']: {
+                    'status': stage['status'],
+                    'attempts': stage['attempts'],
+                    'startedAt': stage['started_at'],
+                    'finishedAt': stage['finished_at'],
+                    'result': json.loads(stage['result']) if stage['result'] else None,
+                    'error': stage['error']
+                }
+                for stage in stages
+            }
+        }
+
+    def claim_next(self, worker_id, stale_after):
+        """
+        Atomically claim the oldest runnable job, or one abandoned by a dead worker
+        (running without a heartbeat, or still held because its submitter died before releasing it)
+        """
+        now = time.time()
+        conn = self._conn.get()
+        with transaction(conn):
+            row = conn.execute(
+                'SELECT id FROM jobs '
+                'WHERE (status = ? AND available_at <= ?) OR (status = ? AND claimed_at < ?) '
+                'OR (status = ? AND created_at < ?) '
+                'ORDER BY available_at LIMIT 1',
+                (PENDING, now, RUNNING, now - stale_after, HELD, now - stale_after)
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute(
+                'UPDATE jobs SET status = ?, claimed_by = ?, claimed_at = ?, updated_at = ?, attempts = attempts + 1 '
+                'WHERE id = ?',
+                (RUNNING, worker_id, now, now, row['id'])
+            )
+        return row['id']
+
+    def renew_claim(self, job_id, worker_id):
+        """Keep a running job's claim fresh so it isn't taken over as abandoned"""
+        now = time.time()
+        self._conn.get().execute(
+            'UPDATE jobs SET claimed_at = ?, updated_at = ? WHERE id = ? AND claimed_by = ? AND status = ?',
+            (now, now, job_id, worker_id, RUNNING)
+        )
+
+    def start_stage(self, job_id, stage):
+        now = time.time()
+        self._conn.get().execute(
+            'UPDATE job_stages SET status = ?, attempts = attempts + 1, started_at = ?, error = NULL '
+            'WHERE job_id = ? AND stage = ?',
+            (RUNNING, now, job_id, stage)
+        )
+
+    def finish_stage(self, job_id, stage, status, result=None, error=None, attempts=None):
+        """Record a stage's outcome; attempts, when given, overrides its attempt count (to stop retries)"""
+        now = time.time()
+        self._conn.get().execute(
+            'UPDATE job_stages SET status = ?, finished_at = ?, result = ?, error = ?, attempts = COALESCE(?, attempts) '
+            'WHERE job_id = ? AND stage = ?',
+            (status, now, json.dumps(result) if result is not None else None, error, attempts, job_id, stage)
+        )
+
+    def finish_job(self, job_id, status):
+        now = time.time()
+        self._conn.get().execute(
+            'UPDATE jobs SET status = ?, updated_at = ?, claimed_by = NULL WHERE id = ?',
+            (status, now, job_id)
+        )
+
+    def retry_later(self, job_id, delay):
+        """Release a claimed job so it is picked up again after delay seconds"""
+        now = time.time()
+        self._conn.get().execute(
+            'UPDATE jobs SET status = ?, available_at = ?, updated_at = ?, claimed_by = NULL WHERE id = ?',
+            (PENDING, now + delay, now, job_id)
+        )
+
+    def counts(self):
+        """Number of jobs per status"""
+        rows = self._conn.get().execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+
+class JobPipeline:
+    """
+    Runs jobs through an ordered list of stages on background threads.
+
+    handlers maps stage name -> callable(job_id, data, results) returning a
+    JSON-serializable result. results holds the results of earlier stages in its chain.
+    A stage listed in depends_on is only run once its dependency is done.
+
+    Stages that do not depend on each other (e.g. email, which needs the pdf, and crm)
+    run at the same time on a pool of stage_concurrency threads per process, so a job
+    takes as long as its slowest chain of dependent stages rather than the sum of all
+    of them. stage_concurrency=1 runs every stage in order on the worker thread.
+
+    on_finish(job_id, status), if given, is called once a job is done or has failed for good.
+    A running job's claim is renewed every stale_after/4 seconds; only a job whose worker
+    died is taken over once its claim is older than stale_after.
+    """
+
+    def __init__(self, store, stages, handlers, depends_on=None, workers=2,
+                 max_attempts=3, retry_delay=30, stale_after=600, poll_interval=1.0, stage_concurrency=1,
+                 on_finish=None):
+        self.store = store
+        self.on_finish = on_finish
+        self.stages = list(stages)
+        self.handlers = handlers
+        self.depends_on = depends_on or {}
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.stage_concurrency = stage_concurrency
+        self._executor = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, data, job_id=None, hold=False):
+        """
+        Persist a job for data and wake a worker; returns the job id.
+        With hold=True the job is not run until release() (or discard() drops it).
+        """
+        job_id = job_id or new_job_id()
+        self.submit_many([(job_id, data, None)], hold=hold)
+        return job_id
+
+    def submit_many(self, jobs, hold=False):
+        """Persist several (job_id, data, client_id) jobs at once; workers pick them up in parallel"""
+        self.store.create_jobs(jobs, self.stages, status=HELD if hold else PENDING)
+        if not hold:
+            self._wakeup.set()
+
+    def release(self, job_ids):
+        """Let held jobs run"""
+        self.store.release_jobs(job_ids)
+        self._wakeup.set()
+
+    def discard(self, job_ids):
+        self.store.discard_jobs(job_ids)
+
+    def ensure_started(self):
+        """Start worker threads once per process (safe to call on every request, and after fork)"""
+        if self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._stop.clear()
+            self._threads = []
+            if self.stage_concurrency > 1:
+                # Shared by every worker thread, so it bounds this process's concurrent stage calls
+                self._executor = ThreadPoolExecutor(max_workers=self.stage_concurrency, thread_name_prefix='job-stage')
+            for i in range(self.workers):
+                worker_id = f"{os.getpid()}-{i}"
+                thread = threading.Thread(target=self._run, args=(worker_id,), name=f"job-worker-{worker_id}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started_pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _run(self, worker_id):
+        while not self._stop.is_set():
+            try:
+                job_id = self.store.claim_next(worker_id, self.stale_after)
+            except Exception as e:
+                print(f"Job worker {worker_id}: failed to claim job: {e}")
+                job_id = None
+
+            if not job_id:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                # A job can run longer than stale_after (slow SMTP, CRM retries); renew its claim meanwhile
+                with ClaimHeartbeat(lambda: self.store.renew_claim(job_id, worker_id), self.stale_after / 4,
+                                    name=f'job-claim-{worker_id}'):
+                    self.run_job(job_id)
+            except Exception as e:
+                print(f"Job worker {worker_id}: job {job_id} crashed: {e}")
+                traceback.print_exc()
+                self.store.retry_later(job_id, self.retry_delay)
+
+    def chains(self):
+        """Stages grouped into chains: a stage joins the chain of the stage it depends on"""
+        chains = []
+        chain_of = {}
+        for stage in self.stages:
+            chain = chain_of.get(self.depends_on.get(stage))
+            if chain is None:
+                chain = []
+                chains.append(chain)
+            chain.append(stage)
+            chain_of[stage] = chain
+        return chains
+
+    def run_job(self, job_id):
+        """Run every unfinished stage of a job, independent chains of stages concurrently"""
+        job = self.store.get_job(job_id)
+        if not job:
+            return
+
+        results = {}
+        chains = self.chains()
+        if self._executor is None or len(chains) == 1:
+            retries = [self._run_chain(job_id, job, chain, results) for chain in chains]
+        else:
+            futures = [self._executor.submit(self._run_chain, job_id, job, chain, results) for chain in chains]
+            retries = [future.result() for future in futures]
+
+        if any(retries):
+            delay = self.retry_delay * (1 + random.random())
+            self.store.retry_later(job_id, delay)
+            return
+
+        final = self.store.get_job(job_id)
+        failed = any(s['status'] == FAILED for s in final['stages'].values())
+        status = FAILED if failed else DONE
+        self.store.finish_job(job_id, status)
+        if self.on_finish:
+            try:
+                self.on_finish(job_id, status)
+            except Exception as e:
+                print(f"Job {job_id}: finish callback failed: {e}")
+
+    def _run_chain(self, job_id, job, chain, results):
+        """Run a chain's unfinished stages in order; returns True if one of them should be retried"""
+        data = job['data']
+        retry = False
+
+        for stage in chain:
+            info = job['stages'].get(stage)
+            if info is None:
+                continue
+            if info['status'] in (DONE, SKIPPED):
+                results[stage] = info['result']
+                continue
+            if info['status'] == FAILED and info['attempts'] >= self.max_attempts:
+                continue
+
+            dependency = self.depends_on.get(stage)
+            if dependency:
+                dep = job['stages'].get(dependency, {})
+                if dep.get('status') == FAILED and dep.get('attempts', 0) < self.max_attempts:
+                    # Wait for the dependency's retry
+                    continue
+                if dep.get('status') != DONE:
+                    self.store.finish_stage(job_id, stage, SKIPPED, error=f"{dependency} stage did not complete")
+                    info['status'] = SKIPPED
+                    continue
+
+            self.store.start_stage(job_id, stage)
+            try:
+                result = self.handlers[stage](job_id, data, results)
+            except StageSkipped as e:
+                self.store.finish_stage(job_id, stage, SKIPPED, error=str(e))
+                results[stage] = None
+                continue
+            except PermanentStageError as e:
+                print(f"Job {job_id}: {stage} stage failed, not retrying: {e}")
+                self.store.finish_stage(job_id, stage, FAILED, error=str(e), attempts=self.max_attempts)
+                info['status'] = FAILED
+                info['attempts'] = self.max_attempts
+                continue
+            except Exception as e:
+                print(f"Job {job_id}: {stage} stage failed (attempt {info['attempts'] + 1}): {e}")
+                self.store.finish_stage(job_id, stage, FAILED, error=str(e))
+                info['status'] = FAILED
+                info['attempts'] += 1
+                if info['attempts'] < self.max_attempts:
+                    retry = True
+                continue
+
+            self.store.finish_stage(job_id, stage, DONE, result=result)
+            info['status'] = DONE
+            results[stage] = result
+
+        return retry
@@ -0,0 +1,284 @@
+"""
+Load test for /api/submit-donation against local stand-ins for Bloomerang, Microsoft Graph and SMTP
+Starts the fake services (fake_services.py), runs the app against them in a scratch directory,
+submits donations at the given concurrency and reports p50/p95/p99 latency and throughput for the
+HTTP request and for each background stage. No real email is sent and the real CRM is never called.
+
+Usage:
+    python loadtest.py --requests 500 --concurrency 20
+    python loadtest.py --email-mode microsoft --latency 0.05 --error-rate 0.02 --rate-limit 100/10
+    python loadtest.py --url http://localhost:8000 --requests 200
+    # --url drives an app you started yourself (point it at `python fake_services.py ...` first)
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_services import FakeBloomerang, FakeGraph, FakeSMTP, parse_rate_limit
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MERCHANDISE = ['Clothing', 'Books', 'Shoes', 'Furniture', 'Electronics']
+
+
+def sample_donation(i, donors):
+    """The i-th donation; donors repeat every `donors` submissions, as returning donors do"""
+    donor = i % donors
+    return {
+        'firstName': f'Load{donor}',
+        'lastName': 'Tester',
+        'email': f'loadtest{donor}@example.com',
+        'phone': f'(555) 01{donor % 100:02d}-{donor % 10000:04d}',
+        'address': f'{donor} Test Street, Miami, FL 33101',
+        'donationType': 'merchandise' if i % 3 else 'cash',
+        'merchandiseItems': MERCHANDISE[:1 + i % len(MERCHANDISE)] if i % 3 else [],
+        'donationDate': time.strftime('%Y-%m-%d'),
+        'location': 'Main Office'
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def start_fakes(args):
+    options = {'latency': args.latency, 'error_rate': args.error_rate, 'seed': args.seed}
+    return {
+        'bloomerang': FakeBloomerang(rate_limit=parse_rate_limit(args.rate_limit), **options).start(),
+        'graph': FakeGraph(**options).start(),
+        'smtp': FakeSMTP(**options).start()
+    }
+
+
+def app_environment(args, fakes):
+    """Environment pointing the app at the fakes"""
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(args.port),
+        'DEBUG': 'false',
+        'EMAIL_MODE': args.email_mode,
+        'SMTP_SERVER': fakes['smtp'].host,
+        'SMTP_PORT': str(fakes['smtp'].port),
+        'SMTP_USE_TLS': 'false',
+        'SENDER_EMAIL': 'receipts@example.com',
+        'SENDER_PASSWORD': 'load-test',
+        'AZURE_TENANT_ID': 'load-test',
+        'AZURE_CLIENT_ID': 'load-test',
+        'AZURE_CLIENT_SECRET': 'load-test',
+        'MS_SENDER_EMAIL': 'receipts@example.com',
+        'GRAPH_LOGIN_URL': fakes['graph'].login_url,
+        'GRAPH_API_URL': fakes['graph'].api_url,
+        'BLOOMERANG_ENABLED': 'false' if args.no_crm else 'true',
+        'BLOOMERANG_API_KEY': 'load-test',
+        'BLOOMERANG_API_URL': fakes['bloomerang'].api_url,
+        # Short retry delays so injected errors are retried within the run
+        'JOB_RETRY_DELAY': '1',
+        'CRM_SYNC_RETRY_DELAY': '1',
+        'BLOOMERANG_TXN_FLUSH_WINDOW': '1'
+    })
+    if args.job_workers:
+        env['JOB_WORKERS'] = str(args.job_workers)
+    return env
+
+
+def start_app(args, env, workdir):
+    log = open(os.path.join(workdir, 'app.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(APP_DIR, 'app.py')], cwd=workdir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{args.port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with code {process.returncode}, see {log.name}")
+        try:
+            if requests.get(f'{url}/api/locations', timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"App did not start within 30 seconds, see {log.name}")
+
+
+def submit_all(url, args):
+    """Submit args.requests donations; returns (results, elapsed seconds)"""
+    local = threading.local()
+
+    def submit(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        headers = {'Idempotency-Key': str(uuid.uuid4())} if args.idempotency_keys else {}
+        start = time.perf_counter()
+        try:
+            response = local.session.post(f'{url}/api/submit-donation', json=sample_donation(i, args.donors),
+                                          headers=headers, timeout=60)
+            ok = response.status_code == 200 and response.json().get('success')
+            job_id = response.json().get('jobId') if ok else None
+            error = None if ok else f'HTTP {response.status_code}'
+        except requests.RequestException as e:
+            ok, job_id, error = False, None, type(e).__name__
+        return {'latency': time.perf_counter() - start, 'ok': ok, 'jobId': job_id, 'error': error}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(submit, range(args.requests)))
+    return results, time.perf_counter() - start
+
+
+def wait_for_jobs(url, job_ids, timeout):
+    """Poll /api/jobs/<id> until every job has finished (or timeout); returns the job records"""
+    session = requests.Session()
+    jobs = {}
+    deadline = time.time() + timeout
+    pending = list(job_ids)
+    while pending and time.time() < deadline:
+        still_running = []
+        for job_id in pending:
+            response = session.get(f'{url}/api/jobs/{job_id}', timeout=10)
+            job = response.json().get('job') if response.status_code == 200 else None
+            crm_sync = (job or {}).get('crmSync') or {}
+            finished = job and job['status'] not in ('pending', 'running')
+            # Donors queued for Bloomerang are finished once their constituent and transaction are posted
+            synced = crm_sync.get('status') in (None, 'done', 'dead') and \
+                crm_sync.get('transactionStatus') in (None, 'done', 'dead')
+            if finished and synced:
+                jobs[job_id] = job
+            else:
+                still_running.append(job_id)
+        pending = still_running
+        if pending:
+            time.sleep(1)
+    for job_id in pending:
+        response = session.get(f'{url}/api/jobs/{job_id}', timeout=10)
+        if response.status_code == 200:
+            jobs[job_id] = response.json()['job']
+    return jobs, len(pending)
+
+
+def stage_rows(jobs):
+    """{row name: (durations, errors, rate)} for each background stage"""
+    rows = {}
+
+    def add(name, spans, errors):
+        if not spans and not errors:
+            # Stage skipped for every job (e.g. Bloomerang disabled)
+            return
+        durations = [finish - start for start, finish in spans]
+        window = (max(f for _, f in spans) - min(s for s, _ in spans)) if spans else 0
+        rows[name] = (durations, errors, len(spans) / window if window > 0 else None)
+
+    queue_wait, end_to_end, crm_sync = [], [], []
+    stages = {}
+    for job in jobs.values():
+        started = [s['startedAt'] for s in job['stages'].values() if s.get('startedAt')]
+        finished = [s['finishedAt'] for s in job['stages'].values() if s.get('finishedAt')]
+        if started:
+            queue_wait.append((job['createdAt'], min(started)))
+        if finished and job['status'] == 'done':
+            end_to_end.append((job['createdAt'], max(finished)))
+        for name, stage in job['stages'].items():
+            spans, errors = stages.setdefault(name, ([], 0))
+            if stage['status'] == 'done' and stage.get('startedAt') and stage.get('finishedAt'):
+                spans.append((stage['startedAt'], stage['finishedAt']))
+            elif stage['status'] == 'failed':
+                stages[name] = (spans, errors + 1)
+        crm = job.get('crmSync') or {}
+        if crm.get('status') == 'done':
+            crm_sync.append((job['createdAt'], crm['updatedAt']))
+
+    add('queue wait', queue_wait, 0)
+    for name, (spans, errors) in stages.items():
+        add(f'{name} stage', spans, errors)
+    if crm_sync:
+        dead = sum(1 for job in jobs.values() if (job.get('crmSync') or {}).get('status') == 'dead')
+        add('bloomerang sync', crm_sync, dead)
+    add('end to end', end_to_end, sum(1 for j in jobs.values() if j['status'] == 'failed'))
+    return rows
+
+
+def print_report(results, elapsed, rows, unfinished):
+    def ms(value):
+        return f'{value * 1000:9.1f}' if value is not None else '        -'
+
+    def per_second(value):
+        return f'{value:9.1f}' if value else '        -'
+
+    print('=' * 78)
+    print(f'{"":<18}{"count":>7}{"errors":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}{"per sec":>9}')
+    print('-' * 78)
+    latencies = [r['latency'] for r in results if r['ok']]
+    errors = sum(1 for r in results if not r['ok'])
+    all_rows = {'http submit': (latencies, errors, len(results) / elapsed if elapsed else None), **rows}
+    for name, (durations, errors, rate) in all_rows.items():
+        print(f'{name:<18}{len(durations):>7}{errors:>8}{ms(percentile(durations, 50))}{ms(percentile(durations, 95))}'
+              f'{ms(percentile(durations, 99))}{ms(max(durations) if durations else None)}{per_second(rate)}')
+    print('=' * 78)
+    print(f'{len(results)} requests in {elapsed:.2f}s')
+    if unfinished:
+        print(f'⚠ {unfinished} job(s) still running when the wait timed out')
+    failures = {}
+    for r in results:
+        if not r['ok']:
+            failures[r['error']] = failures.get(r['error'], 0) + 1
+    for error, count in failures.items():
+        print(f'✗ {count} request(s) failed: {error}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /api/submit-donation against fake external services')
+    parser.add_argument('--requests', type=int, default=200, help='Donations to submit')
+    parser.add_argument('--concurrency', type=int, default=10, help='Requests in flight at once')
+    parser.add_argument('--donors', type=int, default=50, help='Distinct donors the submissions cycle through')
+    parser.add_argument('--email-mode', choices=['smtp', 'microsoft'], default='smtp')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds each fake service adds per call')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of fake service calls that fail')
+    parser.add_argument('--rate-limit', default='100/10', help='Fake Bloomerang rate limit, REQUESTS/SECONDS')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for error injection')
+    parser.add_argument('--no-crm', action='store_true', help='Run with Bloomerang disabled')
+    parser.add_argument('--idempotency-keys', action='store_true', help='Send an Idempotency-Key with each request')
+    parser.add_argument('--job-workers', type=int, default=None, help='JOB_WORKERS for the app')
+    parser.add_argument('--port', type=int, default=5055, help='Port for the app started by the load test')
+    parser.add_argument('--url', help='Drive an already running app instead of starting one')
+    parser.add_argument('--wait', type=float, default=120, help='Seconds to wait for background stages')
+    args = parser.parse_args()
+
+    fakes, process = {}, None
+    workdir = tempfile.mkdtemp(prefix='donor-loadtest-')
+    try:
+        url = args.url
+        if not url:
+            fakes = start_fakes(args)
+            process, url = start_app(args, app_environment(args, fakes), workdir)
+            print(f'App running on {url} (data and log in {workdir})')
+        print(f'Submitting {args.requests} donations, {args.concurrency} at a time...')
+        results, elapsed = submit_all(url, args)
+        job_ids = [r['jobId'] for r in results if r['jobId']]
+        print(f'Waiting for {len(job_ids)} background jobs...')
+        jobs, unfinished = wait_for_jobs(url, job_ids, args.wait)
+        print_report(results, elapsed, stage_rows(jobs), unfinished)
+        for name, service in fakes.items():
+            print(f'Fake {name}: {service.stats}')
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        for service in fakes.values():
+            service.stop()
+
+
+if __name__ == '__main__':
+    main()
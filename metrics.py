@@ -0,0 +1,345 @@
+"""
+Counters and histograms exposed in Prometheus text format on /metrics
+Each process records into its own in-memory registry and publishes a snapshot to a shared
+SQLite file every few seconds, so a scrape answered by any gunicorn worker sums the
+samples of all of them. Samples of workers that have since exited are folded into a retained
+total, so the file stays small and counters never go backwards.
+"""
+
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from sqlite_db import ThreadLocalConnection, transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_samples (
+    process TEXT NOT NULL,
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (process, name, labels)
+);
+CREATE TABLE IF NOT EXISTS metric_retired (
+    process TEXT PRIMARY KEY,
+    retired_at REAL NOT NULL
+);
+"""
+
+# metric_samples process holding the summed samples of processes that have exited
+RETIRED = 'retired'
+
+# Seconds a folded process id is remembered, so a process that was only stalled notices it
+RETIRED_TTL = 86400
+
+# Seconds; covers a fast SQLite write up to a slow CRM call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Timer:
+    """
+    Context manager observing the elapsed time of its block on a histogram series.
+    If the histogram has an 'outcome' label it is set to 'ok' or 'error' (the block raised).
+    """
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = self.labels
+        if 'outcome' in self.histogram.labelnames and 'outcome' not in labels:
+            labels = {**labels, 'outcome': 'ok' if exc_type is None else 'error'}
+        self.histogram.observe(time.perf_counter() - self.start, **labels)
+        return False
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def discount(self, published):
+        """Subtract samples already counted elsewhere ({key: value})"""
+        with self._lock:
+            for key, value in published.items():
+                if key in self._values:
+                    self._values[key] -= value
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def render(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            return {key: [list(series[0]), series[1], series[2]] for key, series in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def discount(self, published):
+        """Subtract samples already counted elsewhere ({key: [bucket counts, sum, count]})"""
+        with self._lock:
+            for key, value in published.items():
+                series = self._values.get(key)
+                if series is not None:
+                    series[0] = [a - b for a, b in zip(series[0], value[0])]
+                    series[1] -= value[1]
+                    series[2] -= value[2]
+
+    def merge(self, total, value):
+        if total is None:
+            return [list(value[0]), value[1], value[2]]
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1], total[2] + value[2]]
+
+    def render(self, key, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value[0]):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else _format_value(bound)
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames + ("le",), key + (le,))} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(value[1])}')
+        lines.append(f'{self.name}_count{labels} {value[2]}')
+        return lines
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_gauge(name, help_text, values, labelname=None):
+    """Prometheus lines for a gauge read at scrape time; values is {label value: number} or a number"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+    if labelname is None:
+        lines.append(f'{name} {_format_value(values)}')
+    else:
+        for label, value in sorted(values.items()):
+            lines.append(f'{name}{_format_labels((labelname,), (str(label),))} {_format_value(value)}')
+    return lines
+
+
+class Registry:
+    """
+    Metrics of this process, optionally shared with other processes through db_path.
+
+    publish() writes this process's samples to the shared file (a background thread does
+    it every publish_interval seconds); render() returns the Prometheus text for the sum
+    over every process that has published. A process that has not published for
+    stale_after seconds has exited: its samples are added to the retained total.
+    """
+
+    def __init__(self, db_path=None, publish_interval=5, stale_after=None):
+        self.publish_interval = publish_interval
+        self.stale_after = stale_after or max(600, publish_interval * 20)
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._conn = ThreadLocalConnection(db_path, on_connect=lambda conn: conn.executescript(SCHEMA)) \
+            if db_path else None
+        self._started_pid = None
+        self._pid = os.getpid()
+        self._process = self._new_process_id()
+        # {metric name: {key: value}} as last written under self._process
+        self._published = {}
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    @staticmethod
+    def _new_process_id():
+        # Unique even when a restarted worker is given a recycled pid
+        return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}'
+
+    def process_id(self):
+        return self._process
+
+    def ensure_started(self):
+        """Start this process's publisher thread (once per process, so it survives gunicorn's fork)"""
+        if not self._conn or self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # Samples inherited across fork belong to the parent, which publishes them itself
+                for metric in self._metrics.values():
+                    metric.reset()
+                self._pid = os.getpid()
+                self._process = self._new_process_id()
+                self._published = {}
+            threading.Thread(target=self._run, name='metrics-publisher', daemon=True).start()
+            atexit.register(self.publish)
+            self._started_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.publish_interval)
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"Metrics publish error: {e}")
+
+    def publish(self):
+        if not self._conn:
+            return
+        conn = self._conn.get()
+        with transaction(conn):
+            now = time.time()
+            if conn.execute('SELECT 1 FROM metric_retired WHERE process = ?', (self._process,)).fetchone():
+                # Stalled long enough to be taken for exited: what it published is in the retained total,
+                # so only what was recorded since goes out, under a new id
+                print(f"Metrics: process {self._process} was retired while still running; starting a new series")
+                for metric in self._metrics.values():
+                    metric.discount(self._published.get(metric.name, {}))
+                self._process = self._new_process_id()
+            published = {metric.name: metric.samples() for metric in list(self._metrics.values())}
+            rows = [
+                (self._process, name, json.dumps(key), json.dumps(value), now)
+                for name, samples in published.items()
+                for key, value in samples.items()
+            ]
+            conn.executemany(
+                'INSERT OR REPLACE INTO metric_samples (process, name, labels, value, updated_at) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+            self._retire_stale(conn, now)
+        self._published = published
+
+    def _retire_stale(self, conn, now):
+        """Fold the samples of processes that stopped publishing into the retained total"""
+        stale = conn.execute(
+            'SELECT process, name, labels, value FROM metric_samples WHERE process != ? AND updated_at < ?',
+            (RETIRED, now - self.stale_after)
+        ).fetchall()
+        if stale:
+            retained = {
+                (row['name'], row['labels']): json.loads(row['value'])
+                for row in conn.execute('SELECT name, labels, value FROM metric_samples WHERE process = ?', (RETIRED,))
+            }
+            for row in stale:
+                metric = self._metrics.get(row['name'])
+                if metric is not None:  # metrics no longer registered are dropped
+                    key = (row['name'], row['labels'])
+                    retained[key] = metric.merge(retained.get(key), json.loads(row['value']))
+            conn.executemany(
+                'INSERT OR REPLACE INTO metric_samples (process, name, labels, value, updated_at) VALUES (?, ?, ?, ?, ?)',
+                [(RETIRED, name, labels, json.dumps(value), now) for (name, labels), value in retained.items()]
+            )
+            processes = {row['process'] for row in stale}
+            conn.executemany('DELETE FROM metric_samples WHERE process = ?', [(process,) for process in processes])
+            conn.executemany('INSERT OR REPLACE INTO metric_retired (process, retired_at) VALUES (?, ?)',
+                             [(process, now) for process in processes])
+        conn.execute('DELETE FROM metric_retired WHERE retired_at < ?', (now - RETIRED_TTL,))
+
+    def collect(self):
+        """{metric name: {label values: merged value}} over all processes"""
+        totals = {name: {} for name in self._metrics}
+        if self._conn:
+            self.publish()
+            rows = self._conn.get().execute('SELECT name, labels, value FROM metric_samples').fetchall()
+            samples = ((row['name'], tuple(json.loads(row['labels'])), json.loads(row['value'])) for row in rows)
+        else:
+            samples = ((metric.name, key, value) for metric in self._metrics.values()
+                       for key, value in metric.samples().items())
+        for name, key, value in samples:
+            metric = self._metrics.get(name)
+            if metric is None or len(key) != len(metric.labelnames):
+                continue
+            totals[name][key] = metric.merge(totals[name].get(key), value)
+        return totals
+
+    def render(self):
+        lines = []
+        for name, series in self.collect().items():
+            metric = self._metrics[name]
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for key in sorted(series):
+                lines.extend(metric.render(key, series[key]))
+        return lines
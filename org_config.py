@@ -0,0 +1,28 @@
+"""
+Organization details and donor CSV location
+Shared by the web app and the command-line tools (batch_receipts.py), so they can read the
+configuration without importing the whole app. Values come from config.py when it exists,
+then ORG_* environment variables (Azure App Service) override them.
+"""
+
+import os
+
+try:
+    from config import ORGANIZATION_INFO, CSV_FILE
+except ImportError:
+    # Default configuration if config.py doesn't exist
+    ORGANIZATION_INFO = {
+        'name': 'Your Organization Name',
+        'address': '123 Main Street, City, State ZIP',
+        'tax_id': 'XX-XXXXXXX',
+        'phone': '(555) 123-4567',
+        'email': 'info@yourorganization.org'
+    }
+    CSV_FILE = 'donors.csv'
+
+# Override organization info with environment variables for Azure App Service
+ORGANIZATION_INFO['name'] = os.getenv('ORG_NAME', ORGANIZATION_INFO.get('name', ''))
+ORGANIZATION_INFO['address'] = os.getenv('ORG_ADDRESS', ORGANIZATION_INFO.get('address', ''))
+ORGANIZATION_INFO['tax_id'] = os.getenv('ORG_TAX_ID', ORGANIZATION_INFO.get('tax_id', ''))
+ORGANIZATION_INFO['phone'] = os.getenv('ORG_PHONE', ORGANIZATION_INFO.get('phone', ''))
+ORGANIZATION_INFO['email'] = os.getenv('ORG_EMAIL', ORGANIZATION_INFO.get('email', ''))
@@ -0,0 +1,164 @@
+"""
+PDF tax receipt rendering
+The text that is the same on every receipt is built once and pasted into each new PDF;
+only the donation date, items, donor block and generation time are drawn per receipt
+"""
+
+import io
+import threading
+from datetime import datetime
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+
+# Every font used on the receipt, registered in this order on every canvas so the
+# internal font names (/F1, /F2, ...) in the cached static layer stay valid
+RECEIPT_FONTS = ['Helvetica-Bold', 'Helvetica', 'Helvetica-Oblique']
+
+WIDTH, HEIGHT = letter
+
+# y position of the first itemized donation line
+ITEMS_TOP = HEIGHT - 1.7*inch - 0.2*inch - 0.3*inch - 0.2*inch - 0.2*inch - 0.4*inch - 0.3*inch
+
+
+def _register_fonts(c):
+    for font in RECEIPT_FONTS:
+        c.setFont(font, 10)
+
+
+def static_text(c, org_info):
+    """Text object holding the parts of the receipt that never change"""
+    text = c.beginText()
+
+    def line(font, size, x, y, value):
+        text.setFont(font, size)
+        text.setTextOrigin(x, y)
+        text.textOut(value)
+
+    # Header
+    line('Helvetica-Bold', 20, 1*inch, HEIGHT - 0.8*inch, "This is your Tax Receipt")
+
+    # Organization info
+    line('Helvetica', 10, 1*inch, HEIGHT - 1.1*inch, "Goodwill Industries of South Florida, Inc.")
+    line('Helvetica', 10, 1*inch, HEIGHT - 1.3*inch, org_info.get('address', ''))
+
+    # Tax acknowledgment (the second line carries the donation date and is drawn per receipt)
+    y_position = HEIGHT - 1.7*inch
+    line('Helvetica', 11, 1*inch, y_position, "Goodwill Industries of South Florida, Inc. acknowledges that a non-cash donation")
+    y_position -= 0.2*inch
+    y_position -= 0.3*inch
+
+    # 501(c)(3) statement
+    line('Helvetica', 11, 1*inch, y_position, "Goodwill Industries of South Florida, Inc is a 501(c)(3) non-profit organization.")
+    y_position -= 0.2*inch
+    line('Helvetica', 11, 1*inch, y_position, "Your donations are tax deductible to the fullest extent of the law.")
+    y_position -= 0.2*inch
+    line('Helvetica', 11, 1*inch, y_position, "No goods or services were provided in exchange for this donation.")
+    y_position -= 0.4*inch
+
+    # Itemized donations heading
+    line('Helvetica-Bold', 11, 1*inch, y_position, "For your records, below please find your itemized donation(s):")
+
+    # Footer
+    line('Helvetica-Oblique', 9, 1*inch, 1.2*inch, "Thank you for your generous donation!")
+    line('Helvetica-Oblique', 9, 1*inch, 1.0*inch, "Please consult with a tax professional regarding deductibility.")
+
+    return text
+
+
+def build_static_layer(org_info):
+    """Return the PDF text operators for the static parts of the receipt"""
+    scratch = canvas.Canvas(io.BytesIO(), pagesize=letter)
+    _register_fonts(scratch)
+    return static_text(scratch, org_info).getCode()
+
+
+def receipt_items(data):
+    """Lines listed under the itemized donations heading"""
+    if data['donationType'] == 'merchandise' and data.get('merchandiseItems'):
+        return list(data['merchandiseItems'])
+    return [data['donationType'].capitalize()]
+
+
+class ReceiptRenderer:
+    """Renders receipts, caching the static layer until the organization info changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._static = None
+
+    def static_layer(self, org_info):
+        key = tuple(sorted(org_info.items()))
+        with self._lock:
+            if key != self._key:
+                self._static = build_static_layer(org_info)
+                self._key = key
+            return self._static
+
+    def render(self, data, org_info, generated_at=None, use_cache=True):
+        """Render a receipt for data and return it as a BytesIO"""
+        generated_at = generated_at or datetime.now()
+
+        buffer = io.BytesIO()
+        c = canvas.Canvas(buffer, pagesize=letter)
+        _register_fonts(c)
+        if use_cache:
+            c.addLiteral(self.static_layer(org_info))
+        else:
+            c.drawText(static_text(c, org_info))
+
+        # Donation date (second line of the acknowledgment)
+        donation_date = datetime.strptime(data['donationDate'], '%Y-%m-%d').strftime('%m/%d/%Y')
+        c.setFont("Helvetica", 11)
+        c.drawString(1*inch, HEIGHT - 1.9*inch, f"was received on {donation_date}.")
+
+        # Itemized donations
+        y_position = ITEMS_TOP
+        for item in receipt_items(data):
+            c.drawString(1.2*inch, y_position, f"• {item}")
+            y_position -= 0.2*inch
+
+        y_position -= 0.2*inch
+
+        # IRS regulation notice
+        c.setFont("Helvetica-Oblique", 10)
+        c.drawString(1*inch, y_position, "IRS Regulations prohibit charitable organizations from establishing or affirming")
+        y_position -= 0.2*inch
+        c.drawString(1*inch, y_position, "the value of contributions.")
+        y_position -= 0.5*inch
+
+        # Donor Information section
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(1*inch, y_position, "Donor Information:")
+        y_position -= 0.3*inch
+
+        c.setFont("Helvetica", 10)
+        donor_info = [
+            f"Name: {data['firstName']} {data['lastName']}",
+            f"Email: {data['email']}",
+            f"Phone: {data['phone']}",
+            f"Address: {data.get('address') or ''}",
+            f"Location: {data['location']}"
+        ]
+
+        for line in donor_info:
+            c.drawString(1*inch, y_position, line)
+            y_position -= 0.2*inch
+
+        # Receipt date at bottom
+        c.setFont("Helvetica", 8)
+        c.drawString(1*inch, 0.7*inch, f"Receipt Generated: {generated_at.strftime('%B %d, %Y at %I:%M %p')}")
+
+        c.save()
+        buffer.seek(0)
+        return buffer
+
+
+renderer = ReceiptRenderer()
+
+
+def render_receipt(data, org_info, generated_at=None):
+    """Render a receipt with the shared process-wide renderer"""
+    return renderer.render(data, org_info, generated_at=generated_at)
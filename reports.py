@@ -0,0 +1,124 @@
+"""
+Donation counts for /api/reports, kept as daily rollups in SQLite
+Rows are folded into per-day counters (location x donation type, plus merchandise items) as
+they are recorded, so a report sums a few rows per day in the range however long the
+donation history gets. The rollups tail the donor store from the last position they
+counted, so every worker's donations are counted exactly once.
+"""
+
+from donor_store import split_items
+from sqlite_db import ThreadLocalConnection, transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS donation_rollups (
+    day TEXT NOT NULL,
+    location TEXT NOT NULL,
+    donation_type TEXT NOT NULL,
+    item TEXT NOT NULL,
+    donations INTEGER NOT NULL,
+    PRIMARY KEY (day, location, donation_type, item)
+);
+CREATE TABLE IF NOT EXISTS rollup_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    source TEXT NOT NULL,
+    position INTEGER NOT NULL
+);
+"""
+
+# Buckets for the optional time series (SQLite expressions over the day column)
+INTERVALS = {
+    'day': 'day',
+    'week': "date(day, '-6 days', 'weekday 1')",  # Monday starting the week
+    'month': "substr(day, 1, 7)"
+}
+
+
+def row_counts(row):
+    """Rollup keys a donors.csv row adds to: (day, location, type, item), item '' for the donation itself"""
+    day = (row.get('Donation Date') or row.get('Date Recorded') or '')[:10]
+    location = row.get('Location') or ''
+    donation_type = row.get('Donation Type') or ''
+    keys = [(day, location, donation_type, '')]
+    keys.extend((day, location, donation_type, item) for item in split_items(row.get('Merchandise Items')))
+    return keys
+
+
+class DonationRollups:
+    """
+    Daily donation counters over a donor store.
+
+    store must provide rows_since(position) -> (rows, position) as the donor stores do;
+    source names it, so switching DONOR_STORE_BACKEND recounts from the new store.
+    """
+
+    def __init__(self, db_path, store, source):
+        self.store = store
+        self.source = source
+        self._conn = ThreadLocalConnection(db_path, on_connect=lambda conn: conn.executescript(SCHEMA))
+
+    def refresh(self):
+        """Count rows recorded since the last refresh (by any process); returns how many were added"""
+        conn = self._conn.get()
+        with transaction(conn):
+            # The write lock is held from here, so two workers never count the same rows
+            state = conn.execute('SELECT source, position FROM rollup_state WHERE id = 1').fetchone()
+            position = state['position'] if state and state['source'] == self.source else None
+            rows = None
+            if position is not None:
+                rows, new_position = self.store.rows_since(position)
+            if rows is None:
+                # First run, a different store, or the store was replaced: count everything again
+                conn.execute('DELETE FROM donation_rollups')
+                rows, new_position = self.store.rows_since(0)
+            counts = {}
+            for row in rows:
+                for key in row_counts(row):
+                    counts[key] = counts.get(key, 0) + 1
+            conn.executemany(
+                'INSERT INTO donation_rollups (day, location, donation_type, item, donations) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (day, location, donation_type, item) DO UPDATE SET donations = donations + excluded.donations',
+                [key + (count,) for key, count in counts.items()]
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO rollup_state (id, source, position) VALUES (1, ?, ?)',
+                (self.source, new_position)
+            )
+        return len(rows)
+
+    def report(self, start=None, end=None, location=None, donation_type=None, interval=None):
+        """Donation totals by location, type and merchandise item (and per interval) for donation dates in [start, end]"""
+        clauses, params = [], []
+        if start:
+            clauses.append('day >= ?')
+            params.append(start)
+        if end:
+            clauses.append('day <= ?')
+            params.append(end)
+        if location:
+            clauses.append('location = ?')
+            params.append(location)
+        if donation_type:
+            clauses.append('donation_type = ?')
+            params.append(donation_type)
+        where = ''.join(' AND ' + clause for clause in clauses)
+        conn = self._conn.get()
+
+        def grouped(column, item_clause):
+            rows = conn.execute(
+                f'SELECT {column} AS value, SUM(donations) AS total FROM donation_rollups '
+                f'WHERE {item_clause}{where} GROUP BY value ORDER BY value', params
+            ).fetchall()
+            return {row['value']: row['total'] for row in rows}
+
+        by_type = grouped('donation_type', "item = ''")
+        result = {
+            'total': sum(by_type.values()),
+            'byLocation': grouped('location', "item = ''"),
+            'byType': by_type,
+            'byItem': grouped('item', "item != ''")
+        }
+        if interval:
+            result['series'] = [
+                {'period': period, 'total': total} for period, total in grouped(INTERVALS[interval], "item = ''").items()
+            ]
+        return result
@@ -0,0 +1,106 @@
+"""
+In-memory cache for settings files in PERSISTENT_DIR (locations, form title, email template)
+Parsed values are kept per process and revalidated with a stat() of the file at most every
+max_age seconds. Saves replace the file atomically, so a write from any gunicorn worker
+changes its inode/mtime and every other worker reloads it on its next check.
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+
+def atomic_write(path, text):
+    """Write text to path via a temp file and rename, so readers never see a partial file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def file_stamp(path):
+    """Version stamp of a file (None if it does not exist)"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class CachedSetting:
+    """
+    One settings file, parsed with parse(text) and serialized with dump(value).
+
+    get() returns the cached value while it is younger than max_age seconds;
+    after that the file is stat()ed and only re-read if its stamp changed.
+    A missing or unreadable file yields default().
+    """
+
+    def __init__(self, path, parse, dump, default, max_age=2.0):
+        self.path = path
+        self.parse = parse
+        self.dump = dump
+        self.default = default
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._value = None
+        self._stamp = None
+        self._loaded = False
+        self._checked_at = 0
+        self.stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'writes': 0}
+
+    def get(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._loaded and now - self._checked_at < self.max_age:
+                self.stats['hits'] += 1
+                return self._value
+
+            stamp = file_stamp(self.path)
+            self._checked_at = now
+            if self._loaded and stamp == self._stamp:
+                self.stats['revalidations'] += 1
+                self.stats['hits'] += 1
+                return self._value
+
+            self.stats['misses'] += 1
+            self._value, self._stamp, self._loaded = self._load(stamp)
+            return self._value
+
+    def _load(self, stamp):
+        if stamp is None:
+            return self.default(), None, True
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                value = self.parse(f.read())
+            # Stamp taken before the read: a concurrent replace is picked up on the next check
+            return value, stamp, True
+        except Exception as e:
+            print(f"Error loading {self.path}: {e}")
+            # Not cached, so the next call tries the file again
+            return self.default(), None, False
+
+    def save(self, value):
+        """Write value to the file and cache it; raises on failure"""
+        atomic_write(self.path, self.dump(value))
+        with self._lock:
+            self._value = value
+            self._stamp = file_stamp(self.path)
+            self._loaded = True
+            self._checked_at = time.monotonic()
+            self.stats['writes'] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def status(self):
+        with self._lock:
+            return {'path': self.path, 'maxAge': self.max_age, **self.stats}
@@ -0,0 +1,214 @@
+"""
+Thread-safe pool of authenticated SMTP sessions
+Keeps connections open between receipts instead of doing connect/STARTTLS/login for every email
+"""
+
+import os
+import smtplib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DeliveryUncertain(smtplib.SMTPException):
+    """The session failed after the message data went out, so the server may already have accepted it"""
+
+
+class _SMTP(smtplib.SMTP):
+    """SMTP session that notes when a message's DATA has started"""
+    data_started = False
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+def is_disconnect(error):
+    """True if an error means the session is gone and a fresh connection should be tried"""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)):
+        return True
+    # 421: service not available, closing transmission channel
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421
+
+
+class SMTPConnectionPool:
+    """
+    Pool of SMTP sessions for one server/account.
+
+    Idle sessions are reused until max_idle seconds old (servers drop idle
+    clients after a few minutes) or until they have sent max_messages
+    messages. A session that fails with a disconnect before the message
+    data is sent is replaced and the message is retried once on the new
+    session. After that point (e.g. a timeout waiting for the reply to DATA)
+    the message may have been delivered, so DeliveryUncertain is raised
+    instead of sending it again.
+    """
+
+    def __init__(self, host, port, username='', password='', use_tls=True, max_size=4,
+                 max_idle=120, max_messages=100, timeout=30, noop_after=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.noop_after = noop_after
+        self._lock = threading.Condition()
+        self._idle = []  # list of (smtp, last_used, sent_count)
+        self._in_use = 0
+        self._pid = os.getpid()
+        self.stats = {'connects': 0, 'reuses': 0, 'reconnects': 0, 'messages': 0}
+
+    def _connect(self):
+        """Open, secure and authenticate a new SMTP session"""
+        server = _SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.ehlo()
+            if self.use_tls:
+                server.starttls(context=ssl.create_default_context())
+                server.ehlo()
+            if self.username and self.password and server.has_extn('auth'):
+                server.login(self.username, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        self._count('connects')
+        return server
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _reset_after_fork(self):
+        # Sockets inherited from the parent process must not be shared
+        if self._pid != os.getpid():
+            self._idle = []
+            self._in_use = 0
+            self._pid = os.getpid()
+
+    def _is_alive(self, server, last_used):
+        if time.time() - last_used < self.noop_after:
+            return True
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Take a live session from the pool, opening one if needed (returns [smtp, sent_count])"""
+        # Only the bookkeeping happens under the lock; closing, NOOP and connecting talk to the
+        # server, and one slow server must not hold up every thread waiting for a session
+        expired = []
+        idle = None
+        with self._lock:
+            self._reset_after_fork()
+            while True:
+                while self._idle:
+                    server, last_used, sent = self._idle.pop()
+                    if time.time() - last_used > self.max_idle or sent >= self.max_messages:
+                        expired.append(server)
+                        continue
+                    idle = (server, last_used, sent)
+                    break
+                if idle or self._in_use < self.max_size:
+                    self._in_use += 1
+                    break
+                self._lock.wait(self.timeout)
+
+        for server in expired:
+            self._close(server)
+        if idle:
+            server, last_used, sent = idle
+            if self._is_alive(server, last_used):
+                self._count('reuses')
+                return [server, sent]
+            # Dropped by the server while idle: replace it using the same slot
+            self._close(server)
+
+        try:
+            return [self._connect(), 0]
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+    def release(self, entry, broken=False):
+        """Return a session to the pool (or drop it if it is broken)"""
+        server, sent = entry
+        with self._lock:
+            self._in_use -= 1
+            drop = broken or self._pid != os.getpid()
+            if not drop:
+                self._idle.append((server, time.time(), sent))
+            self._lock.notify()
+        if drop:
+            self._close(server)
+
+    @contextmanager
+    def connection(self):
+        entry = self.acquire()
+        try:
+            yield entry
+        except Exception:
+            self.release(entry, broken=True)
+            raise
+        else:
+            self.release(entry)
+
+    def send_message(self, msg):
+        """Send one email.message.Message"""
+        self.send_messages([msg])
+
+    def send_messages(self, messages):
+        """Send several messages back to back over a single session"""
+        with self.connection() as entry:
+            for msg in messages:
+                try:
+                    self._send(entry[0], msg)
+                except DeliveryUncertain:
+                    raise
+                except Exception as e:
+                    if not is_disconnect(e):
+                        raise
+                    # The server dropped us (idle timeout, restart) before the message went out - reconnect and retry once
+                    self._close(entry[0])
+                    entry[0] = self._connect()
+                    entry[1] = 0
+                    self._count('reconnects')
+                    self._send(entry[0], msg)
+                entry[1] += 1
+                self._count('messages')
+
+    @staticmethod
+    def _send(server, msg):
+        server.data_started = False
+        try:
+            server.send_message(msg)
+        except Exception as e:
+            # A reply code means the server answered (and a 4xx/5xx to DATA means it did not take the
+            # message); losing the session without a reply after DATA leaves delivery unknown
+            if server.data_started and is_disconnect(e) and not isinstance(e, smtplib.SMTPResponseException):
+                raise DeliveryUncertain(f"SMTP session lost after the message was sent, not resending: {e}") from e
+            raise
+
+    def close_all(self):
+        """Close every idle session"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _, _ in idle:
+            self._close(server)
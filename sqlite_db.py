@@ -0,0 +1,91 @@
+"""
+Small SQLite helpers shared by the job queue and other local stores
+Each thread gets its own connection; SQLite handles locking across gunicorn workers
+"""
+
+import os
+import sqlite3
+import threading
+
+
+def connect(db_path, timeout=30):
+    """Open a SQLite connection tuned for many short writes from several processes"""
+    directory = os.path.dirname(os.path.abspath(db_path))
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={int(timeout * 1000)}')
+    return conn
+
+
+class ThreadLocalConnection:
+    """Hands out one connection per thread (and per process, so it is fork-safe)"""
+
+    def __init__(self, db_path, on_connect=None):
+        self.db_path = db_path
+        self.on_connect = on_connect
+        self._local = threading.local()
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = connect(self.db_path)
+            if self.on_connect:
+                self.on_connect(conn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class transaction:
+    """Context manager for an IMMEDIATE transaction (takes the write lock up front)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
+
+
+class ClaimHeartbeat:
+    """
+    Calls renew() every interval seconds until the block exits.
+    Claimed rows older than a claim timeout are taken over by other workers, so a claimant that
+    can be busy for longer than that (a slow stage, a rate-limit pause) keeps its claims fresh.
+    """
+
+    def __init__(self, renew, interval, name='claims'):
+        self.renew = renew
+        self.interval = interval
+        self.name = name
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.renew()
+            except Exception as e:
+                print(f"Claim renewal error ({self.name}): {e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
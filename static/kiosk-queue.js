@@ -0,0 +1,203 @@
+// Offline queue for kiosk donations, shared by index.html and the service worker (sw.js).
+// Every submission is stored in IndexedDB first and removed only once the server has
+// accepted it. Each record carries a clientId, so resending a batch never records a
+// donation twice.
+const KioskQueue = (() => {
+    const DB_NAME = 'donation-kiosk';
+    const STORE = 'submissions';
+    const BATCH_SIZE = 25;
+    const BASE_DELAY = 5000;
+    const MAX_DELAY = 10 * 60 * 1000;
+    // Server errors (5xx) on a batch before it is split, and on a single record before it is marked failed
+    const SPLIT_AFTER = 2;
+    const FAIL_AFTER = 3;
+
+    function openDb() {
+        return new Promise((resolve, reject) => {
+            const request = indexedDB.open(DB_NAME, 1);
+            request.onupgradeneeded = () => {
+                request.result.createObjectStore(STORE, { keyPath: 'clientId' });
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    async function withStore(mode, fn) {
+        const db = await openDb();
+        try {
+            return await new Promise((resolve, reject) => {
+                const tx = db.transaction(STORE, mode);
+                const result = fn(tx.objectStore(STORE));
+                tx.oncomplete = () => resolve(result && 'result' in result ? result.result : result);
+                tx.onerror = () => reject(tx.error);
+                tx.onabort = () => reject(tx.error);
+            });
+        } finally {
+            db.close();
+        }
+    }
+
+    function newClientId() {
+        if (self.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    }
+
+    // Store a donation; returns the queued record
+    async function add(donation) {
+        const record = {
+            clientId: newClientId(),
+            donation: donation,
+            queuedAt: Date.now(),
+            attempts: 0,
+            nextAttemptAt: 0,
+            status: 'queued'
+        };
+        await withStore('readwrite', store => store.put(record));
+        return record;
+    }
+
+    async function remove(clientId) {
+        await withStore('readwrite', store => store.delete(clientId));
+    }
+
+    async function all() {
+        return withStore('readonly', store => store.getAll());
+    }
+
+    async function counts() {
+        const records = await all();
+        return {
+            queued: records.filter(r => r.status === 'queued').length,
+            rejected: records.filter(r => r.status === 'invalid').length,
+            failed: records.filter(r => r.status === 'failed').length
+        };
+    }
+
+    // Exponential backoff with jitter, capped at MAX_DELAY
+    function backoff(attempts) {
+        const delay = Math.min(MAX_DELAY, BASE_DELAY * 2 ** Math.max(0, attempts - 1));
+        return delay / 2 + Math.random() * delay / 2;
+    }
+
+    async function postBatch(apiUrl, batch) {
+        const response = await fetch(`${apiUrl}/submit-donations/batch`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(batch.map(r => ({ ...r.donation, clientId: r.clientId })))
+        });
+        if (!response.ok) {
+            const error = new Error(`Server responded ${response.status}`);
+            error.status = response.status;
+            throw error;
+        }
+        return response.json();
+    }
+
+    // True when the server answers its health check, i.e. a 5xx came from the batch itself
+    async function serverHealthy(apiUrl) {
+        try {
+            return (await fetch(`${apiUrl}/health`, { cache: 'no-store' })).ok;
+        } catch (error) {
+            return false;
+        }
+    }
+
+    // Send due records in batches. Returns { results, remaining, retryAt } where results maps
+    // clientId -> server result for every record the server answered for.
+    // force ignores the backoff (used right after the volunteer submits).
+    // A batch that keeps failing with a 5xx while the server is otherwise healthy is split in
+    // half until the record causing it is alone; that record is marked failed and retried on
+    // its own every MAX_DELAY, so the rest of the queue can drain.
+    async function flush(apiUrl, force = false) {
+        const results = {};
+        const now = Date.now();
+        const due = (await all())
+            .filter(r => (r.status === 'queued' || r.status === 'failed') && (force || r.nextAttemptAt <= now))
+            .sort((a, b) => a.queuedAt - b.queuedAt);
+
+        const queued = due.filter(r => r.status === 'queued');
+        const work = [];
+        for (let i = 0; i < queued.length; i += BATCH_SIZE) {
+            work.push(queued.slice(i, i + BATCH_SIZE));
+        }
+        due.filter(r => r.status === 'failed').forEach(r => work.push([r]));
+
+        while (work.length) {
+            const batch = work.shift();
+            let response;
+            try {
+                response = await postBatch(apiUrl, batch);
+            } catch (error) {
+                const message = String(error.message || error);
+                const serverError = error.status >= 500;
+                if (serverError) {
+                    batch.forEach(r => {
+                        r.serverErrors = (r.serverErrors || 0) + 1;
+                    });
+                }
+                const repeated = serverError && Math.min(...batch.map(r => r.serverErrors)) >= SPLIT_AFTER;
+                if (repeated && await serverHealthy(apiUrl)) {
+                    if (batch.length > 1) {
+                        // Send the halves separately to find the record the server cannot handle
+                        const half = Math.ceil(batch.length / 2);
+                        await withStore('readwrite', store => {
+                            batch.forEach(r => {
+                                r.lastError = message;
+                                store.put(r);
+                            });
+                        });
+                        work.unshift(batch.slice(0, half), batch.slice(half));
+                        continue;
+                    }
+                    if (batch[0].serverErrors >= FAIL_AFTER) {
+                        // Kept so the donor's details are not lost; retried alone now and then
+                        const record = batch[0];
+                        await withStore('readwrite', store => {
+                            record.status = 'failed';
+                            record.attempts += 1;
+                            record.nextAttemptAt = Date.now() + MAX_DELAY;
+                            record.lastError = message;
+                            store.put(record);
+                        });
+                        continue;
+                    }
+                }
+                // Offline or server trouble: back off this batch and everything after it
+                const failed = batch.concat(...work);
+                await withStore('readwrite', store => {
+                    failed.forEach(r => {
+                        r.attempts += 1;
+                        r.nextAttemptAt = Date.now() + (r.status === 'failed' ? MAX_DELAY : backoff(r.attempts));
+                        r.lastError = message;
+                        store.put(r);
+                    });
+                });
+                break;
+            }
+
+            await withStore('readwrite', store => {
+                response.results.forEach(result => {
+                    const record = batch[result.index];
+                    results[record.clientId] = result;
+                    if (result.status === 'invalid') {
+                        // Kept (not retried) so the donor's details are not lost
+                        record.status = 'invalid';
+                        record.errors = result.errors;
+                        store.put(record);
+                    } else {
+                        store.delete(record.clientId);
+                    }
+                });
+            });
+        }
+
+        const remaining = (await all()).filter(r => r.status === 'queued');
+        const retryAt = remaining.length ? Math.min(...remaining.map(r => r.nextAttemptAt)) : null;
+        return { results, remaining: remaining.length, retryAt };
+    }
+
+    return { add, remove, all, counts, flush };
+})();
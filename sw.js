@@ -0,0 +1,96 @@
+// Service worker for the donation kiosk
+// - keeps the kiosk page, its assets and the locations / form title available offline
+// - flushes the IndexedDB donation queue (static/kiosk-queue.js) on background sync
+importScripts('/static/kiosk-queue.js');
+
+const CACHE_NAME = 'donation-kiosk-v1';
+const API_URL = '/api';
+const SHELL = [
+    '/',
+    '/static/kiosk-queue.js',
+    '/static/goodwill_gulliver_logo.png',
+    '/static/onda_verde_logo.png'
+];
+// Settings the form needs to render; served from cache at once and refreshed in the background
+const CACHED_API = ['/api/locations', '/api/form-title'];
+
+self.addEventListener('install', event => {
+    event.waitUntil(caches.open(CACHE_NAME).then(cache => cache.addAll(SHELL)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys.filter(key => key !== CACHE_NAME).map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+async function staleWhileRevalidate(request) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(request);
+    const network = fetch(request).then(response => {
+        if (response.ok) {
+            cache.put(request, response.clone());
+        }
+        return response;
+    });
+    if (cached) {
+        network.catch(() => {});
+        return cached;
+    }
+    return network;
+}
+
+async function networkFirst(request) {
+    const cache = await caches.open(CACHE_NAME);
+    try {
+        const response = await fetch(request);
+        if (response.ok) {
+            cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await cache.match(request);
+        if (cached) {
+            return cached;
+        }
+        throw error;
+    }
+}
+
+self.addEventListener('fetch', event => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || url.origin !== self.location.origin) {
+        return;
+    }
+    if (CACHED_API.includes(url.pathname)) {
+        event.respondWith(staleWhileRevalidate(event.request));
+    } else if (event.request.mode === 'navigate' && url.pathname === '/') {
+        event.respondWith(networkFirst(event.request));
+    } else if (url.pathname.startsWith('/static/')) {
+        event.respondWith(staleWhileRevalidate(event.request));
+    }
+});
+
+async function flushQueue() {
+    const outcome = await KioskQueue.flush(API_URL);
+    const clients = await self.clients.matchAll();
+    clients.forEach(client => client.postMessage({ type: 'queue-flushed', ...outcome }));
+    if (outcome.remaining) {
+        // Rejecting makes the browser retry the sync later with its own backoff
+        throw new Error(`${outcome.remaining} donations still queued`);
+    }
+}
+
+self.addEventListener('sync', event => {
+    if (event.tag === 'flush-donations') {
+        event.waitUntil(flushQueue());
+    }
+});
+
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'flush') {
+        event.waitUntil(flushQueue().catch(() => {}));
+    }
+});
@@ -5,6 +5,7 @@ Run this after deploying to test basic functionality
 
 import requests
 import json
+import time
 
 # Configuration
 BASE_URL = "http://localhost:5000"  # Change to your Azure URL when deployed
@@ -52,10 +53,10 @@ def test_submit_donation():
             result = response.json()
             if result.get('success'):
                 print("✓ Donation submitted successfully")
-                if result.get('emailSent'):
-                    print("✓ Email sent successfully")
-                else:
-                    print("⚠ Email sending failed (check email configuration)")
+                job_id = result.get('jobId')
+                if job_id:
+                    print(f"  Job ID: {job_id}")
+                    report_job_status(job_id)
                 return True
             else:
                 print(f"✗ Donation submission failed: {result.get('message')}")
@@ -68,6 +69,28 @@ def test_submit_donation():
         print(f"✗ Error submitting donation: {str(e)}")
         return False
 
+def report_job_status(job_id, timeout=30):
+    """Wait for a donation's background job and print each stage's outcome"""
+    deadline = time.time() + timeout
+    job = None
+    while time.time() < deadline:
+        response = requests.get(f"{BASE_URL}/api/jobs/{job_id}")
+        if response.status_code != 200:
+            print(f"⚠ Job status returned status code: {response.status_code}")
+            return
+        job = response.json()['job']
+        if job['status'] not in ('pending', 'running'):
+            break
+        time.sleep(1)
+
+    for stage, info in job['stages'].items():
+        if info['status'] == 'done':
+            print(f"✓ {stage} stage completed")
+        elif info['status'] == 'skipped':
+            print(f"- {stage} stage skipped: {info.get('error')}")
+        else:
+            print(f"⚠ {stage} stage {info['status']}: {info.get('error') or ''} (check configuration)")
+
 def test_csv_download():
     """Test CSV download"""
     print("\nTesting CSV download...")
@@ -0,0 +1,86 @@
+"""
+Constituent index: refresh watermark, sync leases and donor matching
+Run with: python -m pytest test_bloomerang_index.py
+"""
+
+import pytest
+
+import bloomerang_index
+from bloomerang_index import ConstituentIndex
+
+
+class FakeDirectory:
+    """Bloomerang constituents served page by page, in Id order, like fetch_constituents_page"""
+
+    def __init__(self, ids):
+        self.constituents = [self.constituent(i) for i in ids]
+        self.http_seen = []
+
+    @staticmethod
+    def constituent(constituent_id):
+        return {'Id': constituent_id, 'FirstName': 'Donor', 'LastName': str(constituent_id),
+                'FullName': f'Donor {constituent_id}',
+                'PrimaryEmail': {'Value': f'donor{constituent_id}@example.com'}}
+
+    def page(self, config, skip, take=bloomerang_index.PAGE_SIZE, order_direction='Asc', http=None):
+        self.http_seen.append(http)
+        ordered = sorted(self.constituents, key=lambda c: c['Id'], reverse=order_direction == 'Desc')
+        return ordered[skip:skip + take]
+
+
+@pytest.fixture
+def index(tmp_path):
+    return ConstituentIndex(str(tmp_path / 'bloomerang_index.db'))
+
+
+@pytest.fixture
+def directory(monkeypatch):
+    fake = FakeDirectory([1, 2, 3])
+    monkeypatch.setattr(bloomerang_index, 'fetch_constituents_page', fake.page)
+    return fake
+
+
+def test_refresh_finds_constituents_created_elsewhere_below_a_locally_added_id(index, directory):
+    index.full_sync({})
+    # A constituent this app created, with a higher Id than one created in Bloomerang meanwhile
+    index.add([FakeDirectory.constituent(10)])
+    directory.constituents += [FakeDirectory.constituent(5), FakeDirectory.constituent(10)]
+
+    index.refresh({})
+
+    assert index.find_match({'email': 'donor5@example.com'})['id'] == 5
+    assert index.status()['maxId'] == 10
+
+
+def test_sync_pages_go_through_the_given_client(index, directory):
+    client = object()
+    index.full_sync({}, http=client)
+    index.refresh({}, http=client)
+    assert directory.http_seen and all(http is client for http in directory.http_seen)
+
+
+def test_lease_is_only_released_by_its_holder(index):
+    index.set_state('lease:sync', 'another-worker@9999999999')
+    assert not index.try_lease('sync', ttl=60)
+    index.release_lease('sync')
+    assert index.get_state('lease:sync') == 'another-worker@9999999999'
+
+    index.set_state('lease:sync', 'another-worker@1')
+    assert index.try_lease('sync', ttl=60)
+    index.release_lease('sync')
+    assert index.get_state('lease:sync') is None
+
+
+def test_full_sync_stops_when_its_lease_is_taken_over(index, directory, monkeypatch):
+    directory.constituents = [FakeDirectory.constituent(i) for i in range(1, bloomerang_index.PAGE_SIZE * 2 + 1)]
+
+    def first_page_outlives_the_lease(config, skip, **kwargs):
+        # The lease ran out while this page was fetched and another worker took it over
+        index.set_state('lease:sync', 'another-worker@9999999999')
+        return directory.page(config, skip, **kwargs)
+
+    monkeypatch.setattr(bloomerang_index, 'fetch_constituents_page', first_page_outlives_the_lease)
+
+    assert index.full_sync({}) is False
+    assert not index.is_ready()
+    assert index.get_state('lease:sync') == 'another-worker@9999999999'
@@ -0,0 +1,189 @@
+"""
+Bloomerang sync: outbox retries and dead letters, transaction posts, rate limiting
+Run with: python -m pytest test_bloomerang_sync.py
+"""
+
+import threading
+import time
+
+import pytest
+
+from bloomerang_sync import (SyncOutbox, OutboxWorker, TransactionBatcher, TokenBucket, RateLimitedClient,
+                             RateLimited, AuthFailed, PermanentSyncError, DEAD, DONE, PENDING, MIN_RATE)
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return SyncOutbox(str(tmp_path / 'crm_outbox.db'))
+
+
+def donor(email='ada@example.com'):
+    return {'firstName': 'Ada', 'lastName': 'Lovelace', 'email': email, 'phone': '5551234567'}
+
+
+def make_worker(outbox, sync_donor, **kwargs):
+    kwargs.setdefault('base_delay', 0)
+    return OutboxWorker(outbox, sync_donor, **kwargs)
+
+
+def test_same_donor_is_synced_once_per_batch(outbox):
+    calls = []
+    outbox.enqueue('r1', donor())
+    outbox.enqueue('r2', donor('ADA@example.com '))
+    worker = make_worker(outbox, lambda data: calls.append(data) or {'constituent_id': 7})
+
+    assert worker.run_once('w1') == 2
+    assert len(calls) == 1
+    assert outbox.get('r1')['constituentId'] == outbox.get('r2')['constituentId'] == 7
+
+
+def test_failure_is_retried_then_dead_lettered(outbox):
+    def sync_donor(data):
+        raise IOError('Bloomerang timed out')
+
+    outbox.enqueue('r1', donor())
+    worker = make_worker(outbox, sync_donor, max_attempts=2)
+
+    worker.run_once('w1')
+    entry = outbox.get('r1')
+    assert (entry['status'], entry['attempts'], entry['lastError']) == (PENDING, 1, 'Bloomerang timed out')
+
+    worker.run_once('w1')
+    assert outbox.get('r1')['status'] == DEAD
+    assert [e['recordId'] for e in outbox.dead_letters()] == ['r1']
+
+    assert outbox.requeue_dead(['r1']) == 1
+    assert outbox.get('r1')['status'] == PENDING
+
+
+def test_permanent_error_is_dead_lettered_at_once(outbox):
+    def sync_donor(data):
+        raise PermanentSyncError('FirstName is required')
+
+    outbox.enqueue('r1', donor())
+    make_worker(outbox, sync_donor).run_once('w1')
+    assert outbox.get('r1')['status'] == DEAD
+
+
+@pytest.mark.parametrize('error', [RateLimited(60), AuthFailed(401, 300)])
+def test_rate_limits_and_auth_failures_do_not_use_up_attempts(outbox, error):
+    def sync_donor(data):
+        raise error
+
+    outbox.enqueue('r1', donor())
+    outbox.enqueue('r2', donor('grace@example.com'))
+    make_worker(outbox, sync_donor, max_attempts=1).run_once('w1')
+
+    for record_id in ('r1', 'r2'):
+        entry = outbox.get(record_id)
+        assert (entry['status'], entry['attempts']) == (PENDING, 0)
+        assert entry['nextAttemptAt'] > time.time() + 50
+
+
+def test_busy_batch_is_not_reclaimed(outbox):
+    started = threading.Event()
+
+    def sync_donor(data):
+        started.set()
+        time.sleep(1)
+        return {'constituent_id': 7}
+
+    outbox.enqueue('r1', donor())
+    worker = make_worker(outbox, sync_donor, claim_timeout=0.3)
+    thread = threading.Thread(target=worker.run_once, args=('w1',))
+    thread.start()
+    assert started.wait(5)
+    time.sleep(0.6)
+    assert outbox.claim_batch('w2', 10, stale_after=0.3) == []
+    thread.join()
+    assert outbox.get('r1')['status'] == DONE
+
+
+def synced(outbox, record_id='r1'):
+    outbox.enqueue(record_id, donor())
+    make_worker(outbox, lambda data: {'constituent_id': 7}).run_once('w1')
+
+
+def test_failed_post_is_retried_as_maybe_posted(outbox):
+    seen = []
+
+    def post(entry):
+        seen.append(entry['maybe_posted'])
+        if len(seen) == 1:
+            raise IOError('Bloomerang answered 503')
+        return 99
+
+    synced(outbox)
+    batcher = TransactionBatcher(outbox, post, base_delay=0)
+    batcher.flush()
+    assert outbox.get('r1')['transactionStatus'] == PENDING
+
+    batcher.flush()
+    assert seen == [False, True]
+    assert outbox.get('r1')['transactionId'] == 99
+    assert batcher.flush() == 0
+
+
+def test_abandoned_post_is_reclaimed_as_maybe_posted(outbox):
+    synced(outbox)
+    assert [e['maybe_posted'] for e in outbox.claim_transactions(10)] == [False]
+    time.sleep(0.05)
+    assert [e['maybe_posted'] for e in outbox.claim_transactions(10, stale_after=0.01)] == [True]
+
+
+def test_posted_transaction_is_not_queued_again_after_requeue(outbox):
+    synced(outbox)
+    TransactionBatcher(outbox, lambda entry: 99).flush()
+    # The donor is dead-lettered and requeued later (e.g. by an admin); 1 is its outbox row id
+    outbox.dead_letter([1], 'forced')
+    outbox.requeue_dead()
+    make_worker(outbox, lambda data: {'constituent_id': 7}).run_once('w1')
+    assert outbox.claim_transactions(10) == []
+    assert outbox.get('r1')['transactionId'] == 99
+
+
+def test_zero_rate_is_clamped():
+    bucket = TokenBucket(rate=0, capacity=1)
+    assert bucket.rate == MIN_RATE
+    bucket.acquire()
+    bucket.observe({'RateLimit-Remaining': '0.0001', 'RateLimit-Reset': '60'})
+    assert bucket.rate == MIN_RATE
+
+
+def test_bucket_pauses_when_the_window_is_spent():
+    bucket = TokenBucket(rate=100, capacity=10)
+    bucket.observe({'RateLimit-Remaining': '0', 'RateLimit-Reset': '30'})
+    assert bucket.status()['pausedFor'] > 25
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ''
+
+
+class StubHttp:
+    def __init__(self, response):
+        self.response = response
+
+    def request(self, method, url, retry=True, **kwargs):
+        return self.response
+
+
+def test_429_pauses_the_bucket_and_raises_rate_limited():
+    bucket = TokenBucket(rate=100, capacity=10)
+    client = RateLimitedClient(bucket, http=StubHttp(Response(429, {'Retry-After': '12'})))
+    with pytest.raises(RateLimited) as raised:
+        client.get('http://bloomerang.test/v2/constituents')
+    assert not isinstance(raised.value, AuthFailed)
+    assert raised.value.retry_after == 12
+    assert bucket.status()['pausedFor'] > 10
+
+
+def test_rejected_key_pauses_syncing():
+    bucket = TokenBucket(rate=100, capacity=10)
+    client = RateLimitedClient(bucket, http=StubHttp(Response(401)), auth_pause=300)
+    with pytest.raises(AuthFailed):
+        client.post('http://bloomerang.test/v2/constituent')
+    assert bucket.status()['pausedFor'] > 290
@@ -0,0 +1,117 @@
+"""
+Donor store: torn CSV lines, SQLite write-through catch-up and the merchandise item migration
+Run with: python -m pytest test_donor_store.py
+"""
+
+import sqlite3
+
+import pytest
+
+from donor_store import (CSVDonorStore, SQLiteDonorStore, WriteThroughDonorStore, SQLITE_ITEMS_VERSION,
+                         donation_to_row)
+
+
+def donation(first_name='Ada', items=None):
+    return {
+        'firstName': first_name,
+        'lastName': 'Lovelace',
+        'email': f'{first_name.lower()}@example.com',
+        'phone': '(555) 123-4567',
+        'address': '1 Main St',
+        'donationType': 'merchandise',
+        'merchandiseItems': items if items is not None else ['Clothing', 'Books'],
+        'donationDate': '2026-01-15',
+        'location': 'Main Office'
+    }
+
+
+@pytest.fixture
+def write_through(tmp_path):
+    store = WriteThroughDonorStore(CSVDonorStore(str(tmp_path / 'donors.csv')),
+                                   SQLiteDonorStore(str(tmp_path / 'donors.db')))
+    store.ensure_ready()
+    return store
+
+
+def first_names(rows):
+    return [row['First Name'] for row in rows]
+
+
+def test_torn_final_line_is_cut_before_the_next_append(tmp_path):
+    path = tmp_path / 'donors.csv'
+    store = CSVDonorStore(str(path))
+    store.append(donation('Ada'))
+    with open(path, 'ab') as f:
+        f.write(b'2026-01-15 10:00:00,Half,Writ')
+
+    store.append(donation('Grace'))
+
+    assert first_names(store.iter_rows()) == ['Ada', 'Grace']
+    assert (tmp_path / 'donors.csv.torn').read_bytes().startswith(b'2026-01-15 10:00:00,Half,Writ')
+
+
+def test_failed_sqlite_write_is_caught_up_on_the_next_append(write_through, monkeypatch):
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(write_through.sqlite_store, 'append_many', fail)
+        write_through.append(donation('Ada'), record_id='r1')
+    assert first_names(write_through.csv_store.iter_rows()) == ['Ada']
+    assert write_through.sqlite_store.count() == 0
+
+    write_through.append(donation('Grace'), record_id='r2')
+
+    assert first_names(write_through.iter_rows()) == ['Ada', 'Grace']
+    assert write_through.sqlite_store.csv_position() == write_through.csv_store.rows_since(0)[1]
+
+
+def test_restart_copies_missing_rows_once(tmp_path, write_through):
+    write_through.append_many([donation('Ada'), donation('Grace')], record_ids=['r1', 'r2'])
+    # Another process appended to donors.csv without writing through
+    write_through.csv_store.append(donation('Hedy'))
+
+    for _ in range(2):
+        restarted = WriteThroughDonorStore(CSVDonorStore(str(tmp_path / 'donors.csv')),
+                                           SQLiteDonorStore(str(tmp_path / 'donors.db')))
+        restarted.ensure_ready()
+
+    assert first_names(restarted.iter_rows()) == ['Ada', 'Grace', 'Hedy']
+
+
+def test_old_merchandise_text_is_migrated_to_item_ids(tmp_path):
+    path = str(tmp_path / 'donors.db')
+    conn = sqlite3.connect(path)
+    conn.execute(
+        'CREATE TABLE donations (id INTEGER PRIMARY KEY AUTOINCREMENT, record_id TEXT UNIQUE, '
+        'date_recorded TEXT NOT NULL, first_name TEXT, last_name TEXT, email TEXT, email_normalized TEXT, '
+        'phone TEXT, phone_digits TEXT, address TEXT, donation_type TEXT, merchandise_items TEXT, '
+        'donation_date TEXT, location TEXT)'
+    )
+    for row in (donation_to_row(donation('Ada', ['Clothing', 'Bikes, kids'])), donation_to_row(donation('Grace', []))):
+        conn.execute(
+            'INSERT INTO donations (date_recorded, first_name, last_name, email, phone, address, donation_type, '
+            'merchandise_items, donation_date, location) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row
+        )
+    conn.commit()
+    conn.close()
+
+    store = SQLiteDonorStore(path)
+    rows = list(store.iter_rows())
+
+    assert [row['Merchandise Items'] for row in rows] == ['Clothing, Bikes\\, kids', 'N/A']
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == SQLITE_ITEMS_VERSION
+    assert conn.execute('SELECT COUNT(*) FROM donations WHERE merchandise_items IS NOT NULL').fetchone()[0] == 0
+    assert conn.execute('SELECT item_ids FROM donations ORDER BY id').fetchall() == [('[1,9]',), (None,)]
+
+
+def test_item_ids_from_a_rolled_back_insert_are_not_cached(tmp_path):
+    store = SQLiteDonorStore(str(tmp_path / 'donors.db'))
+    broken_row = donation_to_row(donation('Ada', ['Bikes']))[:-1]
+    with pytest.raises(sqlite3.Error):
+        store.insert_rows([broken_row])
+    assert 'Bikes' not in store._item_ids
+
+    store.append(donation('Grace', ['Bikes']))
+    assert [row['Merchandise Items'] for row in store.iter_rows()] == ['Bikes']
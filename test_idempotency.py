@@ -0,0 +1,61 @@
+"""
+Idempotency-Key store: reserve, replay, release and cross-worker sharing
+Run with: python -m pytest test_idempotency.py
+"""
+
+import time
+
+from idempotency import IdempotencyStore, NEW, REPLAY, IN_PROGRESS, MISMATCH
+
+
+def test_completed_key_replays_the_stored_response():
+    store = IdempotencyStore()
+    assert store.begin('k', 'body') == (NEW, None)
+    store.complete('k', 'body', 200, {'success': True, 'jobId': 'j1'})
+    assert store.begin('k', 'body') == (REPLAY, (200, {'success': True, 'jobId': 'j1'}))
+
+
+def test_running_key_is_in_progress_and_other_body_is_a_mismatch():
+    store = IdempotencyStore()
+    store.begin('k', 'body')
+    assert store.begin('k', 'body') == (IN_PROGRESS, None)
+    assert store.begin('k', 'other body') == (MISMATCH, None)
+
+
+def test_released_key_runs_again():
+    store = IdempotencyStore()
+    store.begin('k', 'body')
+    store.release('k')
+    assert store.begin('k', 'body') == (NEW, None)
+
+
+def test_abandoned_reservation_is_taken_over():
+    store = IdempotencyStore(lock_timeout=0)
+    store.begin('k', 'body')
+    assert store.begin('k', 'body') == (NEW, None)
+
+
+def test_expired_key_runs_again():
+    store = IdempotencyStore(ttl=0.01)
+    store.begin('k', 'body')
+    store.complete('k', 'body', 200, {})
+    time.sleep(0.02)
+    assert store.begin('k', 'body') == (NEW, None)
+
+
+def test_workers_share_keys_through_sqlite(tmp_path):
+    path = str(tmp_path / 'idempotency.db')
+    first, second = IdempotencyStore(path), IdempotencyStore(path)
+    assert first.begin('k', 'body') == (NEW, None)
+    assert second.begin('k', 'body') == (IN_PROGRESS, None)
+    first.complete('k', 'body', 200, {'jobId': 'j1'})
+    assert second.begin('k', 'body') == (REPLAY, (200, {'jobId': 'j1'}))
+
+
+def test_release_does_not_drop_a_completed_key(tmp_path):
+    path = str(tmp_path / 'idempotency.db')
+    first, second = IdempotencyStore(path), IdempotencyStore(path)
+    first.begin('k', 'body')
+    first.complete('k', 'body', 200, {'jobId': 'j1'})
+    second.release('k')
+    assert second.begin('k', 'body') == (REPLAY, (200, {'jobId': 'j1'}))
@@ -0,0 +1,150 @@
+"""
+Job pipeline: retries, permanent failures, held jobs and claim takeover
+Run with: python -m pytest test_jobs.py
+"""
+
+import threading
+import time
+
+import pytest
+
+from jobs import (JobStore, JobPipeline, PermanentStageError, StageSkipped,
+                  DONE, FAILED, HELD, PENDING, SKIPPED)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.db'))
+
+
+def make_pipeline(store, handlers, **kwargs):
+    kwargs.setdefault('retry_delay', 0)
+    return JobPipeline(store, ['pdf', 'email', 'crm'], handlers, depends_on={'email': 'pdf'}, **kwargs)
+
+
+def test_failed_stage_is_retried_then_gives_up(store):
+    calls = []
+
+    def email(job_id, data, results):
+        calls.append(job_id)
+        raise IOError('smtp down')
+
+    finished = []
+    pipeline = make_pipeline(store, {'pdf': lambda *a: 'receipt.pdf', 'email': email, 'crm': lambda *a: None},
+                             max_attempts=2, on_finish=lambda job_id, status: finished.append(status))
+    job_id = pipeline.submit({'email': 'a@b.c'})
+
+    pipeline.run_job(job_id)
+    assert store.get_job(job_id)['status'] == PENDING
+    pipeline.run_job(job_id)
+
+    job = store.get_job(job_id)
+    assert len(calls) == 2
+    assert job['status'] == FAILED
+    assert job['stages']['pdf']['status'] == DONE
+    assert job['stages']['pdf']['attempts'] == 1
+    assert job['stages']['email']['attempts'] == 2
+    assert finished == [FAILED]
+
+
+def test_permanent_error_is_not_retried(store):
+    calls = []
+
+    def email(job_id, data, results):
+        calls.append(job_id)
+        raise PermanentStageError('delivery uncertain')
+
+    pipeline = make_pipeline(store, {'pdf': lambda *a: 'receipt.pdf', 'email': email, 'crm': lambda *a: None},
+                             max_attempts=3)
+    job_id = pipeline.submit({})
+    pipeline.run_job(job_id)
+    pipeline.run_job(job_id)
+
+    job = store.get_job(job_id)
+    assert calls == [job_id]
+    assert job['status'] == FAILED
+    assert job['stages']['email']['attempts'] == 3
+
+
+def test_dependent_stage_is_skipped_when_its_dependency_fails(store):
+    def pdf(job_id, data, results):
+        raise PermanentStageError('bad data')
+
+    def crm(job_id, data, results):
+        raise StageSkipped('Bloomerang disabled')
+
+    pipeline = make_pipeline(store, {'pdf': pdf, 'email': lambda *a: None, 'crm': crm})
+    job_id = pipeline.submit({})
+    pipeline.run_job(job_id)
+
+    stages = store.get_job(job_id)['stages']
+    assert stages['email']['status'] == SKIPPED
+    assert stages['crm']['status'] == SKIPPED
+
+
+def test_held_job_runs_only_after_release(store):
+    pipeline = make_pipeline(store, {})
+    job_id = pipeline.submit({}, hold=True)
+    assert store.get_job(job_id)['status'] == HELD
+    assert store.claim_next('w1', stale_after=600) is None
+
+    pipeline.release([job_id])
+    assert store.claim_next('w1', stale_after=600) == job_id
+
+
+def test_discarded_jobs_free_their_client_ids(store):
+    pipeline = make_pipeline(store, {})
+    pipeline.submit_many([('j1', {}, 'client-1')], hold=True)
+    assert store.find_by_client_ids(['client-1']) == {'client-1': 'j1'}
+
+    pipeline.discard(['j1'])
+    assert store.get_job('j1') is None
+    assert store.find_by_client_ids(['client-1']) == {}
+
+
+def test_discard_leaves_released_jobs_alone(store):
+    pipeline = make_pipeline(store, {})
+    pipeline.submit_many([('j1', {}, 'client-1')], hold=True)
+    pipeline.release(['j1'])
+    pipeline.discard(['j1'])
+    assert store.get_job('j1')['status'] == PENDING
+
+
+def test_held_job_of_a_dead_submitter_is_picked_up(store):
+    job_id = make_pipeline(store, {}).submit({}, hold=True)
+    time.sleep(0.05)
+    assert store.claim_next('w1', stale_after=0.01) == job_id
+
+
+def test_running_job_is_not_reclaimed_while_its_worker_is_alive(store):
+    started = threading.Event()
+    calls = []
+
+    def pdf(job_id, data, results):
+        calls.append(job_id)
+        started.set()
+        time.sleep(1)
+
+    pipeline = make_pipeline(store, {'pdf': pdf, 'email': lambda *a: None, 'crm': lambda *a: None},
+                             workers=1, stale_after=0.3, poll_interval=0.05)
+    pipeline.ensure_started()
+    try:
+        job_id = pipeline.submit({})
+        assert started.wait(5)
+        time.sleep(0.6)
+        assert store.claim_next('other-worker', stale_after=0.3) is None
+    finally:
+        pipeline.stop()
+
+    deadline = time.time() + 5
+    while store.get_job(job_id)['status'] != DONE and time.time() < deadline:
+        time.sleep(0.05)
+    assert store.get_job(job_id)['status'] == DONE
+    assert calls == [job_id]
+
+
+def test_abandoned_running_job_is_reclaimed(store):
+    job_id = make_pipeline(store, {}).submit({})
+    assert store.claim_next('dead-worker', stale_after=600) == job_id
+    time.sleep(0.05)
+    assert store.claim_next('w2', stale_after=0.01) == job_id
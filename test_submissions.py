@@ -0,0 +1,164 @@
+"""
+Donation submission endpoints: idempotent retries, batch dedup and failure paths that must not
+record a donation twice, and transaction posts that must not reach Bloomerang twice
+Run with: python -m pytest test_submissions.py
+"""
+
+import importlib
+import os
+
+import pytest
+
+from fake_services import FakeBloomerang
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    """The app with every data file in a temporary directory and no background job workers"""
+    directory = tmp_path_factory.mktemp('app')
+    previous_dir = os.getcwd()
+    previous_env = dict(os.environ)
+    os.chdir(directory)
+    os.environ.update({'JOB_WORKERS': '0', 'METRICS_DB_FILE': '', 'CRM_SYNC_RETRY_DELAY': '0',
+                       'DONOR_STORE_BACKEND': 'csv', 'BLOOMERANG_ENABLED': 'false'})
+    try:
+        module = importlib.import_module('app')
+        yield module
+    finally:
+        module.pipeline.stop()
+        os.environ.clear()
+        os.environ.update(previous_env)
+        os.chdir(previous_dir)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def donation(**overrides):
+    data = {
+        'firstName': 'Ada',
+        'lastName': 'Lovelace',
+        'email': 'ada@example.com',
+        'phone': '(555) 123-4567',
+        'address': '1 Main St',
+        'donationType': 'merchandise',
+        'merchandiseItems': ['Clothing', 'Books'],
+        'donationDate': '2026-01-15',
+        'location': 'Main Office'
+    }
+    data.update(overrides)
+    return data
+
+
+def stored_rows(app_module):
+    return sum(1 for _ in app_module.donor_store.iter_rows())
+
+
+def fail(*args, **kwargs):
+    raise IOError('disk full')
+
+
+def test_resent_batch_is_recorded_once(app_module, client):
+    before = stored_rows(app_module)
+    batch = [donation(clientId='resend-1'), donation(clientId='resend-2'), donation(email='', clientId='resend-3')]
+
+    first = client.post('/api/submit-donations/batch', json=batch).get_json()
+    second = client.post('/api/submit-donations/batch', json=batch).get_json()
+
+    assert first['counts'] == {'created': 2, 'duplicate': 0, 'invalid': 1}
+    assert second['counts'] == {'created': 0, 'duplicate': 2, 'invalid': 1}
+    assert [r['jobId'] for r in second['results'][:2]] == [r['jobId'] for r in first['results'][:2]]
+    assert stored_rows(app_module) == before + 2
+
+
+def test_failed_batch_write_leaves_nothing_behind(app_module, client, monkeypatch):
+    before = stored_rows(app_module)
+    batch = [donation(clientId='fail-1'), donation(clientId='fail-2')]
+
+    with monkeypatch.context() as patch:
+        patch.setattr(app_module.donor_store, 'append_many', fail)
+        response = client.post('/api/submit-donations/batch', json=batch)
+    assert response.status_code == 500
+    assert app_module.job_store.find_by_client_ids(['fail-1', 'fail-2']) == {}
+
+    retried = client.post('/api/submit-donations/batch', json=batch).get_json()
+    assert retried['counts']['created'] == 2
+    assert stored_rows(app_module) == before + 2
+
+
+def test_failed_batch_job_insert_writes_no_rows(app_module, client, monkeypatch):
+    before = stored_rows(app_module)
+    monkeypatch.setattr(app_module.job_store, 'create_jobs', fail)
+    response = client.post('/api/submit-donations/batch', json=[donation(clientId='jobs-down-1')])
+    assert response.status_code == 500
+    assert stored_rows(app_module) == before
+
+
+def test_retry_after_failed_write_records_the_donation_once(app_module, client, monkeypatch):
+    before = stored_rows(app_module)
+    headers = {'Idempotency-Key': 'retry-after-failed-write'}
+
+    with monkeypatch.context() as patch:
+        patch.setattr(app_module.donor_store, 'append_many', fail)
+        assert client.post('/api/submit-donation', json=donation(), headers=headers).status_code == 500
+    assert stored_rows(app_module) == before
+
+    created = client.post('/api/submit-donation', json=donation(), headers=headers)
+    replayed = client.post('/api/submit-donation', json=donation(), headers=headers)
+
+    assert created.status_code == 200
+    assert replayed.headers.get('Idempotent-Replayed') == 'true'
+    assert replayed.get_json()['jobId'] == created.get_json()['jobId']
+    assert stored_rows(app_module) == before + 1
+
+
+def test_failed_job_insert_writes_no_row(app_module, client, monkeypatch):
+    before = stored_rows(app_module)
+    monkeypatch.setattr(app_module.job_store, 'create_jobs', fail)
+    assert client.post('/api/submit-donation', json=donation()).status_code == 500
+    assert stored_rows(app_module) == before
+
+
+def test_failed_job_release_still_records_the_donation(app_module, client, monkeypatch):
+    before = stored_rows(app_module)
+    monkeypatch.setattr(app_module.job_store, 'release_jobs', fail)
+    response = client.post('/api/submit-donation', json=donation())
+    assert response.status_code == 200
+    assert app_module.job_store.get_job(response.get_json()['jobId'])['status'] == 'held'
+    assert stored_rows(app_module) == before + 1
+
+
+class SavedThenFailingBloomerang(FakeBloomerang):
+    """Saves the first transaction posted but answers 503, like a gateway timing out after the write"""
+
+    def handle(self, method, path, query, headers, body):
+        status, payload, extra = super().handle(method, path, query, headers, body)
+        if method == 'POST' and path == '/v2/transaction' and self.stats.get('transactions_created') == 1:
+            return 503, {'Message': 'Service unavailable'}, extra
+        return status, payload, extra
+
+
+@pytest.fixture
+def bloomerang(app_module, monkeypatch):
+    fake = SavedThenFailingBloomerang().start()
+    monkeypatch.setitem(app_module.BLOOMERANG_CONFIG, 'api_url', fake.api_url)
+    monkeypatch.setitem(app_module.BLOOMERANG_CONFIG, 'api_key', 'test-key')
+    yield fake
+    fake.stop()
+
+
+def test_transaction_saved_before_a_5xx_is_not_posted_again(app_module, bloomerang):
+    constituent = bloomerang.add_constituent('Ada', 'Lovelace', 'ada@example.com')
+    outbox = app_module.crm_outbox
+    outbox.enqueue('txn-record-1', donation())
+    entries = outbox.claim_batch('test-worker', 100)
+    outbox.complete([entry['id'] for entry in entries], constituent['Id'], {'constituent_id': constituent['Id']})
+
+    app_module.transaction_batcher.flush()
+    assert outbox.get('txn-record-1')['transactionId'] is None
+    app_module.transaction_batcher.flush()
+
+    assert len(bloomerang.transactions) == 1
+    assert outbox.get('txn-record-1')['transactionId'] == next(iter(bloomerang.transactions))